@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from src import processing, metrics
+from src.pipeline import run_pipeline
+from src.database_handler import database_profile
+from src.processing import process_file, build_dataframe, build_graph, establish_connection, \
+    get_rollup_table_name, create_ledger_if_not_exist, default_chunk_size, load_modes, refresh_dataframe, \
+    create_touched_months_if_not_exist, get_touched_month_query
+from benchmarks.generator import generate_invoices, write_invoices
+# name of the table the benchmarks load
+benchmark_table = 'benchmark_invoices'
+results_path = os.path.normpath(os.path.dirname(__file__) + os.path.join('/results'))
+# file types loaded by the benchmarks, the columnar ones only when pyarrow is installed
+file_types = ('csv', 'json', 'ndjson') + (processing.columnar_types if processing.pyarrow else ())
+
+
+def measure(function, repeat: int, setup=None) -> list:
+    """
+    timing the function repeat times, the setup (not timed) runs before every call
+    :param function: the measured function, without arguments
+    :param repeat: number of calls
+    :param setup: function without arguments, None for no setup
+    :return: list of seconds of every call
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def summarize(seconds: list, rows: int) -> dict:
+    """
+    the latency of the calls and the throughput of the median call
+    :param seconds: list from measure
+    :param rows: number of rows handled by every call
+    :return: dict of the statistics
+    """
+    ordered = sorted(seconds)
+    median = statistics.median(ordered)
+    return {
+        'calls': len(ordered),
+        'rows': rows,
+        'min_seconds': ordered[0],
+        'median_seconds': median,
+        'mean_seconds': statistics.mean(ordered),
+        'p95_seconds': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'rows_per_second': rows / max(median, 1e-9),
+    }
+
+
+def drop_tables(database_connection, table_name: str) -> None:
+    """
+    dropping the table and its rollup and forgetting its files in the ingest ledger and its touched months,
+    so every load starts from an empty database
+    :param database_connection: DatabaseHandler instance
+    :param table_name: table name
+    """
+    database_connection.clear_table('''DROP TABLE IF EXISTS ''' + table_name)
+    database_connection.clear_table('''DROP TABLE IF EXISTS ''' + get_rollup_table_name(table_name))
+    create_ledger_if_not_exist(database_connection)
+    database_connection.clear_table(f"DELETE FROM ingest_ledger WHERE table_name = '{table_name}'")
+    create_touched_months_if_not_exist(database_connection)
+    database_connection.clear_table(f"DELETE FROM touched_months WHERE table_name = '{table_name}'")
+
+
+def run_benchmarks(rows: int = 100000, customers: int = 59, months: int = 60, duplicate_ratio: float = 0.05,
+                   repeat: int = 5, processes: int = 0, chunk_size: int = default_chunk_size,
+                   end_to_end: bool = True) -> dict:
+    """
+    generating one file of rows invoices for every one of file_types, then measuring every stage on its own,
+    process_file of every file, build_dataframe (from the rollup, grouped in sqlite and grouped in pandas),
+    refresh_dataframe with one touched month, build_graph, and the whole pipeline over the memory broker
+    (see pipeline.py), loading the files then running them again, already in the ingest ledger
+    everything runs on a database of its own in a temporary directory, the figures too, and no metrics file is written
+    :param rows: number of rows in every file
+    :param customers: number of distinct customers
+    :param months: number of months the invoices spread over
+    :param duplicate_ratio: share of the rows repeating other rows
+    :param repeat: number of calls of every stage
+    :param processes: number of database consumer processes of the pipeline, 0 for a thread
+    :param chunk_size: number of rows per transaction
+    :param end_to_end: either run the pipeline or only the stages
+    :return: dict of the parameters, the environment and the statistics of every stage
+    """
+    work_path = tempfile.mkdtemp(prefix='invoices_benchmark_')
+    stages = {}
+    try:
+        dataframe = generate_invoices(rows, customers, months, duplicate_ratio)
+        files = [[write_invoices(dataframe, os.path.join(work_path, 'invoices.' + file_type), file_type),
+                  file_type, benchmark_table] for file_type in file_types]
+        database_connection = establish_connection(os.path.join(work_path, 'benchmark.db'), persistent=True,
+                                                   profile=database_profile)
+        for file_path, file_type, table_name in files:
+            stages[f'process_file_{file_type}'] = summarize(measure(
+                lambda: process_file(file_path, file_type, table_name, chunk_size, database_connection),
+                repeat, lambda: drop_tables(database_connection, table_name)), rows)
+
+        for name, options in [('build_dataframe', {}), ('build_dataframe_sql', {'use_rollup': False}),
+                              ('build_dataframe_pandas', {'use_rollup': False, 'aggregate_in_sql': False})]:
+            stages[name] = summarize(measure(
+                lambda: build_dataframe(benchmark_table, database_connection=database_connection, **options),
+                repeat), rows)
+
+        # the graph of the table is cached, then one month is touched before every refresh
+        graph_dataframe = refresh_dataframe(benchmark_table, database_connection)
+        stages['refresh_dataframe_one_month'] = summarize(measure(
+            lambda: refresh_dataframe(benchmark_table, database_connection), repeat,
+            lambda: database_connection.transaction_select(
+                [(get_touched_month_query(), [(benchmark_table, graph_dataframe['InvoiceDate'].iloc[-1])])],
+                '''SELECT changes()''')), 1)
+
+        for name, options in [('build_graph', {'skip_unchanged': False}),
+                              ('build_graph_inline', {'skip_unchanged': False, 'render_mode': 'inline'}),
+                              ('build_graph_unchanged', {})]:
+            stages[name] = summarize(measure(
+                lambda: build_graph(graph_dataframe, os.path.join(work_path, name, 'figure.html'), False, **options),
+                repeat), len(graph_dataframe))
+        database_connection.close()
+
+        if end_to_end:
+            pipeline_path = os.path.join(work_path, 'pipeline.db')
+            pipeline_connection = establish_connection(pipeline_path, persistent=True, profile=database_profile)
+            saved = processing.graph_auto_open, processing.figure_directory, metrics.metrics_directory
+            processing.graph_auto_open = False
+            processing.figure_directory = os.path.join(work_path, 'figures')
+            metrics.metrics_directory = None
+            try:
+                stages['end_to_end'] = summarize(measure(
+                    lambda: run_pipeline(files, processes, chunk_size=chunk_size, _database_path=pipeline_path),
+                    repeat, lambda: drop_tables(pipeline_connection, benchmark_table)), rows * len(files))
+                # the files of the last run are in the ingest ledger, running them again skips the loading
+                stages['end_to_end_rerun'] = summarize(measure(
+                    lambda: run_pipeline(files, processes, chunk_size=chunk_size, _database_path=pipeline_path),
+                    repeat), rows * len(files))
+            finally:
+                processing.graph_auto_open, processing.figure_directory, metrics.metrics_directory = saved
+                pipeline_connection.close()
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+    return {
+        'parameters': {'rows': rows, 'customers': customers, 'months': months, 'duplicate_ratio': duplicate_ratio,
+                       'repeat': repeat, 'processes': processes, 'chunk_size': chunk_size},
+        'environment': get_environment(),
+        'stages': stages,
+    }
+
+
+def run_load_benchmarks(rows: int = 2000000, customers: int = 5000, months: int = 60, duplicate_ratio: float = 0.05,
+                        repeat: int = 3, chunk_size: int = default_chunk_size, modes: tuple = load_modes) -> dict:
+    """
+    generating one csv file of rows invoices, then measuring process_file with every load mode,
+    loading the file into an empty table, and loading it again into the full table (every row is a duplicate)
+    :param rows: number of rows in the file
+    :param customers: number of distinct customers
+    :param months: number of months the invoices spread over
+    :param duplicate_ratio: share of the rows repeating other rows
+    :param repeat: number of calls of every stage
+    :param chunk_size: number of rows per transaction
+    :param modes: load modes to measure, see processing.load_modes
+    :return: dict of the parameters, the environment and the statistics of every stage
+    """
+    work_path = tempfile.mkdtemp(prefix='invoices_benchmark_')
+    stages = {}
+    try:
+        file_path = write_invoices(generate_invoices(rows, customers, months, duplicate_ratio),
+                                   os.path.join(work_path, 'invoices.csv'), 'csv')
+        for load_mode in modes:
+            database_connection = establish_connection(os.path.join(work_path, load_mode + '.db'), persistent=True,
+                                                       profile=database_profile)
+            stages[f'load_{load_mode}'] = summarize(measure(
+                lambda: process_file(file_path, 'csv', benchmark_table, chunk_size, database_connection,
+                                     load_mode=load_mode),
+                repeat, lambda: drop_tables(database_connection, benchmark_table)), rows)
+            stages[f'reload_{load_mode}'] = summarize(measure(
+                lambda: process_file(file_path, 'csv', benchmark_table, chunk_size, database_connection,
+                                     load_mode=load_mode), repeat), rows)
+            database_connection.close()
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+    return {
+        'parameters': {'rows': rows, 'customers': customers, 'months': months, 'duplicate_ratio': duplicate_ratio,
+                       'repeat': repeat, 'chunk_size': chunk_size, 'modes': list(modes)},
+        'environment': get_environment(),
+        'stages': stages,
+    }
+
+
+def get_environment() -> dict:
+    """
+    :return: dict of the commit and the machine the results belong to
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+def save_results(results: dict, file_path: str = None) -> str:
+    """
+    saving the results as json, by default in benchmarks/results named after the commit
+    :param results: dict from run_benchmarks
+    :param file_path: path of the json file, None for the default
+    :return: the file path
+    """
+    if file_path is None:
+        file_path = os.path.join(results_path, f"{results['environment']['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, 'w') as file:
+        json.dump(results, file, indent=4)
+    return file_path
+
+
+def compare_results(baseline: dict, results: dict) -> dict:
+    """
+    comparing the median latency of every stage with the baseline results
+    :param baseline: dict from run_benchmarks (or its saved json) of an older commit
+    :param results: dict from run_benchmarks
+    :return: dict of stage name -> current median / baseline median, above 1 is slower
+    """
+    return {name: stage['median_seconds'] / max(baseline['stages'][name]['median_seconds'], 1e-9)
+            for name, stage in results['stages'].items() if name in baseline['stages']}
+
+
+def main(arguments: list = None) -> dict:
+    """
+    running the benchmarks from the command line, printing and saving the results
+    :param arguments: list of the command line arguments, None for sys.argv
+    :return: dict from run_benchmarks or run_load_benchmarks
+    """
+    parser = argparse.ArgumentParser(description='benchmarking the stages of the pipeline')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--customers', type=int, default=59)
+    parser.add_argument('--months', type=int, default=60)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--processes', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=default_chunk_size)
+    parser.add_argument('--no-end-to-end', action='store_true')
+    parser.add_argument('--load-modes', action='store_true',
+                        help='only compare the load modes of process_file, on a single csv file')
+    parser.add_argument('--output', help='json file of the results, benchmarks/results/<commit>.json by default')
+    parser.add_argument('--compare', help='json file of the results of an older commit')
+    options = parser.parse_args(arguments)
+    if options.load_modes:
+        results = run_load_benchmarks(options.rows, options.customers, options.months, options.duplicate_ratio,
+                                      options.repeat, options.chunk_size)
+    else:
+        results = run_benchmarks(options.rows, options.customers, options.months, options.duplicate_ratio,
+                                 options.repeat, options.processes, options.chunk_size, not options.no_end_to_end)
+    for name, stage in results['stages'].items():
+        print(f"{name:24} median {stage['median_seconds'] * 1000:10.1f} ms  "
+              f"p95 {stage['p95_seconds'] * 1000:10.1f} ms  {stage['rows_per_second']:14.0f} rows/s")
+    print(f"Saved {save_results(results, options.output)}")
+    if options.compare:
+        with open(options.compare) as file:
+            for name, ratio in compare_results(json.load(file), results).items():
+                print(f"{name:24} {ratio:6.2f}x the baseline median")
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
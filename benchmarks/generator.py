@@ -0,0 +1,81 @@
+import os
+import json
+import numpy
+import pandas
+# (address, city, state, country, postal code) of the generated customers
+billing_addresses = [
+    ("421 Bourke Street", "Sidney", "NSW", "Australia", "2010"),
+    ("Rua Dr. Falcão Filho, 155", "São Paulo", "SP", "Brazil", "01007-010"),
+    ("Av. Paulista, 2022", "São Paulo", "SP", "Brazil", "01310-200"),
+    ("Qe 7 Bloco G", "Brasília", "DF", "Brazil", "71020-677"),
+    ("Theodor-Heuss-Straße 34", "Stuttgart", "", "Germany", "70174"),
+    ("Ullevålsveien 14", "Oslo", "", "Norway", "0171"),
+    ("1600 Amphitheatre Parkway", "Mountain View", "CA", "USA", "94043-1351"),
+    ("700 W Pender Street", "Vancouver", "BC", "Canada", "V6C 1G8"),
+    ("8, Rue Hanovre", "Paris", "", "France", "75002"),
+    ("113 Lupus St", "London", "", "United Kingdom", "SW1V 3EN"),
+]
+columns = ['InvoiceId', 'CustomerId', 'InvoiceDate', 'BillingAddress', 'BillingCity', 'BillingState',
+           'BillingCountry', 'BillingPostalCode', 'Total']
+
+
+def generate_invoices(rows: int, customers: int = 59, months: int = 12, duplicate_ratio: float = 0.0,
+                      start: str = '2009-01-01', seed: int = 0) -> pandas.DataFrame:
+    """
+    generating realistic invoices, every customer always billed at the same address,
+    the dates spread over months months and the totals log-normal like real invoices,
+    a duplicate_ratio of the rows repeat other rows as is, next to them (the database ignores them)
+    :param rows: number of rows, duplicates included
+    :param customers: number of distinct customers
+    :param months: number of months from start
+    :param duplicate_ratio: share of the rows repeating earlier rows, 0 to 1
+    :param start: date of the first invoice
+    :param seed: seed of the random generator, the same seed gives the same invoices
+    :return: dataframe with the invoice columns, the same order as the files
+    """
+    generator = numpy.random.default_rng(seed)
+    duplicates = int(rows * duplicate_ratio) if rows > 1 else 0
+    unique_rows = rows - duplicates
+    customer_ids = generator.integers(1, customers + 1, unique_rows)
+    addresses = pandas.DataFrame(billing_addresses, columns=columns[3:8]).iloc[customer_ids % len(billing_addresses)]
+    first_day = pandas.Timestamp(start)
+    last_day = first_day + pandas.DateOffset(months=months)
+    days = generator.integers(0, max((last_day - first_day).days, 1), unique_rows)
+    dataframe = pandas.DataFrame({
+        'InvoiceId': numpy.arange(1, unique_rows + 1),
+        'CustomerId': customer_ids,
+        'InvoiceDate': (first_day + pandas.to_timedelta(numpy.sort(days), unit='D')).strftime('%Y-%m-%d %H:%M:%S'),
+        **{column: addresses[column].to_numpy() for column in columns[3:8]},
+        'Total': generator.lognormal(6, 1, unique_rows).round(2),
+    })
+    if duplicates:
+        dataframe = pandas.concat([dataframe, dataframe.sample(duplicates, replace=True, random_state=seed)])
+        dataframe = dataframe.sort_values('InvoiceId', kind='stable').reset_index(drop=True)
+    return dataframe[columns]
+
+
+def write_invoices(dataframe: pandas.DataFrame, file_path: str, file_type: str) -> str:
+    """
+    writing the invoices in the format of the source files,
+    csv with a header line, json as a single array of objects with string values,
+    ndjson as one object with string values on every line, parquet and arrow (ipc file) with typed columns
+    :param dataframe: dataframe from generate_invoices
+    :param file_path: path of the new file
+    :param file_type: CSV/JSON/NDJSON/PARQUET/ARROW
+    :return: the file path
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    if "csv" == file_type:
+        dataframe.to_csv(file_path, index=False)
+    elif "json" == file_type:
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump(dataframe.astype(str).to_dict(orient='records'), file, indent=4, ensure_ascii=False)
+    elif "ndjson" == file_type:
+        dataframe.astype(str).to_json(file_path, orient='records', lines=True, force_ascii=False)
+    elif "parquet" == file_type:
+        dataframe.assign(InvoiceDate=pandas.to_datetime(dataframe['InvoiceDate'])).to_parquet(file_path, index=False)
+    elif "arrow" == file_type:
+        dataframe.assign(InvoiceDate=pandas.to_datetime(dataframe['InvoiceDate'])).to_feather(file_path)
+    else:
+        raise ValueError(f"unknown file type {file_type}")
+    return file_path
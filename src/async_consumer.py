@@ -0,0 +1,220 @@
+import abc
+import time
+import pika
+import sqlite3
+import asyncio
+import functools
+import concurrent.futures
+from pika.adapters.asyncio_connection import AsyncioConnection
+from src.message import decode_message, encode_message
+from src.metrics import increment, observe_queue_wait, start_exporter
+from src import processing
+from src.dashboard import start_server, stop_server
+from src.processing import ingest_message, default_chunk_size, get_thread_connection, refresh_graph
+# number of messages handled concurrently by every asyncio consumer
+default_concurrency = 4
+
+
+class AsyncConsumer(abc.ABC):
+    queue = None
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, concurrency: int = default_concurrency,
+                 executor: concurrent.futures.Executor = None):
+        """
+        initiating the class, creating the asyncio connection to pika (rabbitmq python's module)
+        the broker I/O runs on the event loop, while up to concurrency messages are handled at once,
+        their blocking work (parsing, sqlite, plotly) is offloaded to the executor
+        :param loop: the event loop shared by all the consumers of the process
+        :param concurrency: number of messages handled concurrently, also the prefetch count
+        :param executor: executor of the blocking work, a threads pool of concurrency threads by default
+        """
+        self.loop = loop
+        self.concurrency = concurrency
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.channel = None
+        self.connection = self.connect()
+
+    def connect(self):
+        """
+        opening the connection to the broker on the event loop, the channel is opened once it's open
+        :return: pika.adapters.asyncio_connection.AsyncioConnection
+        """
+        return AsyncioConnection(pika.ConnectionParameters(host='localhost'),
+                                 on_open_callback=self.on_connection_open,
+                                 on_open_error_callback=self.on_connection_closed,
+                                 on_close_callback=self.on_connection_closed,
+                                 custom_ioloop=self.loop)
+
+    def on_connection_open(self, connection):
+        """
+        the connection is open, opening the channel
+        :type connection: pika.adapters.asyncio_connection.AsyncioConnection
+        """
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_closed(self, connection, error):
+        """
+        the connection failed or was closed, stopping the event loop
+        :type connection: pika.adapters.asyncio_connection.AsyncioConnection
+        :param error: the reason of the closing
+        """
+        print(f"{type(self).__name__} connection closed: ", error)
+        self.loop.stop()
+
+    def on_channel_open(self, channel):
+        """
+        the channel is open, declaring both queues, i can do this because the 'queue_declare' is idempotent
+        then consuming with at most concurrency unacknowledged messages
+        :type channel: pika.channel.Channel
+        """
+        self.channel = channel
+        channel.queue_declare(queue='files_to_database')
+        channel.queue_declare(queue='database_to_graph')
+        channel.basic_qos(prefetch_count=self.concurrency)
+        channel.basic_consume(queue=self.queue, on_message_callback=self.on_message, auto_ack=False)
+        print(f"{type(self).__name__} is Waiting for messages. To exit press CTRL+C")
+
+    def on_message(self, channel, method, properties, body):
+        """
+        when the queue is receiving data the callback method is invoked, on the event loop,
+        handing the message to a task and returning at once
+        :param channel: channel of communication
+        :type channel: pika.channel.Channel
+        :param method: used to acknowledge the message
+        :type method: pika.spec.Basic.Deliver
+        :param properties: user-defined properties on the message
+        :type properties: pika.spec.BasicProperties
+        :type body: bytes
+        """
+        self.loop.create_task(self.handle(method.delivery_tag, method.redelivered, body))
+
+    async def handle(self, delivery_tag: int, redelivered: bool, body: bytes):
+        """
+        running the blocking work of the message in the executor, then acknowledging it on the event loop
+        a failed transaction is delivered again, an unexpected failure is tried once more,
+        then dropped to avoid a poison message loop
+        :param delivery_tag: tag of the message to acknowledge
+        :param redelivered: either the message was already delivered once or not
+        :type body: bytes
+        """
+        async with self.semaphore:
+            try:
+                await self.work(body)
+                self.channel.basic_ack(delivery_tag=delivery_tag)
+                increment('invoices_messages_total', consumer=type(self).__name__, outcome='acknowledged')
+            except sqlite3.OperationalError as e:
+                print("Loading failed, delivering the message again: ", e)
+                self.channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+                increment('invoices_messages_total', consumer=type(self).__name__, outcome='requeued')
+            except Exception as e:
+                print("Processing failed: ", e)
+                self.channel.basic_nack(delivery_tag=delivery_tag, requeue=not redelivered)
+                increment('invoices_messages_total', consumer=type(self).__name__, outcome='failed')
+
+    @abc.abstractmethod
+    async def work(self, body: bytes):
+        """
+        the work of one message, implemented by every stage
+        :type body: bytes
+        """
+
+    def run_blocking(self, function, *args, **kwargs):
+        """
+        :param function: blocking function
+        :return: awaitable of the function results, run in the executor
+        """
+        return self.loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+
+class AsyncDatabaseConsumer(AsyncConsumer):
+    queue = 'files_to_database'
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, concurrency: int = default_concurrency,
+                 executor: concurrent.futures.Executor = None, chunk_size: int = default_chunk_size,
+                 skip_ingested: bool = True):
+        """
+        receiving the path to read the files,
+        after processing the files publishing to the second queue the ok
+        :param loop: the event loop shared by all the consumers of the process
+        :param concurrency: number of files loaded concurrently
+        :param executor: executor of the parsing and the inserting
+        :param chunk_size: number of rows per transaction, 0 to load every file at once
+        :param skip_ingested: either send the files already in the ingest ledger straight to the graph or load them
+        """
+        self.chunk_size = chunk_size
+        self.skip_ingested = skip_ingested
+        super().__init__(loop, concurrency, executor)
+
+    async def work(self, body: bytes):
+        """
+        loading the file (or the shard) in the executor, then publishing the ok for the graph
+        once the whole file is committed
+        :type body: bytes
+        """
+        message = decode_message(body)
+        print(f"AsyncDatabaseConsumer received {message.file_type} file")
+        observe_queue_wait(message.enqueued_at, self.queue)
+        if await self.run_blocking(self.load, message):
+            self.channel.basic_publish(exchange='', routing_key='database_to_graph', body=encode_message(
+                message._replace(byte_start=0, byte_end=0, enqueued_at=time.time())))
+
+    def load(self, message) -> bool:
+        """
+        runs in the executor, with the persistent database connection of the executor thread
+        :param message: the decoded message of the file
+        :return: boolean from ingest_message - true if the graph should be notified
+        """
+        return ingest_message(message, self.chunk_size, get_thread_connection(), self.skip_ingested)
+
+
+class AsyncGraphConsumer(AsyncConsumer):
+    queue = 'database_to_graph'
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, concurrency: int = default_concurrency,
+                 executor: concurrent.futures.Executor = None):
+        """
+        receiving the ok to create or update the graph,
+        the graphs of different tables are rebuilt concurrently, the graph of one table one rebuild at a time
+        :param loop: the event loop shared by all the consumers of the process
+        :param concurrency: number of graphs rebuilt concurrently
+        :param executor: executor of the aggregating and the rendering
+        """
+        self.locks = {}
+        super().__init__(loop, concurrency, executor)
+
+    async def work(self, body: bytes):
+        """
+        rebuilding the graph of the table in the executor
+        :type body: bytes
+        """
+        message = decode_message(body)
+        table_name = message.table_name
+        print(f"AsyncGraphConsumer received the name of the database: {table_name}")
+        observe_queue_wait(message.enqueued_at, self.queue)
+        async with self.locks.setdefault(table_name, asyncio.Lock()):
+            await self.run_blocking(lambda: refresh_graph(table_name, get_thread_connection()))
+
+
+def run(concurrency: int = default_concurrency):
+    """
+    running both stages in one process, on one event loop, so the broker I/O,
+    the sqlite I/O and the parsing of different messages overlap
+    :param concurrency: number of messages handled concurrently by every stage
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    AsyncDatabaseConsumer(loop, concurrency)
+    AsyncGraphConsumer(loop, concurrency)
+    exporter = start_exporter('async_consumer')
+    server = start_server() if 'dashboard' == processing.graph_output else None
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+        exporter.write()
+        stop_server(server)
+
+
+if __name__ == '__main__':
+    run()
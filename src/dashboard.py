@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import threading
+import functools
+import webbrowser
+import http.server
+import pandas
+import plotly.offline
+# directory of the dashboard page and of the data file of every table
+dashboard_directory = os.path.normpath(os.path.dirname(__file__) + os.path.join('/database/dashboard'))
+# port of the http server of the graph consumer serving the dashboard directory, 0 for none
+dashboard_port = 8050
+# seconds between two polls of the data file by the page
+dashboard_poll_interval = 1.0
+# the page, written once, polling the data file of the table in its query string (index.html?table=invoices)
+# a new version carrying the previous version patches only its changed months, any other version replaces them all
+dashboard_page = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Invoices Dashboard</title>
+<script src="plotly.min.js"></script>
+</head>
+<body>
+<div id="graph" style="width:100%;height:95vh"></div>
+<script>
+const table = new URLSearchParams(window.location.search).get('table') || 'invoices';
+const rows = {};
+let version = 0;
+
+function apply(data) {
+    const months = data.previous_version === version ? data.changed : Object.keys(rows).concat(data.months);
+    const positions = new Map(data.months.map((month, index) => [month, index]));
+    for (const month of months) {
+        if (positions.has(month)) {
+            rows[month] = [data.counts[positions.get(month)], data.totals[positions.get(month)]];
+        } else {
+            delete rows[month];
+        }
+    }
+    version = data.version;
+    const dates = Object.keys(rows).sort();
+    Plotly.react('graph', [
+        {x: dates, y: dates.map(month => rows[month][1]), type: 'scatter', name: 'Totals', yaxis: 'y'},
+        {x: dates, y: dates.map(month => rows[month][0]), type: 'bar', name: 'Counts', yaxis: 'y2'}
+    ], {
+        title: table, datarevision: version, xaxis: {anchor: 'y2', type: 'category'},
+        yaxis: {domain: [0.55, 1], title: 'Totals per Month'},
+        yaxis2: {domain: [0, 0.45], title: 'Counts per New Customers'}
+    });
+}
+
+async function poll() {
+    try {
+        const response = await fetch(table + '.json?' + Date.now(), {cache: 'no-store'});
+        if (response.ok) {
+            const data = await response.json();
+            if (data.version !== version) {
+                apply(data);
+            }
+        }
+    } finally {
+        setTimeout(poll, POLL_INTERVAL);
+    }
+}
+
+poll();
+</script>
+</body>
+</html>
+"""
+# the data files are read, diffed and written by one thread of the process at a time
+dashboard_lock = threading.Lock()
+# tables whose page was already opened by this process, every page is opened once
+opened_tables = set()
+# directories whose page was already written by this process
+written_directories = set()
+
+
+def update_dashboard(table_name: str, graph_dataframe: pandas.DataFrame, auto_open_flag: bool,
+                     directory: str = None) -> str:
+    """
+    writing the data file of the table with the months which changed since the last version,
+    nothing is written when no month changed, the page is written once and opened once
+    the last version is read from the data file itself, another process may have written it since
+    :param table_name: table name, the name of the data file
+    :param graph_dataframe: dataframe['InvoiceDate', 'Count', 'Total']
+    :param auto_open_flag: either open the page of the table (once) or not
+    :param directory: directory of the dashboard, dashboard_directory by default
+    :return: str of the update
+    """
+    directory = directory or dashboard_directory
+    write_page(directory)
+    months = {str(month): (int(count), float(total)) for month, count, total in
+              zip(graph_dataframe['InvoiceDate'], graph_dataframe['Count'], graph_dataframe['Total'])}
+    data_path = os.path.join(directory, table_name + '.json')
+    with dashboard_lock:
+        previous_months, previous_version = read_state(data_path)
+        changed = get_changed_months(previous_months, months)
+        if changed or not previous_version:
+            write_data(data_path, months, changed, get_next_version(previous_version), previous_version)
+    if auto_open_flag and table_name not in opened_tables:
+        opened_tables.add(table_name)
+        webbrowser.open(get_dashboard_url(table_name, directory))
+    if not changed and previous_version:
+        return "Dashboard Unchanged, Skipped the Data File"
+    return f"Updated {len(changed)} Months of the Dashboard"
+
+
+def get_changed_months(previous_months: dict, months: dict) -> list:
+    """
+    :param previous_months: dict of month -> (count, total) of the last version
+    :param months: dict of month -> (count, total) of the new version
+    :return: sorted list of the months added, changed or removed
+    """
+    return sorted(month for month in previous_months.keys() | months.keys()
+                  if previous_months.get(month) != months.get(month))
+
+
+def get_next_version(previous_version: int) -> int:
+    """
+    the versions only increase, even across processes and restarts, a version is the time in microseconds
+    (exact as a javascript number) unless the previous one is ahead of the clock
+    :param previous_version: version of the last data file, 0 for none
+    :return: int
+    """
+    return max(previous_version + 1, time.time_ns() // 1000)
+
+
+def read_state(data_path: str) -> tuple:
+    """
+    reading the last version, written by this process or by another one
+    :param data_path: path of the data file
+    :return: tuple of dict of month -> (count, total) and version, ({}, 0) without a readable file
+    """
+    try:
+        with open(data_path, encoding='utf-8') as file:
+            data = json.load(file)
+        return {month: (count, total) for month, count, total in
+                zip(data['months'], data['counts'], data['totals'])}, data['version']
+    except (OSError, ValueError, KeyError):
+        return {}, 0
+
+
+def write_data(data_path: str, months: dict, changed: list, version: int, previous_version: int) -> None:
+    """
+    writing the data file to a temporary file of the process then renaming it, the page never reads half a file
+    :param data_path: path of the data file
+    :param months: dict of month -> (count, total) of the version
+    :param changed: list of the months changed since the previous version
+    :param version: number of the version
+    :param previous_version: number of the version the changed months are relative to
+    """
+    dates = sorted(months)
+    temporary_path = f"{data_path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump({'version': version, 'previous_version': previous_version, 'changed': changed, 'months': dates,
+                   'counts': [months[month][0] for month in dates],
+                   'totals': [months[month][1] for month in dates]}, file)
+    os.replace(temporary_path, data_path)
+
+
+def write_page(directory: str) -> None:
+    """
+    writing the page and plotly.min.js once, the page again only when its content changed
+    :param directory: directory of the dashboard
+    """
+    if directory in written_directories:
+        return
+    os.makedirs(directory, exist_ok=True)
+    page = dashboard_page.replace('POLL_INTERVAL', str(int(dashboard_poll_interval * 1000)))
+    page_path = os.path.join(directory, 'index.html')
+    if os.path.isfile(page_path):
+        with open(page_path, encoding='utf-8') as file:
+            if file.read() == page:
+                page = None
+    if page:
+        with open(page_path, 'w', encoding='utf-8') as file:
+            file.write(page)
+    bundle_path = os.path.join(directory, 'plotly.min.js')
+    if not os.path.isfile(bundle_path):
+        with open(bundle_path, 'w', encoding='utf-8') as file:
+            file.write(plotly.offline.get_plotlyjs())
+    written_directories.add(directory)
+
+
+def get_dashboard_url(table_name: str, directory: str = None) -> str:
+    """
+    :param table_name: table name
+    :param directory: directory of the dashboard, dashboard_directory by default
+    :return: url of the page of the table, on the http server, or the file itself without a port
+    (browsers don't let a file page fetch the data file, serve it with dashboard_port)
+    """
+    if dashboard_port:
+        return f"http://127.0.0.1:{dashboard_port}/index.html?table={table_name}"
+    return f"file://{os.path.abspath(os.path.join(directory or dashboard_directory, 'index.html'))}?table={table_name}"
+
+
+class DashboardHandler(http.server.SimpleHTTPRequestHandler):
+    def end_headers(self):
+        """
+        the data files change all the time, the browser never caches them
+        """
+        self.send_header('Cache-Control', 'no-store')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        """
+        the polls are not printed
+        """
+
+
+def start_server(port: int = None, directory: str = None):
+    """
+    serving the dashboard directory from a thread
+    :param port: port of the http server, 0 for none, dashboard_port by default
+    :param directory: directory of the dashboard, dashboard_directory by default
+    :return: the http.server.ThreadingHTTPServer, None without a port or when the port is taken
+    """
+    port = dashboard_port if port is None else port
+    directory = directory or dashboard_directory
+    if not port:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    write_page(directory)
+    try:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', port),
+                                                 functools.partial(DashboardHandler, directory=directory))
+    except OSError as e:
+        print("Dashboard server failed: ", e)
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Dashboard on http://127.0.0.1:{server.server_address[1]}/index.html")
+    return server
+
+
+def stop_server(server) -> None:
+    """
+    :param server: the server from start_server, None for none
+    """
+    if server:
+        server.shutdown()
+        server.server_close()
@@ -1,23 +1,51 @@
-import pika
-from src.processing import process_file
+import os
+import time
+import sqlite3
+import functools
+import multiprocessing
+import concurrent.futures
+from src.message import Message, decode_message, encode_message, describe
+from src.database_handler import database_path
+from src.processing import ingest_message, default_chunk_size, get_thread_connection
+from src.transport import PikaTransport, MemoryTransport
+from src.metrics import increment, observe_queue_wait, start_exporter
+# number of unacknowledged messages the broker hands to every consumer
+default_prefetch_count = 1
+# either skip the files whose content is already in the ingest ledger or load every file again
+default_skip_ingested = True
+# number of consumer processes started by run_workers
+worker_count = os.cpu_count()
 
 
 class DatabaseConsumer:
-    def __init__(self):
+    def __init__(self, chunk_size: int = default_chunk_size, prefetch_count: int = default_prefetch_count,
+                 transport=None, skip_ingested: bool = default_skip_ingested, _database_path: str = database_path):
         """
         initiating the class, creating the connection to pika (rabbitmq python's module)
         receiving the path to read the files
         after processing the files publishing to the second queue the ok
+        the files are processed by a pool of prefetch_count threads, off the pika I/O thread,
+        so the heartbeats keep going through long loads, every thread keeps its own database connection
+        for the whole lifetime of the consumer
+        :param chunk_size: number of rows per transaction, 0 to load every file at once
+        :param prefetch_count: number of messages delivered to this consumer before it acknowledges them
+        :param transport: PikaTransport or MemoryTransport, a connection to the rabbitmq by default
+        :param skip_ingested: either send the files already in the ingest ledger straight to the graph or load them
+        :param _database_path: path to database the files are loaded into
         """
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host='localhost'))
-        self.channel = self.connection.channel()
+        self.database_path = _database_path
+        self.chunk_size = chunk_size
+        self.skip_ingested = skip_ingested
+        self.prefetch_count = prefetch_count
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=prefetch_count)
+        self.transport = transport or PikaTransport()
         self.declare()
         self.consume()
 
     def callback(self, channel, method, properties, body):
         """
         when the queue is receiving data the callback method is invoked
+        handing the message to the threads pool and returning at once to the pika I/O loop
         :param channel: channel of communication
         :type channel: pika.channel.BlockingChannel
         :param method: used to acknowledge the message
@@ -26,18 +54,57 @@ class DatabaseConsumer:
         :type properties: pika.spec.BasicProperties
         :type body: bytes
         """
-        data = body.decode().split(" ")
-        print(f"DatabaseConsumer received {data[1]} file")
-        process_file(data[0], data[1], data[2])
-        self.publish(bytes(data[2], encoding='utf-8'))
+        self.executor.submit(self.work, method.delivery_tag, method.redelivered, body)
+
+    def work(self, delivery_tag: int, redelivered: bool, body: bytes):
+        """
+        processing the file on a pool thread, then passing the publish and the acknowledgement
+        back to the pika I/O thread, the only thread allowed to use the channel
+        :param delivery_tag: tag of the message to acknowledge
+        :param redelivered: either the message was already delivered once or not
+        :type body: bytes
+        """
+        try:
+            message = decode_message(body)
+            print(f"DatabaseConsumer received {message.file_type} file")
+            observe_queue_wait(message.enqueued_at, 'files_to_database')
+            # a shard notifies the graph only when all the shards of its file are committed
+            complete = ingest_message(message, self.chunk_size, get_thread_connection(self.database_path),
+                                      self.skip_ingested)
+            self.transport.add_callback_threadsafe(functools.partial(self.finish, delivery_tag, message, complete))
+        except sqlite3.OperationalError as e:
+            # the database is locked or full, the committed chunks are loaded again as duplicates
+            print("Loading failed, delivering the message again: ", e)
+            increment('invoices_messages_total', consumer='database_consumer', outcome='requeued')
+            self.transport.add_callback_threadsafe(functools.partial(self.transport.nack, delivery_tag, requeue=True))
+        except Exception as e:
+            # an unexpected failure is tried once more, then dropped to avoid a poison message loop
+            print("Processing failed: ", e)
+            increment('invoices_messages_total', consumer='database_consumer', outcome='failed')
+            self.transport.add_callback_threadsafe(functools.partial(
+                self.transport.nack, delivery_tag, requeue=not redelivered))
+
+    def finish(self, delivery_tag: int, message: Message, complete: bool = True):
+        """
+        invoked on the pika I/O thread once the file is committed,
+        publishing the ok for the graph (the same message, enqueued again now) then acknowledging the message,
+        if the consumer crashes before the broker delivers the message again to another consumer
+        :param delivery_tag: tag of the message to acknowledge
+        :param message: the decoded message of the file
+        :param complete: either the whole file is committed, or only some of its shards or it can't be read
+        """
+        if complete:
+            self.publish(encode_message(message._replace(byte_start=0, byte_end=0, enqueued_at=time.time())))
+        self.transport.ack(delivery_tag)
+        increment('invoices_messages_total', consumer='database_consumer', outcome='acknowledged')
 
     def declare(self):
         """
         declaring both queues, i can do this because the 'queue_declare' is idempotent
         and it's important to declare here too because i can't really know which (consumer/producer) runs first
         """
-        self.channel.queue_declare(queue='files_to_database')
-        self.channel.queue_declare(queue='database_to_graph')
+        self.transport.declare('files_to_database')
+        self.transport.declare('database_to_graph')
 
     def publish(self, byte_string: bytes):
         """
@@ -46,24 +113,68 @@ class DatabaseConsumer:
         :type byte_string: bytes
         :return: str
         """
-        self.channel.basic_publish(exchange='', routing_key='database_to_graph', body=byte_string)
-        return f"Sent {byte_string.decode()}"
+        self.transport.publish('database_to_graph', byte_string)
+        return f"Sent {describe(byte_string)}"
 
     def consume(self):
         """
         consume means to listen to the queue forever until some data comes,
         then process it, then continue listening
+        the messages are acknowledged manually, at most prefetch_count of them are in flight
         """
-        self.channel.basic_consume(queue='files_to_database', on_message_callback=self.callback, auto_ack=True)
+        self.transport.qos(self.prefetch_count)
+        self.transport.consume('files_to_database', self.callback)
 
     def keep_consume(self):
         """
         this command gives the flag to start consuming, but never stops
         """
         print(' DatabaseConsumer is Waiting for messages. To exit press CTRL+C')
-        self.channel.start_consuming()
+        exporter = start_exporter('database_consumer')
+        try:
+            self.transport.start_consuming()
+        finally:
+            # the messages of unfinished files are not acknowledged, the broker delivers them again
+            # the database connections of the pool threads are closed with their threads
+            self.executor.shutdown(wait=True)
+            exporter.write()
 
 
-if __name__ == '__main__':
-    database_consumer = DatabaseConsumer()
+def start_worker(chunk_size: int, prefetch_count: int, broker=None, _database_path: str = database_path):
+    """
+    target of every worker process, each one with its own broker and database connections
+    :param chunk_size: number of rows per transaction
+    :param prefetch_count: number of messages delivered to the worker before it acknowledges them
+    :param broker: MemoryBroker shared by the processes, None for the rabbitmq
+    :param _database_path: path to database the files are loaded into
+    """
+    database_consumer = DatabaseConsumer(chunk_size, prefetch_count, MemoryTransport(broker) if broker else None,
+                                         _database_path=_database_path)
     database_consumer.keep_consume()
+
+
+def run_workers(count: int, chunk_size: int = default_chunk_size, prefetch_count: int = default_prefetch_count,
+                broker=None, wait: bool = True, _database_path: str = database_path) -> list:
+    """
+    running count consumers in processes (parsing is cpu bound), all listening to the same queue
+    so the backlog is drained across all cores, then waiting for them
+    :param count: number of worker processes
+    :param chunk_size: number of rows per transaction
+    :param prefetch_count: number of messages delivered to every worker before it acknowledges them
+    :param broker: MemoryBroker with multiprocessing queues, None for the rabbitmq
+    :param wait: either wait for the workers or return at once
+    :param _database_path: path to database the files are loaded into
+    :return: list of the worker processes
+    """
+    workers = [multiprocessing.Process(target=start_worker, args=(chunk_size, prefetch_count, broker, _database_path),
+                                       daemon=not wait) for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    if wait:
+        for worker in workers:
+            worker.join()
+    return workers
+
+
+if __name__ == '__main__':
+    run_workers(worker_count)
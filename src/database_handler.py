@@ -1,16 +1,46 @@
 import os
 import pandas
+import time
 import sqlite3
+from src.metrics import timer, observe, increment
 database_path = os.path.normpath(os.path.dirname(__file__) + os.path.join('/database/invoices.db'))
+# number of prepared statements sqlite3 keeps per connection
+statement_cache_size = 256
+# pragmas applied by connect, by performance profile name
+# 'default' - sqlite defaults, rollback journal, readers are blocked while a file is committed
+# 'balanced' - write ahead log, readers never block behind a writer, synced only at checkpoints
+#              a power loss can lose the last commits but never corrupts the database
+# 'durable' - write ahead log with every commit synced, nothing committed is ever lost
+# 'fast' - write ahead log without any sync, an os crash or a power loss can corrupt the database,
+#          only for databases which can be rebuilt from the files
+performance_profiles = {
+    'default': {},
+    'balanced': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -65536,
+                 'mmap_size': 268435456, 'temp_store': 'MEMORY'},
+    'durable': {'journal_mode': 'WAL', 'synchronous': 'FULL', 'cache_size': -65536,
+                'mmap_size': 268435456, 'temp_store': 'MEMORY'},
+    'fast': {'journal_mode': 'WAL', 'synchronous': 'OFF', 'cache_size': -262144,
+             'mmap_size': 1073741824, 'temp_store': 'MEMORY'}
+}
+# profile of both consumers, writing and reading the same database concurrently
+database_profile = 'balanced'
+# seconds a connection waits for a lock before raising 'database is locked'
+busy_timeout = 30.0
 
 
 class DatabaseHandler:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, persistent: bool = False, profile: str = 'default'):
         """
         initiating the database object
+        a persistent object keeps its connection (and its prepared statements and page cache)
+        after every query, until close is called explicitly
         :type db_path: str
+        :param persistent: either keep the connection open between queries or not
+        :param profile: name of the performance profile, a key of performance_profiles
         """
         self.path = db_path
+        self.persistent = persistent
+        self.profile = performance_profiles[profile]
         self.connection = None
 
     def get_path(self):
@@ -24,8 +54,12 @@ class DatabaseHandler:
         trying to connect to the database
         :return: -1 in case of exception
         """
+        if self.persistent and self.connection:
+            return self.connection
         try:
-            self.connection = sqlite3.connect(self.path)
+            self.connection = sqlite3.connect(self.path, timeout=busy_timeout, cached_statements=statement_cache_size)
+            for pragma, value in self.profile.items():
+                self.connection.execute(f'''PRAGMA {pragma} = {value}''')
             print("Database Connection Established")
             return self.connection
         except sqlite3.Error as e:
@@ -38,11 +72,45 @@ class DatabaseHandler:
         """
         if self.connection:
             self.connection.close()
+            self.connection = None
             print("Database Connection Closed")
 
+    def release(self):
+        """
+        closing the connection at the end of a query, unless the object is persistent
+        """
+        if not self.persistent:
+            self.close()
+
+    def reconnect(self):
+        """
+        closing the connection whatever its state is, then connecting again
+        :return: the new connection, 0 in case of exception
+        """
+        try:
+            self.close()
+        except sqlite3.Error as e:
+            print("Closing failed: ", e.args[0])
+            self.connection = None
+        return self.connect()
+
+    def ensure_connection(self):
+        """
+        checking the connection is still usable with a cheap query, reconnecting if it isn't
+        :return: the usable connection, 0 in case of exception
+        """
+        if not self.connection:
+            return self.connect()
+        try:
+            self.connection.execute('''SELECT 1''')
+            return self.connection
+        except sqlite3.Error as e:
+            print("Connection lost: ", e.args[0])
+            return self.reconnect()
+
     def select(self, query: str):
         """
-        getting a cursor, executing the query, closing the connection then returning the data
+        getting a cursor, executing the query, releasing the connection then returning the data
         :param query: select query from the database
         :return: list, 0 in case of exception
         """
@@ -50,7 +118,7 @@ class DatabaseHandler:
             cursor = self.connection.cursor()
             results = cursor.execute(query).fetchall()
             print(f"Extracted {len(results)} Records from the Database")
-            self.close()
+            self.release()
             return results
         except sqlite3.OperationalError as e:
             print("Selection failed: ", e.args[0])
@@ -59,7 +127,7 @@ class DatabaseHandler:
     def insert_many(self, query: str, data: list):
         """
         using 'with' clause, executing the query, (data is committed by 'with'),
-        closing the connection then returning finished string
+        releasing the connection then returning finished string
         :param query: insert query, already with the table name embedded in it
         :param data: iterable for the executemany function
         :return: str, 0 in case of exception
@@ -70,12 +138,65 @@ class DatabaseHandler:
             with self.connection as cursor:
                 cursor.executemany(query, data)
             print(f"Inserted {len(data)} Records to the Database")
-            self.close()
+            self.release()
             return f"Inserted {len(data)} Records"
         except sqlite3.OperationalError as e:
             print("Insertion failed: ", e.args[0])
             return 0
 
+    def insert_chunks(self, chunks):
+        """
+        executing every chunk inside its own transaction, so each chunk is committed on its own
+        and only one chunk is held in memory at a time, releasing the connection then returning finished string
+        a chunk is a list of (query, data) pairs, the first pair holds the records,
+        the following pairs (if any) are executed in the same transaction,
+        a (query, data, index) triple is executed only if the pair at the index (before it) changed rows
+        :param chunks: iterable of chunks, can be a generator
+        :return: str, 0 in case of exception
+        """
+        try:
+            records = 0
+            for chunk in chunks:
+                # if the 'with' block succeed the chunk is committed
+                # otherwise a rollback is called for this chunk only
+                with self.connection as cursor:
+                    with timer('invoices_stage_seconds', stage='executemany'):
+                        # number of rows changed by every pair of the chunk
+                        changes = []
+                        for query, data, *condition in chunk:
+                            total_changes = self.connection.total_changes
+                            if not condition or changes[condition[0]]:
+                                cursor.executemany(query, data)
+                            changes.append(self.connection.total_changes - total_changes)
+                    commit_start = time.perf_counter()
+                observe('invoices_stage_seconds', time.perf_counter() - commit_start, stage='commit')
+                increment('invoices_rows_total', len(chunk[0][1]))
+                records += len(chunk[0][1])
+            print(f"Inserted {records} Records to the Database")
+            self.release()
+            return f"Inserted {records} Records"
+        except sqlite3.OperationalError as e:
+            print("Insertion failed: ", e.args[0])
+            return 0
+
+    def transaction_select(self, statements: list, query: str, parameters: tuple = ()):
+        """
+        executing the statements then the select query inside one transaction, without closing the connection,
+        the select sees exactly the state the statements are committing, no other writer can get in between
+        :param statements: list of (query, data) pairs for executemany
+        :param query: select query
+        :param parameters: parameters of the select query
+        :return: list, 0 in case of exception
+        """
+        try:
+            with self.connection as cursor:
+                for statement, data in statements:
+                    cursor.executemany(statement, data)
+                return cursor.execute(query, parameters).fetchall()
+        except sqlite3.OperationalError as e:
+            print("Transaction failed: ", e.args[0])
+            return 0
+
     def to_dataframe(self, headers: list, table_name: str):
         """
         getting a string list of column names, then returning the dataframe from the pandas method
@@ -91,6 +212,33 @@ class DatabaseHandler:
             print("pandas.read_sql_query failed: ", e.args[0])
             return 0
 
+    def query_to_dataframe(self, query: str):
+        """
+        executing a full select query (aggregations, grouping) inside the database
+        and returning only its results as a dataframe
+        :param query: select query with the table name embedded
+        :return: pandas.Dataframe, 0 in case of exception
+        """
+        try:
+            return pandas.read_sql_query(query, self.connection)
+        except pandas.io.sql.DatabaseError as e:
+            print("pandas.read_sql_query failed: ", e.args[0])
+            return 0
+
+    def table_exists(self, table_name: str) -> bool:
+        """
+        checking the sqlite schema for the table, without closing the connection
+        :param table_name: table name
+        :return: boolean - true if the table exists
+        """
+        try:
+            cursor = self.connection.cursor()
+            query = '''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?'''
+            return cursor.execute(query, (table_name,)).fetchone() is not None
+        except sqlite3.OperationalError as e:
+            print("Checking failed: ", e.args[0])
+            return False
+
     def create_table(self, query: str):
         """
         creating table in the database
@@ -105,6 +253,48 @@ class DatabaseHandler:
             print("Creation failed: ", e.args[0])
             return 0
 
+    def create_index(self, query: str):
+        """
+        creating index in the database
+        :param query: create index query with the index and table names embedded
+        :return: str, 0 in case of exception
+        """
+        try:
+            with self.connection as cursor:
+                cursor.execute(query)
+            return "1 Index Created Successfully"
+        except sqlite3.OperationalError as e:
+            print("Index creation failed: ", e.args[0])
+            return 0
+
+    def drop_index(self, query: str):
+        """
+        dropping index from the database
+        :param query: drop index query with the index name embedded
+        :return: str, 0 in case of exception
+        """
+        try:
+            with self.connection as cursor:
+                cursor.execute(query)
+            return "1 Index Dropped Successfully"
+        except sqlite3.OperationalError as e:
+            print("Index dropping failed: ", e.args[0])
+            return 0
+
+    def fill_table(self, query: str):
+        """
+        filling a table from the rows of another table, inside the database
+        :param query: insert select query with the table names embedded
+        :return: str, 0 in case of exception
+        """
+        try:
+            with self.connection as cursor:
+                rows = cursor.execute(query).rowcount
+            return f"Filled {rows} Rows"
+        except sqlite3.OperationalError as e:
+            print("Filling failed: ", e.args[0])
+            return 0
+
     def clear_table(self, query: str):
         """
         clearing all rows from table in database
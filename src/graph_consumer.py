@@ -1,42 +1,115 @@
-import pika
-from src.processing import graph_consumer_callback
+from src.database_handler import database_path, database_profile
+from src.message import decode_message
+from src import processing
+from src.processing import refresh_graph, establish_connection
+from src.dashboard import start_server, stop_server
+from src.transport import PikaTransport
+from src.metrics import increment, observe_queue_wait, start_exporter
+# seconds a notification waits for more notifications before the graph is rebuilt
+default_coalesce_interval = 1.0
+# number of pending notifications which rebuild the graph at once, without waiting
+default_coalesce_count = 100
 
 
 class GraphConsumer:
-    def __init__(self):
+    def __init__(self, coalesce_interval: float = default_coalesce_interval,
+                 coalesce_count: int = default_coalesce_count, transport=None, output: str = None,
+                 _database_path: str = database_path):
         """
         initiating the class, creating the connection to pika (rabbitmq python's module)
         receiving the ok to create or update the graph
         after getting the data from the data base, processing it and passing it to the graph
+        the database connection is kept for the whole lifetime of the consumer
+        a burst of notifications is coalesced, the graph of every table is rebuilt once per burst
+        :param coalesce_interval: seconds to wait for more notifications after the first one
+        :param coalesce_count: number of pending notifications which rebuild the graph without waiting
+        :param transport: PikaTransport or MemoryTransport, a connection to the rabbitmq by default
+        :param output: html/dashboard (see processing.graph_outputs), processing.graph_output by default,
+        with the dashboard the consumer serves the dashboard directory on dashboard.dashboard_port
+        :param _database_path: path to database the graphs are built from
         """
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host='localhost'))
-        self.channel = self.connection.channel()
+        self.output = output or processing.graph_output
+        self.coalesce_interval = coalesce_interval
+        self.coalesce_count = coalesce_count
+        # table name -> number of pending notifications, the last delivery tag acknowledges them all
+        self.pending = {}
+        self.last_delivery_tag = 0
+        self.timer = None
+        self.database_connection = establish_connection(_database_path, persistent=True, profile=database_profile)
+        self.transport = transport or PikaTransport()
         self.declare()
         self.consume()
         self.keep_consume()
 
+    def callback(self, channel, method, properties, body):
+        """
+        when the queue is receiving data the callback method is invoked
+        adding the table to the pending ones and scheduling the rebuild, or rebuilding at once
+        when the pending notifications reach coalesce_count
+        :param channel: channel of communication
+        :type channel: pika.channel.BlockingChannel
+        :param method: used to acknowledge the message
+        :type method: pika.spec.Basic.Deliver
+        :param properties: user-defined properties on the message
+        :type properties: pika.spec.BasicProperties
+        :type body: bytes
+        """
+        message = decode_message(body)
+        table_name = message.table_name
+        print(f"Graph Consumer received the name of the database: {table_name}")
+        observe_queue_wait(message.enqueued_at, 'database_to_graph')
+        self.pending[table_name] = self.pending.get(table_name, 0) + 1
+        self.last_delivery_tag = method.delivery_tag
+        if sum(self.pending.values()) >= self.coalesce_count:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.transport.call_later(self.coalesce_interval, self.flush)
+
+    def flush(self):
+        """
+        rebuilding the graph once for every pending table, then acknowledging
+        all the pending notifications at once
+        """
+        if self.timer is not None:
+            self.transport.remove_timeout(self.timer)
+            self.timer = None
+        for table_name, count in self.pending.items():
+            print(f"Graph Consumer rebuilding {table_name} once for {count} notifications")
+            refresh_graph(table_name, self.database_connection, self.output)
+        increment('invoices_messages_total', sum(self.pending.values()), consumer='graph_consumer',
+                  outcome='acknowledged')
+        self.pending = {}
+        self.transport.ack(self.last_delivery_tag, multiple=True)
+
     def declare(self):
         """
         declaring the queue which the database_consumer will publish to
         it's important to declare it here too because i can't know which of the files will run first
         """
-        self.channel.queue_declare(queue='database_to_graph')
+        self.transport.declare('database_to_graph')
 
     def consume(self):
         """
         consume means to listen to the queue forever until some data comes,
         then process it, then continue listening
+        the messages are acknowledged manually after the rebuild, up to coalesce_count of them are in flight
         """
-        self.channel.basic_consume(queue='database_to_graph',
-                                   on_message_callback=graph_consumer_callback, auto_ack=True)
+        self.transport.qos(self.coalesce_count)
+        self.transport.consume('database_to_graph', self.callback)
 
     def keep_consume(self):
         """
         this command gives the flag to start consuming, but never stops
         """
         print('GraphConsumer is Waiting for messages. To exit press CTRL+C')
-        self.channel.start_consuming()
+        exporter = start_exporter('graph_consumer')
+        server = start_server() if 'dashboard' == self.output else None
+        try:
+            self.transport.start_consuming()
+        finally:
+            self.database_connection.close()
+            exporter.write()
+            stop_server(server)
 
 
 if __name__ == '__main__':
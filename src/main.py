@@ -2,6 +2,7 @@ import os
 import time
 import shutil
 from src.producer import Producer
+from src.message import create_message, encode_message
 from src.database_handler import database_path
 path_list = [
         ["C:/Users/barel/Desktop/Files/invoices_2009.json", "json", "invoices"],
@@ -10,25 +11,37 @@ path_list = [
         ["C:/Users/barel/Desktop/Files/invoices_2012.csv", "csv", "invoices"],
         ["C:/Users/barel/Desktop/Files/invoices_2013.csv", "csv", "invoices"]
     ]
+# file type -> the extensions of its files
+file_extensions = {'json': ('json',), 'csv': ('csv',), 'ndjson': ('ndjson', 'jsonl'),
+                   'parquet': ('parquet',), 'arrow': ('arrow', 'feather')}
+# file types which can be split on line boundaries
+shardable_types = ('csv', 'ndjson')
 
 
-def main(sleep_amount: float, _path_list: list) -> str:
+def main(sleep_amount: float, _path_list: list, shard_size: int = 0, transport=None) -> str:
     """
     passed a list of bytes including 'path', 'type' and 'table_name'
     to activate the first module - Producer
-    :param sleep_amount: number of seconds to sleep between iterations
+    without sleep_amount all the items are checked first, then published in batches with delivery guarantee
+    with shard_size the files bigger than it are split into byte ranges, one message for every range
+    :param sleep_amount: number of seconds to sleep between iterations, 0 to publish in batches
     :param _path_list: strings list of lists
+    :param shard_size: number of bytes in every shard, 0 to send every file whole
+    :param transport: PikaTransport or MemoryTransport of the producer, a connection to the rabbitmq by default
     :return: str
     """
 
-    producer = Producer()
+    producer = Producer(transport)
 
     if check_same_table_list(_path_list):
         producer.declare()
+        if not sleep_amount:
+            return publish_batch(producer, _path_list, shard_size)
         for item in _path_list:
             if check_path(item[0]):
                 if check_type(item[0], item[1]):
-                    producer.publish(create_metadata(item[0], item[1], item[2]))
+                    for metadata in create_shards_metadata(item[0], item[1], item[2], shard_size):
+                        producer.publish(metadata)
                     # waiting 4 seconds between runs - to see the update in progress
                     if item != _path_list[-1]:
                         time.sleep(sleep_amount)
@@ -44,6 +57,27 @@ def main(sleep_amount: float, _path_list: list) -> str:
     return "All Done Successfully"
 
 
+def publish_batch(producer: Producer, _path_list: list, shard_size: int = 0) -> str:
+    """
+    checking every item of the list before publishing any of them,
+    then publishing all of them in one pass
+    :param producer: Producer instance, with the queue declared
+    :param _path_list: strings list of lists
+    :param shard_size: number of bytes in every shard, 0 to send every file whole
+    :return: str
+    """
+    for item in _path_list:
+        if not check_path(item[0]):
+            return f"{item[0]} - is not a valid path, skipping to next"
+        if not check_type(item[0], item[1]):
+            return f"{item[0].split('.')[-1]}, {item[1].lower()} - " \
+                   f"there is differences between file types, skipping to next"
+    print(producer.publish_batch(metadata for item in _path_list
+                                 for metadata in create_shards_metadata(item[0], item[1], item[2], shard_size)))
+    producer.close()
+    return "All Done Successfully"
+
+
 # Cleanup function:
 # ----------------
 # This cleanup supposed to clean the database assets in order to
@@ -68,12 +102,12 @@ def check_same_table_list(_path_list: list) -> bool:
 
 def check_type(path: str, file_type: str) -> bool:
     """
-    checking if the file type is corresponding to the data fed
-    :param path: file type (.json/.csv)
-    :param file_type: JSON/CSV
+    checking if the file type is corresponding to the data fed, and is one of file_extensions
+    :param path: file type (.json/.csv/.ndjson/.jsonl/.parquet/.arrow/.feather)
+    :param file_type: JSON/CSV/NDJSON/PARQUET/ARROW
     :return: boolean - true if the same as the file
     """
-    return path.split(".")[-1] == file_type
+    return path.split(".")[-1] in file_extensions.get(file_type, ())
 
 
 def check_path(path: str) -> bool:
@@ -87,14 +121,53 @@ def check_path(path: str) -> bool:
 
 def create_metadata(path: str, file_type: str, name: str) -> bytes:
     """
-    creating bytes strings with the os module for the file path
+    creating the binary message of the file (see message.py), with its size and the enqueue time
     using the os module and the normpath method for matching all operating systems
     :param path: string of the file path
-    :param file_type: CSV/JSON
+    :param file_type: CSV/JSON/NDJSON/PARQUET/ARROW
+    :param name: name of the table in the database
+    :return: bytes of the encoded message
+    """
+    return encode_message(create_message(os.path.normpath(path), file_type, name))
+
+
+def create_shards_metadata(path: str, file_type: str, name: str, shard_size: int) -> list:
+    """
+    creating the messages of the file, one message for the whole file,
+    or one message for every byte range when the file can be split and is bigger than shard_size
+    :param path: string of the file path
+    :param file_type: CSV/JSON/NDJSON/PARQUET/ARROW
     :param name: name of the table in the database
-    :return: string bytes of combined variables
+    :param shard_size: number of bytes in every shard, 0 to send the file whole
+    :return: list of bytes of the encoded messages
+    """
+    if not shard_size or file_type not in shardable_types or os.path.getsize(path) <= shard_size:
+        return [create_metadata(path, file_type, name)]
+    message = create_message(os.path.normpath(path), file_type, name)
+    return [encode_message(message._replace(byte_start=byte_start, byte_end=byte_end))
+            for byte_start, byte_end in split_file(path, shard_size)]
+
+
+def split_file(path: str, shard_size: int) -> list:
+    """
+    splitting the file into byte ranges of about shard_size bytes, every range ends on a line boundary,
+    the first range holds the header line of a csv, the consumer adds it to the other ranges
+    (a quoted csv field holding a new line can't be split like this, an ndjson line always can)
+    :param path: string of the file path
+    :param shard_size: number of bytes in every shard
+    :return: list of (byte_start, byte_end) covering the whole file
     """
-    return bytes(f'{os.path.normpath(path)} {file_type} {name}', encoding='utf-8')
+    ranges = []
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        byte_start = 0
+        while byte_start < file_size:
+            file.seek(byte_start + shard_size)
+            file.readline()
+            byte_end = min(file.tell(), file_size)
+            ranges.append((byte_start, byte_end))
+            byte_start = byte_end
+    return ranges
 
 
 if __name__ == '__main__':
@@ -0,0 +1,125 @@
+import os
+import time
+import struct
+import hashlib
+from typing import NamedTuple
+# every binary message starts with the magic and the version of the format
+magic = b'INVM'
+version = 1
+# magic, version, file size, byte range start, byte range end, enqueue timestamp
+header = struct.Struct('>4sBQQQd')
+# length prefix of every string field
+string_length = struct.Struct('>H')
+hash_block_size = 1 << 20
+
+
+class Message(NamedTuple):
+    """
+    the fields of one message, a byte_end of 0 means the whole file
+    """
+    path: str
+    file_type: str
+    table_name: str
+    file_size: int = 0
+    content_hash: str = ''
+    byte_start: int = 0
+    byte_end: int = 0
+    enqueued_at: float = 0.0
+
+
+def create_message(path: str, file_type: str, table_name: str, hash_content: bool = False) -> Message:
+    """
+    creating a message of a file, with its size and the enqueue time
+    :param path: string of the file path
+    :param file_type: CSV/JSON/NDJSON/PARQUET/ARROW
+    :param table_name: name of the table in the database
+    :param hash_content: either hash the content of the file (reading all of it) or leave the hash empty
+    :return: Message
+    """
+    is_file = os.path.isfile(path)
+    return Message(path, file_type, table_name,
+                   file_size=os.path.getsize(path) if is_file else 0,
+                   content_hash=hash_file(path) if is_file and hash_content else '',
+                   enqueued_at=time.time())
+
+
+def encode_message(message: Message) -> bytes:
+    """
+    packing the message, fixed size header then the length prefixed strings
+    :param message: Message
+    :return: bytes
+    """
+    fields = [message.path, message.file_type, message.table_name, message.content_hash]
+    return header.pack(magic, version, message.file_size, message.byte_start, message.byte_end,
+                       message.enqueued_at) + b''.join(pack_string(field) for field in fields)
+
+
+def decode_message(body: bytes) -> Message:
+    """
+    unpacking a binary message, or parsing a legacy one,
+    'path type table' from the producer or 'table' from the database consumer
+    :param body: bytes
+    :return: Message
+    """
+    if not body.startswith(magic):
+        text = body.decode()
+        if ' ' not in text:
+            return Message('', '', text)
+        # the path is the only field which can hold spaces
+        path, file_type, table_name = text.rsplit(' ', 2)
+        return Message(path, file_type, table_name)
+    _, message_version, file_size, byte_start, byte_end, enqueued_at = header.unpack_from(body)
+    if message_version != version:
+        raise ValueError(f"unknown message version {message_version}")
+    fields = []
+    position = header.size
+    for _ in range(4):
+        field, position = unpack_string(body, position)
+        fields.append(field)
+    path, file_type, table_name, content_hash = fields
+    return Message(path, file_type, table_name, file_size, content_hash, byte_start, byte_end, enqueued_at)
+
+
+def describe(body: bytes) -> str:
+    """
+    human readable form of a message, for printing
+    :param body: bytes
+    :return: str
+    """
+    if not body.startswith(magic):
+        return body.decode()
+    message = decode_message(body)
+    return ' '.join(field for field in (message.path, message.file_type, message.table_name) if field)
+
+
+def pack_string(field: str) -> bytes:
+    """
+    :param field: string field
+    :return: length prefixed utf-8 bytes
+    """
+    encoded = field.encode('utf-8')
+    return string_length.pack(len(encoded)) + encoded
+
+
+def unpack_string(body: bytes, position: int) -> tuple:
+    """
+    :param body: bytes
+    :param position: index of the length prefix
+    :return: tuple of the string field and the index after it
+    """
+    (length,) = string_length.unpack_from(body, position)
+    position += string_length.size
+    return body[position:position + length].decode('utf-8'), position + length
+
+
+def hash_file(path: str) -> str:
+    """
+    hashing the content of the file block after block
+    :param path: string of the file path
+    :return: hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(hash_block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
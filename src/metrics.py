@@ -0,0 +1,260 @@
+import os
+import time
+import threading
+import contextlib
+import http.server
+# histogram buckets of the timings, in seconds
+default_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0)
+# port of the http endpoint of the consumers, 0 for none
+metrics_port = 0
+# directory of the metrics files (the textfile collector format, one file per process), None for none
+metrics_directory = os.path.normpath(os.path.dirname(__file__) + os.path.join('/database/metrics'))
+# seconds between two writes of the metrics file
+metrics_interval = 15.0
+# name -> (type, help) of every metric of the modules
+descriptions = {
+    'invoices_stage_seconds': ('histogram', 'Seconds spent in every stage of the modules.'),
+    'invoices_queue_wait_seconds': ('histogram', 'Seconds between the enqueue of a message and its handling.'),
+    'invoices_rows_total': ('counter', 'Rows inserted into the database, the duplicates it ignores included.'),
+    'invoices_messages_total': ('counter', 'Messages handled by the consumers, by outcome.'),
+    'invoices_figure_writes_total': ('counter', 'Graph rebuilds, written or skipped as unchanged.'),
+    'invoices_graph_cache_total': ('counter', 'Graph dataframes, unchanged, merged from the touched months or built.'),
+}
+
+
+class Registry:
+    def __init__(self, buckets: tuple = default_buckets):
+        """
+        the counters and the histograms of one process, shared by all its threads
+        :param buckets: upper bounds of the histogram buckets, in seconds
+        """
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # (name, labels) -> number
+        self.counters = {}
+        # (name, labels) -> [count of every bucket, sum, count]
+        self.histograms = {}
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        """
+        :param name: name of the counter
+        :param amount: number added to the counter
+        :param labels: labels of the counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        :param name: name of the histogram
+        :param seconds: observed value
+        :param labels: labels of the histogram
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """
+        observing the seconds spent inside the with block, also when it raises
+        :param name: name of the histogram
+        :param labels: labels of the histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, iterable, name: str, **labels):
+        """
+        observing the seconds spent producing every item of a (lazy) iterable, the reading and the parsing
+        :param iterable: iterable, usually a generator
+        :param name: name of the histogram
+        :param labels: labels of the histogram
+        :return: generator of the same items
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - start, **labels)
+            yield item
+
+    def render(self) -> str:
+        """
+        :return: str of all the metrics in the prometheus text format
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(value[0]), value[1], value[2])) for key, value in self.histograms.items())
+        lines = []
+        described = set()
+        for (name, labels), value in counters:
+            describe(lines, described, name, 'counter')
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in histograms:
+            describe(lines, described, name, 'histogram')
+            for bound, bucket_count in zip(self.buckets, buckets):
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', repr(bound)),))} {bucket_count}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+def describe(lines: list, described: set, name: str, metric_type: str) -> None:
+    """
+    adding the HELP and TYPE lines before the first sample of the metric
+    :param lines: list of the lines of the text format
+    :param described: set of the names already described
+    :param name: name of the metric
+    :param metric_type: counter/histogram
+    """
+    if name not in described:
+        described.add(name)
+        lines.append(f"# HELP {name} {descriptions.get(name, (metric_type, name))[1]}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+
+def format_labels(labels: tuple) -> str:
+    """
+    :param labels: tuple of (name, value) pairs
+    :return: str of the labels in the prometheus text format, empty without labels
+    """
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+# the registry of the process, every module records into it
+registry = Registry()
+increment = registry.increment
+observe = registry.observe
+timer = registry.timer
+timed = registry.timed
+
+
+def observe_queue_wait(enqueued_at: float, queue_name: str) -> None:
+    """
+    observing the seconds the message waited, from the enqueue timestamp of the producer (see message.py)
+    legacy messages without the timestamp are skipped
+    :param enqueued_at: unix time of the enqueue, 0 when unknown
+    :param queue_name: name of the queue the message came from
+    """
+    if enqueued_at:
+        observe('invoices_queue_wait_seconds', max(time.time() - enqueued_at, 0.0), queue=queue_name)
+
+
+def write_metrics(file_path: str, metrics_registry: Registry = registry) -> None:
+    """
+    writing the metrics to a temporary file then renaming it, the collector never reads half a file
+    :param file_path: path of the .prom file
+    :param metrics_registry: Registry instance
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    temporary_path = file_path + '.tmp'
+    with open(temporary_path, 'w') as file:
+        file.write(metrics_registry.render())
+    os.replace(temporary_path, file_path)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    metrics_registry = registry
+
+    def do_GET(self):
+        """
+        answering every path with the metrics
+        """
+        body = self.metrics_registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """
+        the scrapes are not printed
+        """
+
+
+class Exporter:
+    def __init__(self, name: str, port: int = None, directory: str = None, interval: float = None,
+                 metrics_registry: Registry = registry):
+        """
+        exporting the metrics of the process from a thread, on a local http endpoint
+        and/or to a file rewritten every interval seconds
+        :param name: name of the consumer, the file is named after it and the process id
+        :param port: port of the http endpoint, 0 for none, metrics_port by default
+        :param directory: directory of the file, None for none, metrics_directory by default
+        :param interval: seconds between two writes of the file, metrics_interval by default
+        :param metrics_registry: Registry instance
+        """
+        self.metrics_registry = metrics_registry
+        self.interval = metrics_interval if interval is None else interval
+        port = metrics_port if port is None else port
+        directory = metrics_directory if directory is None else directory
+        self.file_path = os.path.join(directory, f"{name}_{os.getpid()}.prom") if directory else None
+        self.stopped = threading.Event()
+        self.server = None
+        if port:
+            handler = type('Handler', (MetricsHandler,), {'metrics_registry': metrics_registry})
+            try:
+                self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+                threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            except OSError as e:
+                print("Metrics server failed: ", e)
+        if self.file_path:
+            threading.Thread(target=self.keep_writing, daemon=True).start()
+
+    def keep_writing(self):
+        """
+        runs on the writer thread, until stop
+        """
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """
+        writing the file now, the consumers write it once more when they stop
+        """
+        if self.file_path:
+            write_metrics(self.file_path, self.metrics_registry)
+
+    def stop(self):
+        """
+        writing the file one last time, then stopping the threads
+        """
+        self.stopped.set()
+        self.write()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+# the exporter of the process, started by the first consumer of the process
+exporters = {}
+
+
+def start_exporter(name: str) -> Exporter:
+    """
+    starting the exporter of the process once, the consumers running in the same process share it
+    (a forked process starts its own)
+    :param name: name of the first consumer of the process
+    :return: the Exporter of the process
+    """
+    if os.getpid() not in exporters:
+        exporters[os.getpid()] = Exporter(name)
+    return exporters[os.getpid()]
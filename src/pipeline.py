@@ -0,0 +1,78 @@
+import time
+import threading
+import multiprocessing
+from src.main import main
+from src.database_handler import database_path
+from src.graph_consumer import GraphConsumer
+from src.database_consumer import DatabaseConsumer, run_workers, default_prefetch_count
+from src.processing import default_chunk_size
+from src.transport import MemoryBroker, MemoryTransport, poll_interval
+# seconds run_pipeline waits for the graphs before giving up
+default_timeout = 600.0
+
+
+def run_pipeline(_path_list: list, processes: int = 0, shard_size: int = 0, chunk_size: int = default_chunk_size,
+                 prefetch_count: int = default_prefetch_count, coalesce_interval: float = 0.1,
+                 timeout: float = default_timeout, _database_path: str = database_path) -> float:
+    """
+    running the three modules over a MemoryBroker, without rabbitmq,
+    the producer and the graph consumer in this process, the database consumer in a thread of this process
+    or in worker processes, then waiting until the graph of every file is rebuilt
+    :param _path_list: strings list of lists, 'path', 'type' and 'table_name'
+    :param processes: number of database consumer processes, 0 to run the database consumer in a thread
+    :param shard_size: number of bytes in every shard, 0 to send every file whole
+    :param chunk_size: number of rows per transaction
+    :param prefetch_count: number of messages delivered to every database consumer before it acknowledges them
+    :param coalesce_interval: seconds the graph consumer waits for more notifications
+    :param timeout: seconds to wait for the graphs
+    :param _database_path: path to database of the consumers
+    :return: seconds from the first publish to the last graph rebuild
+    """
+    manager = multiprocessing.Manager() if processes else None
+    broker = MemoryBroker(manager)
+    # the queues are declared before the processes start, so all of them share the same queues
+    broker.declare('files_to_database')
+    broker.declare('database_to_graph')
+    graph_transport = MemoryTransport(broker)
+    graph_thread = threading.Thread(target=GraphConsumer, daemon=True,
+                                    kwargs={'coalesce_interval': coalesce_interval, 'transport': graph_transport,
+                                            '_database_path': _database_path})
+    database_transport = None
+    workers = []
+    if processes:
+        workers = run_workers(processes, chunk_size, prefetch_count, broker, wait=False, _database_path=_database_path)
+    else:
+        database_transport = MemoryTransport(broker)
+        database_consumer = DatabaseConsumer(chunk_size, prefetch_count, database_transport,
+                                             _database_path=_database_path)
+        threading.Thread(target=database_consumer.keep_consume, daemon=True).start()
+    graph_thread.start()
+    start = time.perf_counter()
+    try:
+        result = main(0, _path_list, shard_size, MemoryTransport(broker))
+        if result != "All Done Successfully":
+            raise ValueError(result)
+        # every file notifies the graph once, after all its shards are committed
+        expected = len({item[0] for item in _path_list})
+        while graph_transport.settled < expected:
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError(f"{graph_transport.settled} of {expected} graphs rebuilt in {timeout} seconds")
+            time.sleep(poll_interval / 10)
+        return time.perf_counter() - start
+    finally:
+        graph_transport.add_callback_threadsafe(graph_transport.stop_consuming)
+        graph_thread.join()
+        graph_transport.close()
+        if database_transport:
+            database_transport.add_callback_threadsafe(database_transport.stop_consuming)
+            database_transport.close()
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        if manager:
+            manager.shutdown()
+
+
+if __name__ == '__main__':
+    from src.main import path_list
+    print(f"Pipeline Done in {run_pipeline(path_list):.3f} Seconds")
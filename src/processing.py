@@ -1,80 +1,769 @@
+import io
 import os
+import re
+import json
+import time
+import numpy
+import hashlib
 import pandas
+import sqlite3
+import threading
+import collections
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
-from src.database_handler import DatabaseHandler, database_path
-figure_path = os.path.normpath(os.path.dirname(__file__) + os.path.join('/database/figure.html'))
+from src.database_handler import DatabaseHandler, database_path, database_profile
+from src.message import Message, decode_message, hash_file
+from src.metrics import timer, timed, increment
+from src.dashboard import update_dashboard
+try:
+    # optional, only the parquet and arrow files need it
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+# directory of the html files of the graphs, one file for every table
+figure_directory = os.path.normpath(os.path.dirname(__file__) + os.path.join('/database/figures'))
+# either the graph consumers open the html file in the browser after every rebuild or not
+graph_auto_open = True
+# how plotly.js is written with the graphs
+# 'directory' - plotly.min.js is written once next to the html files, every html file only references it
+# 'inline' - every html file embeds the whole plotly.js bundle, a few MB, the file can be moved alone
+render_modes = ('directory', 'inline')
+graph_render_mode = 'directory'
+# (database path, table name) -> (graph dataframe, dict of its rows by month, id of the last touched month merged
+# into it) of every table, the next graph of the table recomputes only the months touched after the id,
+# an unchanged table (no month touched after the id) costs a single select, least recently used first evicted
+graph_dataframes = collections.OrderedDict()
+graph_dataframes_lock = threading.Lock()
+# number of tables whose graph dataframe is kept, 0 to keep none
+graph_cache_size = 64
+# above this number of touched months the graph dataframe is built whole again (a parameter for every month)
+touched_months_limit = 500
+# where the graph consumers put the graphs
+# 'html' - a whole html file of the table is rebuilt (when its data changed), see graph_render_mode
+# 'dashboard' - only the data file of the table is written (see dashboard.py), the page polls it
+graph_outputs = ('html', 'dashboard')
+graph_output = 'html'
+# html file path -> (render mode, hash of the graph data) of the last write, unchanged graphs aren't written again
+figure_hashes = {}
+default_chunk_size = 100000
+json_block_size = 1 << 20
+# file types read with pyarrow, column after column, from a memory map
+columnar_types = ('parquet', 'arrow')
+json_separators = re.compile(r'[\s,]*')
+# the end of a json buffer cut in the middle of a token (a number, a literal or an escape), nothing structural
+json_cut_token = re.compile(r'[^\s,:\[\]{}"]*')
+# size of the longest json object read_json_chunks buffers before failing the file
+json_record_limit = 64 << 20
+# the declared types of the invoice columns, the files are read with them instead of inferring them,
+# the text columns are kept as read (json strings are never converted, csv postal codes keep their zeros)
+invoice_schema = {'InvoiceId': 'int32', 'CustomerId': 'int32', 'InvoiceDate': 'datetime64[ns]',
+                  'BillingAddress': str, 'BillingCity': 'category', 'BillingState': 'category',
+                  'BillingCountry': 'category', 'BillingPostalCode': str, 'Total': 'float64'}
+# text of the parsed dates in the database, the same as in the files
+invoice_date_format = '%Y-%m-%d %H:%M:%S'
+# number of rows converted to python values at a time while executemany inserts them, see DataframeRows
+rows_block_size = 10000
+# how the rows of the files are merged into the table
+# 'replace' - REPLACE INTO the table row after row, the last row with the same InvoiceId and CustomerId is kept
+# 'first_wins' - bulk load through a staging table, the row already in the table (or the first of the chunk) is kept
+# 'last_wins' - bulk load through a staging table, the last row of the chunk replaces the others
+load_modes = ('replace', 'first_wins', 'last_wins')
+default_load_mode = 'replace'
+# persistent database connections of every pool thread, by database path, see get_thread_connection
+thread_connections = threading.local()
 
 
-def process_file(file_path: str, file_type: str, table_name: str):
+def process_file(file_path: str, file_type: str, table_name: str, chunk_size: int = 0,
+                 database_connection: DatabaseHandler = None, defer_indexes: bool = False, byte_range: tuple = None,
+                 load_mode: str = default_load_mode, raise_database_errors: bool = False):
     """
     if database directory isn't exists, creating it
     getting the file path, file type, and table name
     opening the file then inserting all the data into the database
+    with a chunk_size the file is streamed, each chunk is inserted and committed in its own transaction
+    so the memory is bounded by the chunk size and not by the file size
+    the monthly rollup table is updated in the same transaction as the rows
+    for a bulk load the indexes can be deferred, they are dropped before the load and built once after it,
+    the rollup is then rebuilt once after the indexes instead of in every transaction,
+    with the months touched by the load recorded in the same transaction as the rebuilt rollup,
+    even when the load fails
+    with a bulk load mode the rows of every chunk go into an unindexed temporary staging table first,
+    then a single insert select merges them into the table, see load_modes
     :param file_path: filepath normal to the operating system
-    :param file_type: CSV/JSON
+    :param file_type: CSV/JSON/NDJSON/PARQUET/ARROW
     :param table_name: table name
+    :param chunk_size: number of rows per transaction, 0 to read the whole file at once
+    :param database_connection: persistent DatabaseHandler of the consumer, None to establish a new one
+    :param defer_indexes: either build the indexes after the load or keep them during it
+    :param byte_range: (byte_start, byte_end) of a csv or ndjson shard, None to read the whole file
+    :param load_mode: replace/first_wins/last_wins
+    :param raise_database_errors: either raise sqlite3.OperationalError when a transaction failed
+    (the database is locked, the disk is full) or return 0 as for a file which can't be read
     :return: str from database_handler, 0 in case of exception
     """
-    if not os.path.exists(database_path):
-        os.mkdir(os.path.dirname(database_path))
-    database_connection = establish_connection(database_path)
-    create_table_if_not_exist(database_connection, table_name)
+    if load_mode not in load_modes:
+        raise ValueError(f"unknown load mode {load_mode}")
+    database_connection = reuse_connection(database_connection)
+    create_table_if_not_exist(database_connection, table_name, defer_indexes)
+    create_rollup_table_if_not_exist(database_connection, table_name)
+    if load_mode != 'replace':
+        create_staging_table_if_not_exist(database_connection, table_name)
+    if defer_indexes:
+        drop_indexes(database_connection, table_name)
+        create_pending_months_if_not_exist(database_connection)
 
-    insert_many_query = get_insert_many_query(table_name)
-
-    dataframe = pandas.DataFrame()
+    chunks = (get_chunk_statements(dataframe, table_name, not defer_indexes, load_mode)
+              for dataframe in timed(read_chunks(file_path, file_type, chunk_size, byte_range),
+                                     'invoices_stage_seconds', stage='read'))
     try:
+        results = database_connection.insert_chunks(chunks)
+    except ValueError as e:
+        # pandas.errors.ParserError and json.JSONDecodeError are both raised while reading
+        # when streaming, the chunks before the failure are already committed
+        print("reading failed: ", e.args[0])
+        results = None
+    finally:
+        # whatever failed, the committed chunks mustn't be left without indexes and with their months pending
+        if defer_indexes:
+            database_connection.ensure_connection()
+            create_indexes_if_not_exist(database_connection, table_name)
+            database_connection.transaction_select(
+                [('''DELETE FROM ''' + get_rollup_table_name(table_name), [()]),
+                 ('''INSERT INTO ''' + get_rollup_table_name(table_name) + ''' '''
+                  + get_monthly_aggregate_query(table_name), [()]),
+                 ('''INSERT INTO touched_months (table_name, month)
+                    SELECT table_name, month FROM pending_months WHERE table_name = ?''', [(table_name,)]),
+                 ('''DELETE FROM pending_months WHERE table_name = ?''', [(table_name,)])],
+                '''SELECT changes()''')
+        database_connection.release()
+    if results is None:
+        return 0
+    if not results and raise_database_errors:
+        raise sqlite3.OperationalError(f"loading {file_path} into {table_name} failed, the transaction rolled back")
+    return results
+
+
+def record_shard(database_connection: DatabaseHandler, file_path: str, file_size: int,
+                 byte_start: int, byte_end: int) -> bool:
+    """
+    the completion barrier of a sharded file, recording the committed shard and summing the recorded ranges
+    in the same transaction, so exactly one shard (the last one) sees the whole file covered,
+    then forgetting the ranges of the completed file
+    :param database_connection: DatabaseHandler instance
+    :param file_path: filepath normal to the operating system
+    :param file_size: size of the whole file
+    :param byte_start: first byte of the shard
+    :param byte_end: byte after the last byte of the shard
+    :return: boolean - true if all the shards of the file are committed
+    :raise sqlite3.OperationalError: the shard couldn't be recorded, the message should be delivered again
+    (acknowledged, no other shard would ever complete the file)
+    """
+    database_connection.ensure_connection()
+    database_connection.create_table('''CREATE TABLE IF NOT EXISTS ingest_shards (path text, file_size integer,
+            byte_start integer, byte_end integer, UNIQUE (path, file_size, byte_start) ON CONFLICT REPLACE)''')
+    results = database_connection.transaction_select(
+        [('''INSERT INTO ingest_shards VALUES (?, ?, ?, ?)''', [(file_path, file_size, byte_start, byte_end)])],
+        '''SELECT SUM(byte_end - byte_start) FROM ingest_shards WHERE path = ? AND file_size = ?''',
+        (file_path, file_size))
+    if not results:
+        database_connection.release()
+        raise sqlite3.OperationalError(f"recording the shard {byte_start}-{byte_end} of {file_path} failed")
+    complete = results[0][0] >= file_size
+    if complete:
+        database_connection.transaction_select(
+            [('''DELETE FROM ingest_shards WHERE path = ? AND file_size = ?''', [(file_path, file_size)])],
+            '''SELECT changes()''')
+    database_connection.release()
+    return complete
+
+
+def ingest_message(message: Message, chunk_size: int, database_connection: DatabaseHandler,
+                   skip_ingested: bool = True) -> bool:
+    """
+    the work of the database consumers for one message, loading the file (or the shard)
+    unless the ingest ledger already holds its content, then recording the committed shard
+    and the file in the ledger once all of it is committed
+    :param message: the decoded message of the file
+    :param chunk_size: number of rows per transaction, 0 to read the whole file at once
+    :param database_connection: persistent DatabaseHandler of the consumer
+    :param skip_ingested: either skip the files of the ledger or load every file again
+    :return: boolean - true if the graph should be notified, once for every file,
+    false for a file which can't be read (the message is dropped)
+    :raise sqlite3.OperationalError: a transaction failed, the message should be delivered again
+    """
+    byte_range = (message.byte_start, message.byte_end) if message.byte_end else None
+    if skip_ingested and check_ingested(database_connection, message.path, message.table_name, message.content_hash):
+        print(f"{message.path} is already ingested, skipping to the graph")
+        return message.byte_start == 0
+    results = process_file(message.path, message.file_type, message.table_name, chunk_size,
+                           database_connection, byte_range=byte_range, raise_database_errors=True)
+    # a failed shard isn't recorded, so a file with a failed shard is never complete nor in the ledger
+    complete = bool(results) and (byte_range is None or record_shard(
+        database_connection, message.path, message.file_size, message.byte_start, message.byte_end))
+    if complete:
+        record_ingested(database_connection, message.path, message.table_name, message.content_hash)
+    return complete
+
+
+def create_ledger_if_not_exist(database_connection: DatabaseHandler) -> None:
+    """
+    the ingest ledger, one row for every file loaded into every table,
+    with the size and the modification time of the file when it was loaded and the hash of its content
+    :param database_connection: DatabaseHandler instance
+    """
+    database_connection.create_table('''CREATE TABLE IF NOT EXISTS ingest_ledger (path text, table_name text,
+            file_size integer, mtime integer, content_hash text, ingested_at float,
+            UNIQUE (path, table_name) ON CONFLICT REPLACE)''')
+    database_connection.create_index('''CREATE INDEX IF NOT EXISTS ingest_ledger_content
+            ON ingest_ledger (table_name, file_size, content_hash)''')
+
+
+def check_ingested(database_connection: DatabaseHandler, file_path: str, table_name: str,
+                   content_hash: str = '') -> bool:
+    """
+    checking the ledger, a file with the same path, size and modification time is ingested without reading it,
+    otherwise the content is hashed (only if a file of the same size is in the ledger) and looked up,
+    so a touched or copied file is ingested too, and recorded under its path for the next time
+    :param database_connection: DatabaseHandler instance
+    :param file_path: filepath normal to the operating system
+    :param table_name: table name
+    :param content_hash: hash of the content from the message, empty to hash the file if needed
+    :return: boolean - true if the content of the file is already in the table
+    """
+    if not os.path.isfile(file_path):
+        return False
+    stat = os.stat(file_path)
+    database_connection.ensure_connection()
+    create_ledger_if_not_exist(database_connection)
+    results = database_connection.transaction_select([], '''SELECT 1 FROM ingest_ledger
+            WHERE path = ? AND table_name = ? AND file_size = ? AND mtime = ?''',
+                                                     (file_path, table_name, stat.st_size, stat.st_mtime_ns))
+    ingested = bool(results)
+    if not ingested:
+        same_size = database_connection.transaction_select([], '''SELECT 1 FROM ingest_ledger
+                WHERE table_name = ? AND file_size = ? LIMIT 1''', (table_name, stat.st_size))
+        if same_size:
+            content_hash = content_hash or hash_file(file_path)
+            ingested = bool(database_connection.transaction_select([], '''SELECT 1 FROM ingest_ledger
+                    WHERE table_name = ? AND file_size = ? AND content_hash = ? LIMIT 1''',
+                                                                   (table_name, stat.st_size, content_hash)))
+            if ingested:
+                record_ingested(database_connection, file_path, table_name, content_hash)
+    database_connection.release()
+    return ingested
+
+
+def record_ingested(database_connection: DatabaseHandler, file_path: str, table_name: str,
+                    content_hash: str = '') -> None:
+    """
+    recording the loaded file in the ledger, with its current size, modification time and content hash
+    :param database_connection: DatabaseHandler instance
+    :param file_path: filepath normal to the operating system
+    :param table_name: table name
+    :param content_hash: hash of the content from the message, empty to hash the file
+    """
+    stat = os.stat(file_path)
+    database_connection.ensure_connection()
+    create_ledger_if_not_exist(database_connection)
+    database_connection.transaction_select(
+        [('''INSERT INTO ingest_ledger VALUES (?, ?, ?, ?, ?, ?)''',
+          [(file_path, table_name, stat.st_size, stat.st_mtime_ns, content_hash or hash_file(file_path),
+            time.time())])],
+        '''SELECT changes()''')
+    database_connection.release()
+
+
+def get_chunk_statements(dataframe: pandas.DataFrame, table_name: str, refresh_rollup: bool = True,
+                         load_mode: str = default_load_mode) -> list:
+    """
+    preparing the statements of one transaction, inserting the rows of the chunk
+    (into the table, or into the staging table then merging and clearing it)
+    then recomputing the rollup rows of every month the chunk touched (the months of the rows it replaced too,
+    kept in chunk_months for the transaction) and recording the months as touched,
+    only if the chunk changed rows of the table (a replace always does, a merge of known rows doesn't)
+    the rows carry the month key of their date (see add_month_key)
+    when the rollup is left to the caller the months are kept in pending_months until it's rebuilt,
+    a graph refreshed in between doesn't read them from the old rollup
+    :param dataframe: one chunk of the file
+    :param table_name: table name
+    :param refresh_rollup: either recompute the rollup in this transaction or leave it to the caller
+    :param load_mode: replace/first_wins/last_wins
+    :return: list of (query, data) pairs and (query, data, index) triples for DatabaseHandler.insert_chunks
+    """
+    with timer('invoices_stage_seconds', stage='order_headers'):
+        dataframe = add_month_key(apply_schema(order_headers(dataframe)))
+    if 'replace' == load_mode:
+        # the months of the rows the chunk replaces are refreshed too, a row can move to another month
+        statements = [(get_displaced_months_query(table_name),
+                       DataframeRows(dataframe[['InvoiceId', 'CustomerId']])),
+                      (get_insert_many_query(table_name), DataframeRows(dataframe))]
+    else:
+        statements = [(get_staging_insert_query(table_name), DataframeRows(dataframe))]
+        if 'last_wins' == load_mode:
+            # first_wins never replaces a row, last_wins can move one to another month
+            statements.append((get_staged_displaced_months_query(table_name), [()]))
+        statements.append((get_staging_merge_query(table_name, load_mode), [()]))
+        statements.append(('''DELETE FROM temp.''' + get_staging_table_name(table_name), [()]))
+    # the pair writing into the table (the insert or the merge), the months are refreshed and touched
+    # only if it changed rows
+    table_statement = len(statements) - 1 if 'replace' == load_mode else len(statements) - 2
+    month_keys = dataframe['InvoiceMonth'].dropna().unique().tolist()
+    statements.append(('''INSERT INTO chunk_months VALUES (?)''', [(month_key,) for month_key in month_keys]))
+    if refresh_rollup:
+        statements.append((get_rollup_clear_query(table_name), [()], table_statement))
+        statements.append((get_rollup_refresh_query(table_name), [()], table_statement))
+    statements.append((get_chunk_touched_months_query(refresh_rollup), [(table_name,)], table_statement))
+    statements.append(('''DELETE FROM chunk_months''', [()]))
+    return statements
+
+
+def read_chunks(file_path: str, file_type: str, chunk_size: int, byte_range: tuple = None):
+    """
+    reading the file lazily, chunk after chunk, csv with the pandas chunksize,
+    json (a single array of objects) with an incremental decoder, ndjson (an object on every line) line after line,
+    parquet by row groups and arrow (the ipc file format) by slices of the memory mapped file
+    every chunk has the types of invoice_schema
+    :param file_path: filepath normal to the operating system
+    :param file_type: CSV/JSON/NDJSON/PARQUET/ARROW
+    :param chunk_size: number of rows in every chunk, 0 to read the whole file as one chunk
+    :param byte_range: (byte_start, byte_end) of a csv or ndjson shard, None to read the whole file
+    :return: generator of dataframes with up to chunk_size rows
+    """
+    if byte_range:
+        # only the file types split by main.split_file, on line boundaries, get here
+        with io.BufferedReader(ByteRangeFile(file_path, byte_range[0], byte_range[1], "csv" == file_type)) as file:
+            yield from read_chunks(file, file_type, chunk_size)
+
+    elif file_type in columnar_types:
+        yield from (apply_schema(dataframe) for dataframe in read_columnar_chunks(file_path, file_type, chunk_size))
+
+    elif not chunk_size:
         if "json" == file_type:
-            dataframe = pandas.read_json(file_path)
+            yield apply_schema(pandas.read_json(file_path, dtype=False, convert_dates=False))
+
+        elif "ndjson" == file_type:
+            yield apply_schema(pandas.read_json(file_path, lines=True, dtype=False, convert_dates=False))
 
         elif "csv" == file_type:
-            dataframe = pandas.read_csv(file_path)
-    except pandas.errors.ParserError as e:
-        print("reading failed: ", e.args[0])
-        return 0
+            yield apply_schema(pandas.read_csv(file_path, dtype=get_csv_dtypes()))
+
+    elif "json" == file_type:
+        yield from (apply_schema(dataframe) for dataframe in read_json_chunks(file_path, chunk_size))
+
+    elif "ndjson" == file_type:
+        with pandas.read_json(file_path, lines=True, chunksize=chunk_size, dtype=False, convert_dates=False) as reader:
+            yield from (apply_schema(dataframe) for dataframe in reader)
+
+    elif "csv" == file_type:
+        yield from (apply_schema(dataframe)
+                    for dataframe in pandas.read_csv(file_path, chunksize=chunk_size, dtype=get_csv_dtypes()))
 
-    dataframe = order_headers(dataframe)
-    return database_connection.insert_many(insert_many_query, dataframe.values.tolist())
+
+def read_columnar_chunks(file_path: str, file_type: str, chunk_size: int):
+    """
+    reading a parquet or an arrow file through a memory map,
+    only the rows of the current chunk are converted to a dataframe
+    :param file_path: filepath of a parquet file or an arrow ipc file (feather v2)
+    :param file_type: PARQUET/ARROW
+    :param chunk_size: number of rows in every chunk, 0 to read the whole file as one chunk
+    :return: generator of dataframes with up to chunk_size rows
+    """
+    if pyarrow is None:
+        raise ValueError(f"reading {file_type} files needs the pyarrow module")
+    with pyarrow.memory_map(file_path) as source:
+        if "parquet" == file_type:
+            parquet_file = pyarrow.parquet.ParquetFile(source)
+            if not chunk_size:
+                yield parquet_file.read().to_pandas()
+            else:
+                yield from (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunk_size))
+        else:
+            # the record batches are read whole, a compressed file (to_feather writes lz4 by default)
+            # is decompressed into memory, then cut into chunks
+            table = pyarrow.ipc.open_file(source).read_all()
+            if not chunk_size:
+                yield table.to_pandas()
+            else:
+                yield from (table.slice(offset, chunk_size).to_pandas()
+                            for offset in range(0, table.num_rows, chunk_size))
 
 
-def build_dataframe(table_name: str) -> pandas.DataFrame:
+def get_csv_dtypes() -> dict:
+    """
+    :return: dict of the types read_csv converts to while parsing, all the types of invoice_schema
+    but the dates and the integers (read_csv wraps an integer out of the range silently, apply_schema checks them)
+    """
+    return {column: dtype for column, dtype in invoice_schema.items() if not str(dtype).startswith('datetime')
+            and not pandas.api.types.is_integer_dtype(dtype)}
+
+
+def apply_schema(dataframe: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    converting the columns which don't have the type of invoice_schema yet,
+    the ids to int32, the totals to float64, the dates to timestamps and the places to categories
+    :param dataframe: dataframe with the invoice columns
+    :return: dataframe with the declared types
+    :raise ValueError: a value can't have its declared type, see get_integer_column
+    """
+    conversions = {column: dtype for column, dtype in invoice_schema.items()
+                   if column in dataframe and dtype is not str and not str(dtype).startswith('datetime')
+                   and dataframe[column].dtype != dtype}
+    integers = {column: get_integer_column(dataframe[column], dtype) for column, dtype in conversions.items()
+                if pandas.api.types.is_integer_dtype(dtype)}
+    if integers:
+        dataframe = dataframe.assign(**integers)
+        conversions = {column: dtype for column, dtype in conversions.items() if column not in integers}
+    if conversions:
+        dataframe = dataframe.astype(conversions)
+    if 'InvoiceDate' in dataframe and not pandas.api.types.is_datetime64_any_dtype(dataframe['InvoiceDate']):
+        dataframe = dataframe.assign(InvoiceDate=parse_dates(dataframe['InvoiceDate']))
+    return dataframe
+
+
+def get_integer_column(column: pandas.Series, dtype: str) -> pandas.Series:
+    """
+    converting a column to an integer type, the same ValueError for every value it can't hold,
+    whether the file is read whole or streamed (pandas raises TypeError, OverflowError or wraps the value)
+    :param column: column of the dataframe
+    :param dtype: integer type, int32
+    :return: the converted column
+    """
+    try:
+        values = pandas.to_numeric(column)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"{column.name} has a value which isn't a number: {e}") from e
+    if values.isna().any():
+        raise ValueError(f"{column.name} has missing values")
+    bounds = numpy.iinfo(dtype)
+    if len(values) and (values.min() < bounds.min or values.max() > bounds.max):
+        raise ValueError(f"{column.name} has a value out of the {dtype} range")
+    return values.astype(dtype)
+
+
+def parse_dates(dates: pandas.Series) -> pandas.Series:
+    """
+    parsing the dates with the fixed invoice_date_format first, the fast path of every file written like the sources,
+    inferring the format only if a date doesn't match it
+    :param dates: series of date strings
+    :return: series of timestamps
+    """
+    try:
+        return pandas.to_datetime(dates, format=invoice_date_format)
+    except ValueError:
+        return pandas.to_datetime(dates)
+
+
+def add_month_key(dataframe: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    adding the InvoiceMonth column, the integer month key (YYYYMM) of the date, computed once at ingest
+    so the rollup and the aggregations compare integers instead of formatting the dates of every row
+    :param dataframe: dataframe with the InvoiceDate column, parsed or not
+    :return: dataframe with the InvoiceMonth column last, None for a missing date
+    """
+    dates = dataframe['InvoiceDate']
+    if not pandas.api.types.is_datetime64_any_dtype(dates):
+        dates = parse_dates(dates)
+    month_keys = dates.dt.year * 100 + dates.dt.month
+    if month_keys.hasnans:
+        month_keys = month_keys.astype(object).where(month_keys.notna(), None)
+    else:
+        month_keys = month_keys.astype('int32')
+    return dataframe.assign(InvoiceMonth=month_keys)
+
+
+def get_month_key(month: str) -> int:
+    """
+    :param month: month string, 'YYYY-MM'
+    :return: integer month key, YYYYMM
+    """
+    return int(month[:4]) * 100 + int(month[5:7])
+
+
+def get_month_name(month_key: int) -> str:
+    """
+    :param month_key: integer month key, YYYYMM
+    :return: month string, 'YYYY-MM'
+    """
+    return f"{month_key // 100:04d}-{month_key % 100:02d}"
+
+
+class DataframeRows:
+    def __init__(self, dataframe: pandas.DataFrame, block_size: int = None):
+        """
+        the rows of a dataframe for executemany, zipped one tuple at a time from the columns while sqlite
+        inserts them, instead of a nested list of the whole chunk, only block_size rows are python values at a time
+        (the values of a category column are shared strings), the dates are formatted as the text of the files
+        :param dataframe: dataframe with the columns in the order of the table
+        :param block_size: number of rows converted at a time, rows_block_size by default
+        """
+        self.dataframe = dataframe
+        self.block_size = block_size or rows_block_size
+
+    def __len__(self) -> int:
+        return len(self.dataframe)
+
+    def __iter__(self):
+        for start in range(0, len(self.dataframe), self.block_size):
+            block = self.dataframe.iloc[start:start + self.block_size]
+            columns = [block[column].dt.strftime(invoice_date_format).tolist()
+                       if pandas.api.types.is_datetime64_any_dtype(block[column])
+                       else block[column].tolist() for column in block.columns]
+            yield from zip(*columns)
+
+
+class ByteRangeFile(io.RawIOBase):
+    def __init__(self, file_path: str, byte_start: int, byte_end: int, header: bool = True):
+        """
+        file like object reading only a byte range of the file, the range is preceded by
+        the header line of the file when it doesn't start at the beginning, so every shard is a whole csv
+        :param file_path: filepath normal to the operating system
+        :param byte_start: first byte of the range
+        :param byte_end: byte after the last byte of the range
+        :param header: either the first line of the file is a header (csv) or a row like the others (ndjson)
+        """
+        super().__init__()
+        self.file = open(file_path, 'rb')
+        self.prefix = self.file.readline() if byte_start and header else b''
+        self.file.seek(byte_start)
+        self.remaining = byte_end - byte_start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        """
+        reading the header first, then the range, never beyond its end
+        :param buffer: writable buffer
+        :return: number of bytes read, 0 at the end of the range
+        """
+        if self.prefix:
+            data, self.prefix = self.prefix[:len(buffer)], self.prefix[len(buffer):]
+        else:
+            data = self.file.read(min(len(buffer), self.remaining))
+            self.remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def read_json_chunks(file_path: str, chunk_size: int):
+    """
+    decoding a json array object after object, reading the file in fixed size blocks
+    so only the current block and the current chunk are kept in memory,
+    the next block is read only when the object is cut by the end of the block, any other error fails the file
+    :param file_path: filepath of a json file holding a single array of objects
+    :param chunk_size: number of rows in every chunk
+    :return: generator of dataframes with up to chunk_size rows
+    """
+    decoder = json.JSONDecoder()
+    records = []
+    with open(file_path, encoding='utf-8') as file:
+        buffer = file.read(json_block_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"{file_path} is not a json array")
+        position = 1
+        while True:
+            position = json_separators.match(buffer, position).end()
+            if position == len(buffer) or buffer[position] != ']':
+                try:
+                    record, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as e:
+                    # the object is cut by the end of the block (the failing token runs to the end), reading more
+                    if not is_cut_json(buffer, e) or len(buffer) - position > json_record_limit:
+                        raise
+                    block = file.read(json_block_size)
+                    if not block:
+                        raise
+                    buffer, position = buffer[position:] + block, 0
+                    continue
+                records.append(record)
+                if len(records) == chunk_size:
+                    yield pandas.DataFrame(records)
+                    records = []
+            else:
+                break
+    if records:
+        yield pandas.DataFrame(records)
+
+
+def is_cut_json(buffer: str, error: json.JSONDecodeError) -> bool:
+    """
+    :param buffer: the decoded buffer
+    :param error: the decoding error
+    :return: boolean - true if the error is the end of the buffer, a string or a token the next block may complete
+    """
+    if error.msg.startswith('Unterminated string'):
+        return True
+    return json_cut_token.match(buffer, error.pos).end() == len(buffer)
+
+
+def build_dataframe(table_name: str, aggregate_in_sql: bool = True, use_rollup: bool = True,
+                    database_connection: DatabaseHandler = None) -> pandas.DataFrame:
     """
     establishing connection to database, and requesting dataframe of the data
     then processing it and preparing it for the graph
+    by default the monthly rollup table maintained at ingest is read as is,
+    if it doesn't exist yet the grouping is done inside the database and only one row per month is returned,
+    otherwise every row is loaded and grouped with pandas
     :param table_name: database name for the query
+    :param aggregate_in_sql: either group by inside sqlite or in pandas
+    :param use_rollup: either read the rollup table or aggregate the rows
+    :param database_connection: persistent DatabaseHandler of the consumer, None to establish a new one
     :return: summed and counted dataframe
     """
-    database_connection = establish_connection(database_path)
-    dataframe = database_connection.to_dataframe(['CustomerId', 'InvoiceDate', 'Total'], table_name)
-    database_connection.close()
+    database_connection = reuse_connection(database_connection)
+    if use_rollup and database_connection.table_exists(get_rollup_table_name(table_name)):
+        with timer('invoices_stage_seconds', stage='rollup_read'):
+            dataframe = database_connection.query_to_dataframe(get_rollup_select_query(table_name))
+        database_connection.release()
+        return dataframe
 
-    dataframe = get_invoice_date_fixed(dataframe)
+    if aggregate_in_sql:
+        with timer('invoices_stage_seconds', stage='sql_aggregation'):
+            dataframe = database_connection.query_to_dataframe(get_monthly_aggregate_query(table_name))
+        database_connection.release()
+        return dataframe
+
+    with timer('invoices_stage_seconds', stage='pandas_aggregation'):
+        dataframe = database_connection.to_dataframe(['CustomerId', 'InvoiceMonth AS InvoiceDate', 'Total'],
+                                                     table_name)
+        database_connection.release()
+
+        dataframe = get_month_key_fixed(dataframe)
 
-    analyze_dataframe = dataframe.copy()
-    total_sum_dataframe = get_column_sum(analyze_dataframe)
+        analyze_dataframe = dataframe.copy()
+        total_sum_dataframe = get_column_sum(analyze_dataframe)
 
-    customer_count_dataframe = drop_duplicates(analyze_dataframe)
-    customer_count_dataframe = get_column_count(customer_count_dataframe)
-    return customer_count_dataframe.merge(total_sum_dataframe, how='inner', on='InvoiceDate')
+        customer_count_dataframe = drop_duplicates(analyze_dataframe)
+        customer_count_dataframe = get_column_count(customer_count_dataframe)
+        dataframe = customer_count_dataframe.merge(total_sum_dataframe, how='inner', on='InvoiceDate')
+        return get_month_names_fixed(dataframe)
 
 
-def build_graph(graph_dataframe: pandas.DataFrame, _figure_path: str, auto_open_flag: bool) -> str:
+def refresh_dataframe(table_name: str, database_connection: DatabaseHandler = None) -> pandas.DataFrame:
+    """
+    the dataframe of the graph of the table, only the months touched since the last graph of the table
+    built by this process are recomputed (read from the rollup, or grouped from their rows without a rollup)
+    and merged into it, so the database work follows the loaded months and not the history of the table,
+    the first graph (or one with more than touched_months_limit touched months) is built whole
+    (rows deleted or tables dropped outside of process_file aren't tracked)
+    :param table_name: table name
+    :param database_connection: persistent DatabaseHandler of the consumer, None to establish a new one
+    :return: summed and counted dataframe, the same as build_dataframe
+    """
+    database_connection = reuse_connection(database_connection)
+    database_connection.ensure_connection()
+    key = (database_connection.get_path(), table_name)
+    with graph_dataframes_lock:
+        cached = graph_dataframes.get(key)
+    if cached is None:
+        create_touched_months_if_not_exist(database_connection)
+    graph_dataframe, rows, last_id = cached or (None, None, 0)
+    # the ids are read before the rows, a month touched in between is merged again by the next graph
+    touched = database_connection.transaction_select([], '''SELECT id, month FROM touched_months
+            WHERE table_name = ? AND id > ? ORDER BY id''', (table_name, last_id)) or []
+    months = sorted({month for _, month in touched})
+    months_rows = 0
+    if graph_dataframe is not None and months and len(months) <= touched_months_limit:
+        with timer('invoices_stage_seconds', stage='touched_months_read'):
+            if database_connection.table_exists(get_rollup_table_name(table_name)):
+                months_rows = database_connection.transaction_select(
+                    [], get_rollup_months_query(table_name, len(months)), tuple(months))
+            else:
+                months_rows = database_connection.transaction_select(
+                    [], get_months_aggregate_query(table_name, len(months)),
+                    tuple(get_month_key(month) for month in months))
+    if months_rows != 0:
+        rows = merge_months(rows, months_rows, months)
+        graph_dataframe = pandas.DataFrame(sorted(rows.values()), columns=['InvoiceDate', 'Count', 'Total'])
+        increment('invoices_graph_cache_total', outcome='merged')
+    elif graph_dataframe is None or months:
+        graph_dataframe = build_dataframe(table_name, database_connection=database_connection)
+        rows = {row[0]: row for row in graph_dataframe.itertuples(index=False, name=None)}
+        increment('invoices_graph_cache_total', outcome='built')
+    else:
+        increment('invoices_graph_cache_total', outcome='unchanged')
+    cache_graph_dataframe(key, (graph_dataframe, rows, touched[-1][0] if touched else last_id))
+    database_connection.release()
+    return graph_dataframe
+
+
+def cache_graph_dataframe(key: tuple, entry: tuple) -> None:
+    """
+    keeping the graph dataframe of the table as the most recently used,
+    evicting the least recently used tables above graph_cache_size
+    :param key: (database path, table name)
+    :param entry: (graph dataframe, dict of its rows by month, id of the last touched month merged into it)
+    """
+    with graph_dataframes_lock:
+        graph_dataframes[key] = entry
+        graph_dataframes.move_to_end(key)
+        while len(graph_dataframes) > graph_cache_size:
+            graph_dataframes.popitem(last=False)
+
+
+def merge_months(rows: dict, months_rows: list, months: list) -> dict:
+    """
+    replacing the rows of the recomputed months, a month without a recomputed row is removed
+    :param rows: dict of month -> (month, count, total) of the last graph
+    :param months_rows: list of (month, count, total) of the recomputed months
+    :param months: list of the recomputed months
+    :return: new dict of month -> (month, count, total)
+    """
+    months = set(months)
+    rows = {month: row for month, row in rows.items() if month not in months}
+    rows.update((row[0], tuple(row)) for row in months_rows)
+    return rows
+
+
+def build_graph(graph_dataframe: pandas.DataFrame, _figure_path: str, auto_open_flag: bool,
+                render_mode: str = None, skip_unchanged: bool = True) -> str:
     """
     getting the dataframe from graph_consumer and
     extracting the columns to present them properly in browser
+    the data is hashed first, the html file isn't built nor written again when its data didn't change
     :param auto_open_flag: either auto_open or not
     :param _figure_path: path to figure file in database folder
     :param graph_dataframe: dataframe['InvoiceDate', 'Count', 'Total']
+    :param render_mode: directory/inline, see render_modes, graph_render_mode by default
+    :param skip_unchanged: either skip the write when the file holds the same data or always write it
     :return: All Done str
     """
+    render_mode = render_mode or graph_render_mode
+    if render_mode not in render_modes:
+        raise ValueError(f"unknown render mode {render_mode}")
+    figure_hash = (render_mode, hash_dataframe(graph_dataframe))
+    if skip_unchanged and figure_hashes.get(_figure_path) == figure_hash and os.path.isfile(_figure_path):
+        increment('invoices_figure_writes_total', outcome='unchanged')
+        return "Graph Unchanged, Skipped the html File"
     dates, counts, totals = get_columns(graph_dataframe)
-    figure = get_figure(dates, counts, totals)
-    write_html(figure, _figure_path, auto_open_flag)
+    with timer('invoices_stage_seconds', stage='figure'):
+        figure = get_figure(dates, counts, totals)
+    with timer('invoices_stage_seconds', stage='html_write'):
+        write_html(figure, _figure_path, auto_open_flag, render_mode)
+    figure_hashes[_figure_path] = figure_hash
+    increment('invoices_figure_writes_total', outcome='written')
     return "Updated html File and Opened it"
 
 
-def graph_consumer_callback(channel, method, properties, body) -> None:
+def hash_dataframe(dataframe: pandas.DataFrame) -> str:
+    """
+    hashing the columns and the values of the dataframe
+    :param dataframe: dataframe of the graph
+    :return: hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(list(dataframe.columns)).encode('utf-8'))
+    digest.update(pandas.util.hash_pandas_object(dataframe, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def graph_consumer_callback(channel, method, properties, body, database_connection: DatabaseHandler = None) -> None:
     """
     when the queue is receiving data the callback method is invoked
     :param channel: channel of communication
@@ -84,21 +773,52 @@ def graph_consumer_callback(channel, method, properties, body) -> None:
     :param properties: user-defined properties on the message
     :type properties: pika.spec.BasicProperties
     :type body: bytes
+    :param database_connection: persistent DatabaseHandler of the consumer, None to establish a new one
     """
-    table_name = body.decode()
+    table_name = decode_message(body).table_name
     print(f"Graph Consumer received the name of the database: {table_name}")
-    graph_dataframe = build_dataframe(table_name)
-    build_graph(graph_dataframe, figure_path, True)
+    refresh_graph(table_name, database_connection)
+
+
+def refresh_graph(table_name: str, database_connection: DatabaseHandler = None, output: str = None) -> str:
+    """
+    refreshing the dataframe of the table (only its touched months) then building the graph from it,
+    into the html file of the table or into the data file of the dashboard
+    :param table_name: table name
+    :param database_connection: persistent DatabaseHandler of the consumer, None to establish a new one
+    :param output: html/dashboard, see graph_outputs, graph_output by default
+    :return: str from build_graph or update_dashboard
+    """
+    output = output or graph_output
+    if output not in graph_outputs:
+        raise ValueError(f"unknown graph output {output}")
+    graph_dataframe = refresh_dataframe(table_name, database_connection)
+    if 'dashboard' == output:
+        with timer('invoices_stage_seconds', stage='dashboard_write'):
+            return update_dashboard(table_name, graph_dataframe, graph_auto_open)
+    return build_graph(graph_dataframe, get_figure_path(table_name), graph_auto_open)
 
 
-def write_html(figure: go.Figure, _figure_path: str, auto_open_flag: bool) -> None:
+def get_figure_path(table_name: str) -> str:
     """
-    writing the data into .html file
+    :param table_name: table name
+    :return: path of the html file of the table graph
+    """
+    return os.path.join(figure_directory, table_name + '.html')
+
+
+def write_html(figure: go.Figure, _figure_path: str, auto_open_flag: bool, render_mode: str = 'inline') -> None:
+    """
+    writing the data into .html file, with the directory render mode plotly writes plotly.min.js
+    next to the file only if it's not there yet
     :param figure: the graph
     :param _figure_path: path to the .html file
     :param auto_open_flag: boolean to or not to open the web
+    :param render_mode: directory/inline, see render_modes
     """
-    figure.write_html(_figure_path, auto_open=auto_open_flag)
+    os.makedirs(os.path.dirname(os.path.abspath(_figure_path)), exist_ok=True)
+    figure.write_html(_figure_path, auto_open=auto_open_flag,
+                      include_plotlyjs='directory' if 'directory' == render_mode else True)
 
 
 def get_figure(dates: list, counts: list, totals: list) -> go.Figure:
@@ -154,17 +874,23 @@ def drop_duplicates(analyze_dataframe: pandas.DataFrame) -> pandas.DataFrame:
     return analyze_dataframe.drop_duplicates(subset=['CustomerId', 'InvoiceDate'])
 
 
-def get_invoice_date_fixed(dataframe: pandas.DataFrame) -> pandas.DataFrame:
+def get_month_key_fixed(dataframe: pandas.DataFrame) -> pandas.DataFrame:
     """
-    trying to change the type of values of InvoiceDate
-    :param dataframe: dataframe with 3 columns
-    :return: dataframe with fixed dates
+    dropping the rows without a month key, grouping on the integer keys instead of the formatted dates
+    :param dataframe: dataframe with 3 columns, the month keys as InvoiceDate
+    :return: dataframe with integer month keys
     """
-    try:
-        dataframe.loc[:, 'InvoiceDate'] = pandas.to_datetime(dataframe['InvoiceDate']).dt.strftime('%Y-%m')
-        return dataframe
-    except ValueError as e:
-        print("to_datetime Error: ", e.args[0])
+    dataframe = dataframe.dropna(subset=['InvoiceDate'])
+    return dataframe.astype({'InvoiceDate': 'int64'})
+
+
+def get_month_names_fixed(dataframe: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    formatting the month keys of the grouped dataframe, one per month instead of one per row
+    :param dataframe: grouped dataframe, the month keys as InvoiceDate
+    :return: dataframe with the months as 'YYYY-MM'
+    """
+    return dataframe.assign(InvoiceDate=[get_month_name(month_key) for month_key in dataframe['InvoiceDate']])
 
 
 def get_insert_many_query(table_name: str) -> str:
@@ -173,32 +899,338 @@ def get_insert_many_query(table_name: str) -> str:
     :param table_name: table name
     :return: insert string
     """
-    return '''REPLACE INTO ''' + table_name + ''' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+    return '''REPLACE INTO ''' + table_name + ''' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+
+def get_staging_table_name(table_name: str) -> str:
+    """
+    :param table_name: table name
+    :return: name of the temporary staging table of the table
+    """
+    return table_name + '_staging'
+
+
+def get_staging_insert_query(table_name: str) -> str:
+    """
+    :param table_name: table name
+    :return: insert string of the staging table, without any constraint to check
+    """
+    return '''INSERT INTO temp.''' + get_staging_table_name(table_name) + ''' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+
+def get_staging_merge_query(table_name: str, load_mode: str) -> str:
+    """
+    merging the staging table into the table in one statement, in the order of the unique key
+    (so the index is updated page after page) and in the order of arrival for rows with the same key,
+    first_wins ignores every row whose key is already in the table, last_wins replaces it
+    :param table_name: table name
+    :param load_mode: first_wins/last_wins
+    :return: insert select string
+    """
+    conflict = 'IGNORE' if 'first_wins' == load_mode else 'REPLACE'
+    return '''INSERT OR ''' + conflict + ''' INTO ''' + table_name + '''
+            SELECT * FROM temp.''' + get_staging_table_name(table_name) + '''
+            ORDER BY InvoiceId, CustomerId, rowid'''
+
+
+def get_monthly_aggregate_query(table_name: str) -> str:
+    """
+    the same result as get_month_key_fixed, drop_duplicates, get_column_count, get_column_sum and get_month_names_fixed
+    but grouped inside the database by the integer month key, one row per month
+    with the distinct customers count and the totals sum, only the month of every group is formatted
+    :param table_name: table name
+    :return: select string
+    """
+    return '''SELECT printf('%04d-%02d', InvoiceMonth / 100, InvoiceMonth % 100) AS InvoiceDate,
+            COUNT(DISTINCT CustomerId) AS Count, SUM(Total) AS Total
+            FROM ''' + table_name + ''' WHERE InvoiceMonth IS NOT NULL GROUP BY InvoiceMonth ORDER BY InvoiceMonth'''
+
+
+def get_rollup_table_name(table_name: str) -> str:
+    """
+    :param table_name: table name
+    :return: name of the monthly rollup table of the table
+    """
+    return table_name + '_monthly'
+
+
+def get_displaced_months_query(table_name: str) -> str:
+    """
+    keeping the month of the row the new row replaces, executed with (InvoiceId, CustomerId) before the insert
+    :param table_name: table name
+    :return: insert select string
+    """
+    return '''INSERT INTO chunk_months SELECT InvoiceMonth FROM ''' + table_name + '''
+            WHERE InvoiceId = ? AND CustomerId = ? AND InvoiceMonth IS NOT NULL'''
+
+
+def get_staged_displaced_months_query(table_name: str) -> str:
+    """
+    keeping the months of the rows the staged rows replace, before the merge
+    :param table_name: table name
+    :return: insert select string
+    """
+    return '''INSERT INTO chunk_months SELECT DISTINCT table_rows.InvoiceMonth
+            FROM temp.''' + get_staging_table_name(table_name) + ''' AS staged_rows
+            JOIN ''' + table_name + ''' AS table_rows
+            ON table_rows.InvoiceId = staged_rows.InvoiceId AND table_rows.CustomerId = staged_rows.CustomerId
+            WHERE table_rows.InvoiceMonth IS NOT NULL'''
+
+
+def get_rollup_clear_query(table_name: str) -> str:
+    """
+    removing the rollup rows of the months of chunk_months, a month left without rows has no row
+    :param table_name: table name
+    :return: delete string
+    """
+    return '''DELETE FROM ''' + get_rollup_table_name(table_name) + '''
+            WHERE InvoiceDate IN (SELECT printf('%04d-%02d', month / 100, month % 100) FROM chunk_months)'''
+
+
+def get_rollup_refresh_query(table_name: str) -> str:
+    """
+    recomputing the months of chunk_months from the rows of the table, after get_rollup_clear_query
+    recomputing instead of adding keeps the rollup right when rows are replaced or ignored as duplicates
+    :param table_name: table name
+    :return: insert select string
+    """
+    return '''INSERT INTO ''' + get_rollup_table_name(table_name) + '''
+            SELECT printf('%04d-%02d', InvoiceMonth / 100, InvoiceMonth % 100), COUNT(DISTINCT CustomerId), SUM(Total)
+            FROM ''' + table_name + ''' WHERE InvoiceMonth IN (SELECT month FROM chunk_months) GROUP BY InvoiceMonth'''
+
+
+def get_touched_month_query(committed: bool = True) -> str:
+    """
+    replacing the row of the month, the new row gets a new id after all the others, executed with (table, month)
+    :param committed: either record the month as touched or keep it pending until the rollup is rebuilt
+    :return: insert string
+    """
+    if not committed:
+        return '''INSERT INTO pending_months (table_name, month) VALUES (?, ?)'''
+    return '''INSERT INTO touched_months (table_name, month) VALUES (?, ?)'''
+
+
+def get_chunk_touched_months_query(committed: bool = True) -> str:
+    """
+    the same as get_touched_month_query for every month of chunk_months, the replaced rows months too,
+    executed with (table,)
+    :param committed: either record the months as touched or keep them pending until the rollup is rebuilt
+    :return: insert select string
+    """
+    return '''INSERT INTO ''' + ('touched_months' if committed else 'pending_months') + ''' (table_name, month)
+            SELECT ?, printf('%04d-%02d', month / 100, month % 100) FROM chunk_months'''
+
+
+def get_months_aggregate_query(table_name: str, count: int) -> str:
+    """
+    the same as get_monthly_aggregate_query for some months only, executed with the month keys
+    :param table_name: table name
+    :param count: number of months
+    :return: select string
+    """
+    return '''SELECT printf('%04d-%02d', InvoiceMonth / 100, InvoiceMonth % 100) AS InvoiceDate,
+            COUNT(DISTINCT CustomerId) AS Count, SUM(Total) AS Total
+            FROM ''' + table_name + ''' WHERE InvoiceMonth IN (''' + ', '.join('?' * count) + ''')
+            GROUP BY InvoiceMonth ORDER BY InvoiceMonth'''
+
+
+def get_rollup_months_query(table_name: str, count: int) -> str:
+    """
+    :param table_name: table name
+    :param count: number of months, executed with the months
+    :return: select string of the rollup rows of the months
+    """
+    return '''SELECT InvoiceDate, Count, Total FROM ''' + get_rollup_table_name(table_name) + '''
+            WHERE InvoiceDate IN (''' + ', '.join('?' * count) + ''') ORDER BY InvoiceDate'''
 
 
-def establish_connection(_database_path: str) -> DatabaseHandler:
+def get_rollup_select_query(table_name: str) -> str:
+    """
+    :param table_name: table name
+    :return: select string of the rollup, one row per month
     """
+    return '''SELECT InvoiceDate, Count, Total FROM ''' + get_rollup_table_name(table_name) + '''
+            ORDER BY InvoiceDate'''
+
+
+def establish_connection(_database_path: str, persistent: bool = False, profile: str = 'default') -> DatabaseHandler:
+    """
+    if database directory isn't exists, creating it
     creating an instance of DatabaseHandler
     :param _database_path: path to database
+    :param persistent: either keep the connection open between queries or not
+    :param profile: name of the sqlite performance profile, see database_handler.performance_profiles
     :return: instance of DatabaseHandler
     """
-    database_connection = DatabaseHandler(db_path=_database_path)
+    os.makedirs(os.path.dirname(os.path.abspath(_database_path)), exist_ok=True)
+    database_connection = DatabaseHandler(db_path=_database_path, persistent=persistent, profile=profile)
     database_connection.connect()
     return database_connection
 
 
-def create_table_if_not_exist(database_connection: DatabaseHandler, table_name: str) -> None:
+def reuse_connection(database_connection: DatabaseHandler = None) -> DatabaseHandler:
     """
-    create table query, with column types and unique columns to prevent duplicates
+    reusing the persistent connection of a consumer, reconnecting if it was lost on the way,
+    or establishing a new connection to the default database
+    :param database_connection: DatabaseHandler instance or None
+    :return: connected instance of DatabaseHandler
+    """
+    if database_connection is None:
+        return establish_connection(database_path, profile=database_profile)
+    database_connection.ensure_connection()
+    return database_connection
+
+
+def get_thread_connection(_database_path: str = None) -> DatabaseHandler:
+    """
+    sqlite connections can't be shared between threads, every pool thread
+    establishes its own persistent connection to the database once and keeps it
+    :param _database_path: path to database, database_path by default
+    :return: the DatabaseHandler of the current thread
+    """
+    _database_path = _database_path or database_path
+    if not hasattr(thread_connections, 'database_connections'):
+        thread_connections.database_connections = {}
+    if _database_path not in thread_connections.database_connections:
+        thread_connections.database_connections[_database_path] = establish_connection(
+            _database_path, persistent=True, profile=database_profile)
+    return thread_connections.database_connections[_database_path]
+
+
+def create_table_if_not_exist(database_connection: DatabaseHandler, table_name: str,
+                              defer_indexes: bool = False) -> None:
+    """
+    create table query, with column types and unique columns to prevent duplicates,
+    a table created before the month key gets it (see add_month_key_column_if_not_exist)
+    then the indexes of the graph access paths, unless they are deferred to after a bulk load,
+    and the touched months log and the chunk months the loads of every table write to
     :param database_connection: DatabaseHandler instance
     :param table_name: table name
+    :param defer_indexes: either skip the indexes (built later by create_indexes_if_not_exist) or not
     """
     query = '''CREATE TABLE IF NOT EXISTS ''' + table_name + ''' (InvoiceId integer,
             CustomerId integer, InvoiceDate text, BillingAddress text,
             BillingCity text, BillingState text, BillingCountry text,
-            BillingPostalCode text, Total float,
+            BillingPostalCode text, Total float, InvoiceMonth integer,
             UNIQUE (InvoiceId, CustomerId) ON CONFLICT IGNORE)'''
     database_connection.create_table(query)
+    add_month_key_column_if_not_exist(database_connection, table_name)
+    create_touched_months_if_not_exist(database_connection)
+    create_chunk_months_if_not_exist(database_connection)
+    if not defer_indexes:
+        create_indexes_if_not_exist(database_connection, table_name)
+
+
+def add_month_key_column_if_not_exist(database_connection: DatabaseHandler, table_name: str) -> None:
+    """
+    migrating a table created before the InvoiceMonth column, adding the column then filling it from the dates
+    (formatting them in sqlite, once), the date index it replaces is dropped, the rollup months stay the same
+    :param database_connection: DatabaseHandler instance
+    :param table_name: table name
+    """
+    database_connection.ensure_connection()
+    if database_connection.transaction_select([], "SELECT 1 FROM pragma_table_info(?) WHERE name = 'InvoiceMonth'",
+                                              (table_name,)):
+        return
+    print(f"Adding the month key to {table_name}")
+    database_connection.create_table('''ALTER TABLE ''' + table_name + ''' ADD COLUMN InvoiceMonth integer''')
+    database_connection.fill_table('''UPDATE ''' + table_name + '''
+            SET InvoiceMonth = CAST(strftime('%Y%m', InvoiceDate) AS integer)''')
+    database_connection.drop_index('''DROP INDEX IF EXISTS ''' + table_name + '''_date_customer_total''')
+
+
+def create_touched_months_if_not_exist(database_connection: DatabaseHandler) -> None:
+    """
+    the touched months log, one row for every month of every table, moved to a new id every time a load touches it,
+    so the months touched since any id are the rows after it (the ids only increase, see get_touched_month_query)
+    :param database_connection: DatabaseHandler instance
+    """
+    database_connection.create_table('''CREATE TABLE IF NOT EXISTS touched_months
+            (id integer PRIMARY KEY AUTOINCREMENT, table_name text, month text,
+            UNIQUE (table_name, month) ON CONFLICT REPLACE)''')
+
+
+def create_chunk_months_if_not_exist(database_connection: DatabaseHandler) -> None:
+    """
+    the months of the chunk being loaded, its own and the ones of the rows it replaces,
+    filled and cleared inside the transaction of the chunk, so no other connection ever sees a row
+    :param database_connection: DatabaseHandler instance
+    """
+    database_connection.create_table('''CREATE TABLE IF NOT EXISTS chunk_months
+            (month integer PRIMARY KEY ON CONFLICT IGNORE)''')
+
+
+def create_pending_months_if_not_exist(database_connection: DatabaseHandler) -> None:
+    """
+    the months touched by a load with deferred indexes, moved to the touched months log with the rebuilt rollup,
+    the months of a load which failed before its rebuild are moved by the next one
+    :param database_connection: DatabaseHandler instance
+    """
+    database_connection.create_table('''CREATE TABLE IF NOT EXISTS pending_months (table_name text, month text,
+            UNIQUE (table_name, month) ON CONFLICT IGNORE)''')
+
+
+def get_index_queries(table_name: str) -> dict:
+    """
+    covering indexes of the access paths, by month key (the rollup and the graph aggregation
+    read only the index, never the rows) and by customer
+    :param table_name: table name
+    :return: dict of index name and create index string
+    """
+    return {
+        table_name + '_month_customer_total': '''CREATE INDEX IF NOT EXISTS ''' + table_name + '''_month_customer_total
+            ON ''' + table_name + ''' (InvoiceMonth, CustomerId, Total)''',
+        table_name + '_customer_date': '''CREATE INDEX IF NOT EXISTS ''' + table_name + '''_customer_date
+            ON ''' + table_name + ''' (CustomerId, InvoiceDate)'''
+    }
+
+
+def create_indexes_if_not_exist(database_connection: DatabaseHandler, table_name: str) -> None:
+    """
+    creating the covering indexes of the table, building them from the rows if the table isn't empty
+    :param database_connection: DatabaseHandler instance
+    :param table_name: table name
+    """
+    for query in get_index_queries(table_name).values():
+        database_connection.create_index(query)
+
+
+def drop_indexes(database_connection: DatabaseHandler, table_name: str) -> None:
+    """
+    dropping the covering indexes of the table before a bulk load
+    :param database_connection: DatabaseHandler instance
+    :param table_name: table name
+    """
+    for index_name in get_index_queries(table_name):
+        database_connection.drop_index('''DROP INDEX IF EXISTS ''' + index_name)
+
+
+def create_staging_table_if_not_exist(database_connection: DatabaseHandler, table_name: str) -> None:
+    """
+    the staging table has the columns of the table without its constraints and indexes,
+    a temporary table lives as long as the connection and only this connection sees it
+    :param database_connection: DatabaseHandler instance
+    :param table_name: table name
+    """
+    database_connection.create_table('''CREATE TEMP TABLE IF NOT EXISTS ''' + get_staging_table_name(table_name)
+                                     + ''' AS SELECT * FROM ''' + table_name + ''' WHERE 0''')
+
+
+def create_rollup_table_if_not_exist(database_connection: DatabaseHandler, table_name: str) -> None:
+    """
+    create the monthly rollup table, one row per month with the distinct customers count and the totals sum
+    when created next to a table which already holds rows, filling it once from the rows
+    :param database_connection: DatabaseHandler instance
+    :param table_name: table name
+    """
+    rollup_table_name = get_rollup_table_name(table_name)
+    if database_connection.table_exists(rollup_table_name):
+        return
+    query = '''CREATE TABLE IF NOT EXISTS ''' + rollup_table_name + ''' (InvoiceDate text PRIMARY KEY,
+            Count integer, Total float)'''
+    database_connection.create_table(query)
+    database_connection.fill_table('''REPLACE INTO ''' + rollup_table_name + ''' '''
+                                   + get_monthly_aggregate_query(table_name))
 
 
 def order_headers(dataframe: pandas.DataFrame):
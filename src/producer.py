@@ -1,21 +1,24 @@
-import pika
+import time
+from src.message import describe
+from src.transport import PikaTransport
+# number of messages committed together by publish_batch
+default_batch_size = 1000
 
 
 class Producer:
-    def __init__(self):
+    def __init__(self, transport=None):
         """
         initiating the class,
         creating the first queue and creating the connection to the rabbitmq
+        :param transport: PikaTransport or MemoryTransport, a connection to the rabbitmq by default
         """
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host='localhost'))
-        self.channel = self.connection.channel()
+        self.transport = transport or PikaTransport()
 
     def declare(self):
         """
         declaring the queue which the producer will publish to
         """
-        self.channel.queue_declare(queue='files_to_database')
+        self.transport.declare('files_to_database')
 
     def publish(self, byte_string):
         """
@@ -24,12 +27,27 @@ class Producer:
         :param byte_string: bytes
         :return: str
         """
-        self.channel.basic_publish(exchange='', routing_key='files_to_database', body=byte_string)
-        return f"Sent {byte_string.decode()}"
+        self.transport.publish('files_to_database', byte_string)
+        return f"Sent {describe(byte_string)}"
+
+    def publish_batch(self, byte_strings, batch_size: int = default_batch_size):
+        """
+        publishing many messages in one pass, without waiting for the broker after every message,
+        every batch_size messages are committed together on a transactional channel,
+        the commit returns only once the broker holds all the messages of the batch
+        (the blocking connection confirms one message at a time, a transaction confirms a whole batch)
+        :param byte_strings: iterable of bytes
+        :param batch_size: number of messages in every commit
+        :return: str with the throughput
+        """
+        start = time.perf_counter()
+        count = self.transport.publish_batch('files_to_database', byte_strings, batch_size)
+        elapsed = time.perf_counter() - start
+        return f"Sent {count} Messages in {elapsed:.3f} Seconds ({count / max(elapsed, 1e-9):.0f} Messages per Second)"
 
     def close(self):
         """
         closing the connection
         :return:
         """
-        self.connection.close()
+        self.transport.close()
@@ -0,0 +1,381 @@
+import time
+import heapq
+import queue
+import pika
+import itertools
+import threading
+from typing import NamedTuple
+# seconds the memory transport waits on a queue before checking it is still consuming
+poll_interval = 0.1
+
+
+class Delivery(NamedTuple):
+    """
+    the method of a message delivered by the memory transport, the same attributes as pika.spec.Basic.Deliver
+    """
+    delivery_tag: int
+    redelivered: bool
+    routing_key: str
+
+
+class PikaTransport:
+    def __init__(self, host: str = 'localhost'):
+        """
+        the transport of the modules over rabbitmq, a pika blocking connection and its channel
+        :param host: host of the rabbitmq broker
+        """
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=host))
+        self.channel = self.connection.channel()
+        # opened by the first publish_batch, a transactional channel can't publish unconfirmed messages
+        self.batch_channel = None
+
+    def declare(self, queue_name: str):
+        """
+        declaring the queue, 'queue_declare' is idempotent
+        :param queue_name: name of the queue
+        """
+        self.channel.queue_declare(queue=queue_name)
+
+    def publish(self, queue_name: str, body: bytes):
+        """
+        publishing to the queue, using the default exchange
+        :param queue_name: name of the queue, the routing key
+        :type body: bytes
+        """
+        self.channel.basic_publish(exchange='', routing_key=queue_name, body=body)
+
+    def publish_batch(self, queue_name: str, bodies, batch_size: int) -> int:
+        """
+        publishing many messages, every batch_size messages are committed together on a transactional channel,
+        the commit returns only once the broker holds all the messages of the batch
+        (the blocking connection confirms one message at a time, a transaction confirms a whole batch)
+        :param queue_name: name of the queue, the routing key
+        :param bodies: iterable of bytes
+        :param batch_size: number of messages in every commit
+        :return: number of messages published
+        """
+        if self.batch_channel is None:
+            self.batch_channel = self.connection.channel()
+            self.batch_channel.tx_select()
+        count = 0
+        for body in bodies:
+            self.batch_channel.basic_publish(exchange='', routing_key=queue_name, body=body)
+            count += 1
+            if count % batch_size == 0:
+                self.batch_channel.tx_commit()
+        self.batch_channel.tx_commit()
+        return count
+
+    def qos(self, prefetch_count: int):
+        """
+        :param prefetch_count: number of unacknowledged messages delivered to the consumers of the transport
+        """
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+
+    def consume(self, queue_name: str, callback):
+        """
+        consuming the queue with manual acknowledgements
+        :param queue_name: name of the queue
+        :param callback: invoked with (channel, method, properties, body) for every message
+        """
+        self.channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=False)
+
+    def ack(self, delivery_tag: int, multiple: bool = False):
+        """
+        :param delivery_tag: tag of the message to acknowledge
+        :param multiple: either acknowledge all the messages up to the tag or only it
+        """
+        self.channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+
+    def nack(self, delivery_tag: int, requeue: bool):
+        """
+        :param delivery_tag: tag of the message to reject
+        :param requeue: either deliver the message again or drop it
+        """
+        self.channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+
+    def call_later(self, delay: float, callback):
+        """
+        :param delay: seconds to wait
+        :param callback: invoked once on the consuming thread
+        :return: handle for remove_timeout
+        """
+        return self.connection.call_later(delay, callback)
+
+    def remove_timeout(self, handle):
+        """
+        :param handle: handle returned by call_later
+        """
+        self.connection.remove_timeout(handle)
+
+    def add_callback_threadsafe(self, callback):
+        """
+        the only method which can be called from other threads
+        :param callback: invoked once on the consuming thread
+        """
+        self.connection.add_callback_threadsafe(callback)
+
+    def start_consuming(self):
+        """
+        delivering the messages to the callbacks until stop_consuming
+        """
+        self.channel.start_consuming()
+
+    def stop_consuming(self):
+        """
+        stopping start_consuming, must be called on the consuming thread (or with add_callback_threadsafe)
+        """
+        self.channel.stop_consuming()
+
+    def message_count(self, queue_name: str) -> int:
+        """
+        :param queue_name: name of the queue
+        :return: number of messages ready in the queue
+        """
+        return self.channel.queue_declare(queue=queue_name, passive=True).method.message_count
+
+    def purge(self, queue_name: str):
+        """
+        clearing the queue out
+        :param queue_name: name of the queue
+        """
+        self.channel.queue_purge(queue=queue_name)
+
+    def close(self):
+        """
+        closing the connection
+        """
+        self.connection.close()
+
+
+class MemoryBroker:
+    def __init__(self, manager=None):
+        """
+        a stand in for rabbitmq, the queues of the memory transports connected to it
+        with a multiprocessing manager the queues are shared with other processes,
+        declare all the queues before passing the broker to the processes
+        :param manager: multiprocessing.Manager() to share the queues between processes, None for one process
+        """
+        self.manager = manager
+        self.queues = {}
+
+    def __getstate__(self) -> dict:
+        """
+        the manager stays in the process which created it, the queue proxies are passed to the others
+        """
+        return {'manager': None, 'queues': self.queues}
+
+    def declare(self, queue_name: str):
+        """
+        creating the queue once
+        :param queue_name: name of the queue
+        :return: the queue
+        """
+        if queue_name not in self.queues:
+            self.queues[queue_name] = self.manager.Queue() if self.manager else queue.Queue()
+        return self.queues[queue_name]
+
+
+class MemoryTransport:
+    def __init__(self, broker: MemoryBroker):
+        """
+        the transport of the modules over a MemoryBroker, with the same semantics as PikaTransport,
+        manual acknowledgements, prefetch count and redelivery of unacknowledged messages when closed
+        :param broker: the broker shared by all the transports of the pipeline
+        """
+        self.broker = broker
+        self.events = queue.Queue()
+        self.timers = []
+        self.counter = itertools.count()
+        self.delivery_tags = itertools.count(1)
+        self.credit = None
+        self.prefetch_count = 0
+        self.unacked = {}
+        # number of messages acknowledged or rejected, the progress of the consumers of the transport
+        self.settled = 0
+        self.feeders = []
+        self.consuming = False
+        self.closed = threading.Event()
+
+    def declare(self, queue_name: str):
+        """
+        declaring the queue on the broker, idempotent like 'queue_declare'
+        :param queue_name: name of the queue
+        """
+        self.broker.declare(queue_name)
+
+    def publish(self, queue_name: str, body: bytes):
+        """
+        putting the message in the queue of the broker, not redelivered
+        :param queue_name: name of the queue
+        :type body: bytes
+        """
+        self.broker.declare(queue_name).put((body, False))
+
+    def publish_batch(self, queue_name: str, bodies, batch_size: int) -> int:
+        """
+        every message is held by the broker as soon as it's put, batch_size is kept for the same signature
+        :return: number of messages published
+        """
+        count = 0
+        for body in bodies:
+            self.publish(queue_name, body)
+            count += 1
+        return count
+
+    def qos(self, prefetch_count: int):
+        """
+        taking effect on the first consume, like the channel of the PikaTransport before it consumes
+        :param prefetch_count: number of unacknowledged messages delivered to the consumers of the transport
+        """
+        self.prefetch_count = prefetch_count
+
+    def consume(self, queue_name: str, callback):
+        """
+        starting a feeder thread which moves the messages of the queue to the consuming thread,
+        at most prefetch_count unacknowledged messages at a time
+        """
+        if self.credit is None:
+            self.credit = threading.Semaphore(self.prefetch_count) if self.prefetch_count else None
+        source = self.broker.declare(queue_name)
+        feeder = threading.Thread(target=self.feed, args=(queue_name, source, callback), daemon=True)
+        self.feeders.append(feeder)
+        feeder.start()
+
+    def feed(self, queue_name: str, source, callback):
+        """
+        runs on the feeder thread, until the transport is closed
+        :param queue_name: name of the queue
+        :param source: the queue of the broker
+        :param callback: invoked with (channel, method, properties, body) on the consuming thread
+        """
+        while not self.closed.is_set():
+            if self.credit and not self.credit.acquire(timeout=poll_interval):
+                continue
+            try:
+                body, redelivered = source.get(timeout=poll_interval)
+            except queue.Empty:
+                if self.credit:
+                    self.credit.release()
+                continue
+            self.events.put(('deliver', (queue_name, body, redelivered, callback)))
+
+    def deliver(self, queue_name: str, body: bytes, redelivered: bool, callback):
+        """
+        runs on the consuming thread, registering the message as unacknowledged then invoking the callback
+        """
+        delivery_tag = next(self.delivery_tags)
+        self.unacked[delivery_tag] = (queue_name, body)
+        callback(self, Delivery(delivery_tag, redelivered, queue_name), None, body)
+
+    def ack(self, delivery_tag: int, multiple: bool = False):
+        """
+        settling the messages and giving their prefetch credit back to the feeders
+        :param delivery_tag: tag of the message to acknowledge
+        :param multiple: either acknowledge all the messages up to the tag or only it
+        """
+        tags = [tag for tag in self.unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+        for tag in tags:
+            if self.unacked.pop(tag, None) is not None:
+                self.settled += 1
+                if self.credit:
+                    self.credit.release()
+
+    def nack(self, delivery_tag: int, requeue: bool):
+        """
+        settling the message, a requeued message goes to the back of its queue marked as redelivered
+        :param delivery_tag: tag of the message to reject
+        :param requeue: either deliver the message again or drop it
+        """
+        queue_name, body = self.unacked.pop(delivery_tag)
+        self.settled += 1
+        if requeue:
+            self.broker.declare(queue_name).put((body, True))
+        if self.credit:
+            self.credit.release()
+
+    def call_later(self, delay: float, callback):
+        """
+        :param delay: seconds to wait
+        :param callback: invoked once on the consuming thread, by start_consuming
+        :return: handle for remove_timeout
+        """
+        handle = (time.monotonic() + delay, next(self.counter), callback)
+        heapq.heappush(self.timers, handle)
+        return handle
+
+    def remove_timeout(self, handle):
+        """
+        :param handle: handle returned by call_later, ignored if the callback was already invoked
+        """
+        if handle in self.timers:
+            self.timers.remove(handle)
+            heapq.heapify(self.timers)
+
+    def add_callback_threadsafe(self, callback):
+        """
+        the only method which can be called from other threads
+        :param callback: invoked once on the consuming thread, after the deliveries already queued
+        """
+        self.events.put(('call', callback))
+
+    def start_consuming(self):
+        """
+        running the loop of the consuming thread, the deliveries, the callbacks and the timers,
+        until stop_consuming
+        """
+        self.consuming = True
+        while self.consuming:
+            while self.timers and self.timers[0][0] <= time.monotonic():
+                heapq.heappop(self.timers)[2]()
+            timeout = min(poll_interval, self.timers[0][0] - time.monotonic()) if self.timers else poll_interval
+            try:
+                kind, event = self.events.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                continue
+            if kind == 'deliver':
+                self.deliver(*event)
+            else:
+                event()
+
+    def stop_consuming(self):
+        """
+        stopping start_consuming, must be called on the consuming thread (or with add_callback_threadsafe),
+        the messages fed meanwhile wait for the next start_consuming
+        """
+        self.consuming = False
+
+    def message_count(self, queue_name: str) -> int:
+        """
+        :param queue_name: name of the queue
+        :return: number of messages ready in the queue, not those already fed to the consuming thread
+        """
+        return self.broker.declare(queue_name).qsize()
+
+    def purge(self, queue_name: str):
+        """
+        clearing the queue out, the unacknowledged messages are kept
+        :param queue_name: name of the queue
+        """
+        source = self.broker.declare(queue_name)
+        while True:
+            try:
+                source.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        """
+        stopping the feeders, then handing every unacknowledged (or not yet delivered) message back to the broker
+        """
+        self.consuming = False
+        self.closed.set()
+        for feeder in self.feeders:
+            feeder.join()
+        while not self.events.empty():
+            kind, event = self.events.get_nowait()
+            if kind == 'deliver':
+                self.broker.declare(event[0]).put((event[1], True))
+        for queue_name, body in self.unacked.values():
+            self.broker.declare(queue_name).put((body, True))
+        self.unacked = {}
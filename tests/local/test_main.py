@@ -18,6 +18,14 @@ class TestMain(unittest.TestCase):
         cls.producer = Producer()
         cls.producer.declare()
 
+    def test_batch(self):
+        """
+        1. testing the main run without sleeping, checking all parameters, publishing in batches and expecting All Done
+        """
+        results = main(0, files)
+        # 1
+        self.assertEqual(results, "All Done Successfully")
+
     def test_main(self):
         """
         1. testing the whole main run, checking all parameters and expecting All Done
@@ -43,8 +51,8 @@ class TestMain(unittest.TestCase):
         """
         clearing the queue out and closing the producer channel
         """
-        cls.producer.channel.queue_purge(queue='files_to_database')
-        cls.producer.channel.close()
+        cls.producer.transport.purge('files_to_database')
+        cls.producer.transport.close()
 
 
 def get_files_bad_type():
@@ -1,8 +1,14 @@
 import os
 import numpy
+import shutil
+import tempfile
 import pandas
+import sqlite3
 import unittest
 import src.processing as processing
+import src.database_handler as database_handler
+from src.main import split_file
+from src.message import create_message
 from src.database_handler import DatabaseHandler
 
 database_path = os.path.normpath(os.path.pardir + os.path.join('/dummy_database/dummy.db'))
@@ -11,7 +17,8 @@ table_name = "invoices_dummy"
 base_path = os.path.normpath(os.path.dirname(__file__) + os.path.join('/dummy_files'))
 files = [[base_path + os.path.join('/invoices_2009.json'), "json", "invoices"],
          [base_path + os.path.join('/invoices_2011.csv'), "csv", "invoices"],
-         [base_path + os.path.join('/bad_invoices_2009.json'), "json", "invoices"]]
+         [base_path + os.path.join('/bad_invoices_2009.json'), "json", "invoices"],
+         [base_path + os.path.join('/invoices_2010.ndjson'), "ndjson", "invoices"]]
 
 
 class TestProcessing(unittest.TestCase):
@@ -70,6 +77,250 @@ class TestProcessing(unittest.TestCase):
         # 5
         self.assertFalse(get_file_reply(files[0][0], files[1][1]))
 
+    def test_read_chunks(self):
+        """
+        1. streaming the json file in chunks of 3 rows, expecting 2 chunks (3 + 1)
+        2. streaming the csv file in chunks of 3 rows, expecting 2 chunks (3 + 1)
+        3. checking the streamed json holds the same rows as the whole file read
+        4. trying to stream a csv file as json, the decoding exception is raised
+        """
+        json_chunks = list(processing.read_chunks(files[0][0], files[0][1], 3))
+        # 1
+        self.assertEqual([len(chunk) for chunk in json_chunks], [3, 1])
+        csv_chunks = list(processing.read_chunks(files[1][0], files[1][1], 3))
+        # 2
+        self.assertEqual([len(chunk) for chunk in csv_chunks], [3, 1])
+        streamed = pandas.concat(json_chunks, ignore_index=True)
+        # 3
+        self.assertEqual(streamed['InvoiceId'].astype(int).tolist(),
+                         pandas.read_json(files[0][0])['InvoiceId'].tolist())
+        # 4
+        with self.assertRaises(ValueError):
+            list(processing.read_chunks(files[1][0], files[0][1], 3))
+
+    def test_read_json_blocks(self):
+        """
+        1. the json file is read in blocks smaller than its objects and tokens, with the same rows
+        2. a malformed object fails the file at once, without reading the blocks after it
+        """
+        json_block_size = processing.json_block_size
+        invoice_ids = next(processing.read_chunks(files[0][0], files[0][1], 0))['InvoiceId'].tolist()
+        try:
+            for block_size in [1, 7, 16, 100]:
+                processing.json_block_size = block_size
+                # 1
+                self.assertEqual(pandas.concat(processing.read_chunks(files[0][0], files[0][1], 3))
+                                 ['InvoiceId'].tolist(), invoice_ids)
+            with tempfile.TemporaryDirectory() as directory:
+                file_path = os.path.join(directory, 'invoices.json')
+                with open(files[0][0], encoding='utf-8') as file:
+                    text = file.read().replace('"InvoiceId": "1"', '"InvoiceId": x1', 1)
+                with open(file_path, 'w', encoding='utf-8') as file:
+                    file.write(text[:-1] + (',' + text[1:-1]) * 100 + ']')
+                processing.json_block_size = 1000
+                with self.assertRaises(ValueError) as context:
+                    list(processing.read_chunks(file_path, 'json', 3))
+                # 2
+                self.assertLessEqual(len(context.exception.doc), 1000)
+        finally:
+            processing.json_block_size = json_block_size
+
+    def test_read_ndjson(self):
+        """
+        1. streaming the ndjson file in chunks of 3 rows, expecting 2 chunks (3 + 1), the same rows as the whole file
+        2. reading every byte range of the ndjson file gives all the rows once, without a header line
+        3. loading the ndjson file inserts all its rows
+        """
+        chunks = list(processing.read_chunks(files[3][0], files[3][1], 3))
+        dataframe = next(processing.read_chunks(files[3][0], files[3][1], 0))
+        # 1
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 1])
+        self.assertEqual(pandas.concat(chunks)['InvoiceId'].tolist(), dataframe['InvoiceId'].tolist())
+        shards = [pandas.concat(processing.read_chunks(files[3][0], files[3][1], 1, byte_range))
+                  for byte_range in split_file(files[3][0], 100)]
+        # 2
+        self.assertGreater(len(shards), 1)
+        self.assertEqual(pandas.concat(shards)['InvoiceId'].tolist(), [84, 85, 86, 87])
+        # 3
+        self.assertEqual(processing.process_file(files[3][0], files[3][1], table_name, 2, self.database_connection),
+                         "Inserted 4 Records")
+
+    @unittest.skipUnless(processing.pyarrow, "pyarrow isn't installed")
+    def test_read_columnar(self):
+        """
+        1. the parquet and the arrow files are read whole and in chunks with the same rows as the csv file
+        """
+        dataframe = next(processing.read_chunks(files[1][0], files[1][1], 0))
+        with tempfile.TemporaryDirectory() as directory:
+            for file_type, file_path in [('parquet', os.path.join(directory, 'invoices.parquet')),
+                                         ('arrow', os.path.join(directory, 'invoices.arrow'))]:
+                if 'parquet' == file_type:
+                    dataframe.to_parquet(file_path, index=False)
+                else:
+                    dataframe.to_feather(file_path)
+                chunks = list(processing.read_chunks(file_path, file_type, 3))
+                # 1
+                self.assertEqual([len(chunk) for chunk in chunks], [3, 1])
+                self.assertEqual(next(processing.read_chunks(file_path, file_type, 0))['InvoiceId'].tolist(),
+                                 dataframe['InvoiceId'].tolist())
+
+    def test_invoice_schema(self):
+        """
+        1. the csv and json chunks are read with the types of invoice_schema
+        2. the csv postal codes keep their leading zeros
+        3. the rows of the dataframe are produced as tuples, the dates formatted as the text of the file
+        4. the rows are the same converted in blocks smaller than the dataframe
+        """
+        for file_path, file_type, _ in files[:2]:
+            dataframe = next(processing.read_chunks(file_path, file_type, 0))
+            # 1
+            self.assertEqual(dataframe['InvoiceId'].dtype, 'int32')
+            self.assertEqual(dataframe['CustomerId'].dtype, 'int32')
+            self.assertEqual(dataframe['Total'].dtype, 'float64')
+            self.assertEqual(dataframe['BillingCountry'].dtype, 'category')
+            self.assertTrue(pandas.api.types.is_datetime64_any_dtype(dataframe['InvoiceDate']))
+        # 2
+        self.assertIn('01007-010', dataframe['BillingPostalCode'].tolist())
+        rows = processing.DataframeRows(processing.order_headers(dataframe))
+        # 3
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(next(iter(rows))[:3], (250, 55, '2012-01-01 00:00:00'))
+        # 4
+        self.assertEqual(list(processing.DataframeRows(processing.order_headers(dataframe), 3)), list(rows))
+
+    def test_schema_errors(self):
+        """
+        1. a missing InvoiceId raises the same ValueError whether the file is read whole or streamed,
+        process_file catches it and returns 0
+        2. an InvoiceId out of the int32 range raises the same ValueError, instead of being wrapped
+        """
+        dataframe = next(processing.read_chunks(files[0][0], files[0][1], 0))
+        with tempfile.TemporaryDirectory() as directory:
+            for number, invoice_id in [(1, None), (2, 2 ** 40)]:
+                rows = dataframe.astype({'InvoiceId': object, 'InvoiceDate': str})
+                rows.loc[1, 'InvoiceId'] = invoice_id
+                for file_type in ['json', 'csv']:
+                    file_path = os.path.join(directory, f'invoices_{number}.{file_type}')
+                    if 'json' == file_type:
+                        rows.to_json(file_path, orient='records')
+                    else:
+                        rows.to_csv(file_path, index=False)
+                    for chunk_size in [0, 1]:
+                        # 1, 2
+                        with self.assertRaises(ValueError):
+                            list(processing.read_chunks(file_path, file_type, chunk_size))
+                        self.assertEqual(processing.process_file(file_path, file_type, table_name, chunk_size,
+                                                                 self.database_connection), 0)
+
+    def test_read_shards(self):
+        """
+        1. reading every byte range of the csv file as its own csv gives all the rows once
+        2. every shard holds the header, the columns are the same as the whole file
+        """
+        shards = [pandas.concat(processing.read_chunks(files[1][0], files[1][1], 1, byte_range))
+                  for byte_range in split_file(files[1][0], 100)]
+        dataframe = pandas.read_csv(files[1][0])
+        # 1
+        self.assertEqual(pandas.concat(shards)['InvoiceId'].tolist(), dataframe['InvoiceId'].tolist())
+        # 2
+        for shard in shards:
+            self.assertEqual(shard.columns.tolist(), dataframe.columns.tolist())
+
+    def test_record_shard(self):
+        """
+        1. recording the first of two shards, the file isn't complete
+        2. recording the first shard again (redelivered), the file still isn't complete
+        3. recording the second shard completes the file
+        4. the ranges of the completed file are forgotten, recording again starts over
+        5. a shard which can't be recorded (the database is locked) raises, the message is delivered again
+        """
+        # 1
+        self.assertFalse(processing.record_shard(self.database_connection, 'dummy.csv', 100, 0, 60))
+        # 2
+        self.assertFalse(processing.record_shard(self.database_connection, 'dummy.csv', 100, 0, 60))
+        # 3
+        self.assertTrue(processing.record_shard(self.database_connection, 'dummy.csv', 100, 60, 100))
+        # 4
+        self.assertFalse(processing.record_shard(self.database_connection, 'dummy.csv', 100, 60, 100))
+        busy_timeout, database_handler.busy_timeout = database_handler.busy_timeout, 0
+        lock = sqlite3.connect(database_path, isolation_level=None)
+        try:
+            locked_connection = DatabaseHandler(database_path)
+            locked_connection.connect()
+            lock.execute('''BEGIN EXCLUSIVE''')
+            # 5
+            with self.assertRaises(sqlite3.OperationalError):
+                processing.record_shard(locked_connection, 'dummy.csv', 100, 0, 60)
+        finally:
+            lock.rollback()
+            lock.close()
+            database_handler.busy_timeout = busy_timeout
+        self.database_connection.ensure_connection()
+        self.database_connection.clear_table('''DELETE FROM ingest_shards''')
+
+    def test_ingest_ledger(self):
+        """
+        1. a new file isn't in the ledger, it's loaded and the graph is notified
+        2. the same file is in the ledger, it's skipped and the graph is still notified
+        3. a touched file and a copied file are found by their content hash
+        4. a changed file isn't in the ledger
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = shutil.copy(files[1][0], os.path.join(directory, 'invoices.csv'))
+            message = create_message(file_path, "csv", table_name)
+            # 1
+            self.assertFalse(processing.check_ingested(self.database_connection, file_path, table_name))
+            self.assertTrue(processing.ingest_message(message, 0, self.database_connection))
+            self.database_connection.ensure_connection()
+            self.assertEqual(self.database_connection.select('''SELECT COUNT(*) FROM ''' + table_name)[0][0], 4)
+            # 2
+            self.database_connection.ensure_connection()
+            self.database_connection.clear_table('''DELETE FROM ''' + table_name)
+            self.assertTrue(processing.ingest_message(message, 0, self.database_connection))
+            self.database_connection.ensure_connection()
+            self.assertEqual(self.database_connection.select('''SELECT COUNT(*) FROM ''' + table_name)[0][0], 0)
+            # 3
+            os.utime(file_path, ns=(0, 0))
+            self.assertTrue(processing.check_ingested(self.database_connection, file_path, table_name))
+            copy_path = shutil.copy(file_path, os.path.join(directory, 'copy.csv'))
+            self.assertTrue(processing.check_ingested(self.database_connection, copy_path, table_name))
+            # 4
+            with open(file_path, 'a') as file:
+                file.write('\n254,14,2012-02-01 00:00:00,8210 111 ST NW,Edmonton,AB,Canada,T6G 2C7,1.98')
+            self.assertFalse(processing.check_ingested(self.database_connection, file_path, table_name))
+        self.database_connection.ensure_connection()
+        self.database_connection.clear_table('''DELETE FROM ingest_ledger''')
+
+    def test_load_modes(self):
+        """
+        1. every load mode loads the whole file
+        2. loading a changed row again, first_wins keeps the row of the table
+        3. last_wins and replace keep the changed row
+        4. an unknown load mode raises
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            changed_path = os.path.join(directory, 'changed.csv')
+            with open(files[1][0]) as file, open(changed_path, 'w') as changed_file:
+                changed_file.write(file.read().replace('2703.14', '1.00'))
+            for load_mode, total in [('first_wins', 2703.14), ('last_wins', 1.00), ('replace', 1.00)]:
+                self.database_connection.ensure_connection()
+                self.database_connection.clear_table('''DELETE FROM ''' + table_name)
+                processing.process_file(files[1][0], "csv", table_name, 2, self.database_connection,
+                                        load_mode=load_mode)
+                self.database_connection.ensure_connection()
+                # 1
+                self.assertEqual(self.database_connection.select('''SELECT COUNT(*) FROM ''' + table_name)[0][0], 4)
+                processing.process_file(changed_path, "csv", table_name, 2, self.database_connection,
+                                        load_mode=load_mode)
+                self.database_connection.ensure_connection()
+                results = self.database_connection.select('''SELECT Total FROM ''' + table_name
+                                                          + ''' WHERE InvoiceId = 250''')
+                # 2 3
+                self.assertEqual(results, [(total,)])
+        # 4
+        with self.assertRaises(ValueError):
+            processing.process_file(files[1][0], "csv", table_name, load_mode='merge')
+
     def test_build_dataframe(self):
         """
         1.2.3 checking data type is correct
@@ -98,15 +349,309 @@ class TestProcessing(unittest.TestCase):
         # 8
         self.assertEqual(dataframe['Total'][0], alt_dataframe['Total'][0])
 
+    def test_monthly_aggregate_query(self):
+        """
+        1. aggregating inside the database gives the same dataframe as the pandas grouping
+        2. aggregating the 'bad' data (CustomerId duplicate) counts the distinct customers only (3)
+        """
+        insert_good_data()
+        dataframe = self.database_connection.query_to_dataframe(
+            processing.get_monthly_aggregate_query(table_name))
+        # 1
+        self.assertDataframeEqual(dataframe, get_dataframe())
+        self.database_connection.clear_table('''DELETE FROM ''' + table_name)
+        insert_bad_data()
+        dataframe = self.database_connection.query_to_dataframe(
+            processing.get_monthly_aggregate_query(table_name))
+        # 2
+        self.assertEqual(dataframe['Count'][0], 3)
+
+    def test_rollup(self):
+        """
+        1. inserting both files in chunks, the rollup holds the same dataframe as the aggregation
+        2. inserting the json file again (replaced rows), the rollup is still the same
+        """
+        processing.create_rollup_table_if_not_exist(self.database_connection, table_name)
+        self.database_connection.clear_table('''DELETE FROM ''' + processing.get_rollup_table_name(table_name))
+        for file_path, file_type, _ in files[:2]:
+            insert_rollup_data(file_path, file_type)
+        rollup_query = processing.get_rollup_select_query(table_name)
+        # 1
+        self.assertDataframeEqual(self.database_connection.query_to_dataframe(rollup_query), get_equal_dataframe())
+        insert_rollup_data(files[0][0], files[0][1])
+        # 2
+        self.assertDataframeEqual(self.database_connection.query_to_dataframe(rollup_query), get_equal_dataframe())
+        self.database_connection.clear_table('''DROP TABLE ''' + processing.get_rollup_table_name(table_name))
+
+    def test_rollup_moved_rows(self):
+        """
+        1. a row loaded again with the date of another month (replace and last_wins) leaves its old month,
+        the rollup of both months is right
+        2. a month left without rows has no rollup row
+        """
+        processing.create_rollup_table_if_not_exist(self.database_connection, table_name)
+        rollup_query = processing.get_rollup_select_query(table_name)
+        with tempfile.TemporaryDirectory() as directory:
+            for load_mode in ['replace', 'last_wins']:
+                self.database_connection.ensure_connection()
+                self.database_connection.clear_table('''DELETE FROM ''' + table_name)
+                self.database_connection.ensure_connection()
+                self.database_connection.clear_table('''DELETE FROM '''
+                                                     + processing.get_rollup_table_name(table_name))
+                for months in [{1: '2009-01', 2: '2009-01'}, {2: '2009-02'}, {1: '2009-03'}]:
+                    processing.process_file(write_month_rows(directory, months), "csv", table_name, 0,
+                                            self.database_connection, load_mode=load_mode)
+                self.database_connection.ensure_connection()
+                rollup = self.database_connection.query_to_dataframe(rollup_query)
+                # 1
+                self.assertEqual(rollup.values.tolist(), [['2009-02', 1, 10.0], ['2009-03', 1, 5.0]])
+                # 2
+                self.assertNotIn('2009-01', rollup['InvoiceDate'].tolist())
+        self.database_connection.ensure_connection()
+        self.database_connection.clear_table('''DROP TABLE ''' + processing.get_rollup_table_name(table_name))
+
+    def test_touched_moved_rows(self):
+        """
+        1. a row moved to another month touches both months, the refreshed graph drops it from the old month
+        2. the same with deferred indexes, once the rollup is rebuilt
+        """
+        processing.create_rollup_table_if_not_exist(self.database_connection, table_name)
+        self.database_connection.clear_table('''DELETE FROM ''' + processing.get_rollup_table_name(table_name))
+        processing.graph_dataframes.clear()
+        with tempfile.TemporaryDirectory() as directory:
+            processing.process_file(write_month_rows(directory, {1: '2009-01', 2: '2009-01'}), "csv", table_name, 0,
+                                    self.database_connection)
+            processing.refresh_dataframe(table_name, self.database_connection)
+            last_id = processing.graph_dataframes[(self.database_connection.get_path(), table_name)][2]
+            processing.process_file(write_month_rows(directory, {2: '2009-02'}), "csv", table_name, 0,
+                                    self.database_connection)
+            self.database_connection.ensure_connection()
+            touched = self.database_connection.transaction_select([], '''SELECT month FROM touched_months
+                    WHERE table_name = ? AND id > ? ORDER BY month''', (table_name, last_id))
+            # 1
+            self.assertEqual(touched, [('2009-01',), ('2009-02',)])
+            self.assertEqual(processing.refresh_dataframe(table_name, self.database_connection).values.tolist(),
+                             [['2009-01', 1, 5.0], ['2009-02', 1, 10.0]])
+            processing.process_file(write_month_rows(directory, {1: '2009-03'}), "csv", table_name, 0,
+                                    self.database_connection, defer_indexes=True)
+            # 2
+            self.assertEqual(processing.refresh_dataframe(table_name, self.database_connection).values.tolist(),
+                             [['2009-02', 1, 10.0], ['2009-03', 1, 5.0]])
+        self.database_connection.ensure_connection()
+        self.database_connection.clear_table('''DROP TABLE ''' + processing.get_rollup_table_name(table_name))
+
+    def test_touched_months(self):
+        """
+        1. the first graph of the table is built whole
+        2. loading a file of another month, only that month is touched since the first graph,
+        merging it gives the same dataframe as building the graph whole
+        3. without touched months the dataframe of the last graph is returned as is
+        """
+        processing.create_rollup_table_if_not_exist(self.database_connection, table_name)
+        self.database_connection.clear_table('''DELETE FROM ''' + processing.get_rollup_table_name(table_name))
+        processing.graph_dataframes.clear()
+        processing.process_file(files[0][0], files[0][1], table_name, 0, self.database_connection)
+        self.database_connection.ensure_connection()
+        graph_dataframe = processing.refresh_dataframe(table_name, self.database_connection)
+        # 1
+        self.assertEqual(graph_dataframe, processing.build_dataframe(table_name,
+                                                                     database_connection=self.database_connection))
+        last_id = processing.graph_dataframes[(self.database_connection.get_path(), table_name)][2]
+        processing.process_file(files[1][0], files[1][1], table_name, 0, self.database_connection)
+        self.database_connection.ensure_connection()
+        touched = self.database_connection.transaction_select([], '''SELECT month FROM touched_months
+                WHERE table_name = ? AND id > ?''', (table_name, last_id))
+        graph_dataframe = processing.refresh_dataframe(table_name, self.database_connection)
+        # 2
+        self.assertEqual(touched, [('2012-01',)])
+        self.assertEqual(graph_dataframe, processing.build_dataframe(table_name,
+                                                                     database_connection=self.database_connection))
+        # 3
+        self.assertIs(processing.refresh_dataframe(table_name, self.database_connection), graph_dataframe)
+        self.database_connection.ensure_connection()
+        self.database_connection.clear_table('''DROP TABLE ''' + processing.get_rollup_table_name(table_name))
+
+    def test_ignored_touched_months(self):
+        """
+        1. loading the same file again with first_wins ignores every row and touches no month
+        2. the dataframe of the last graph is returned as is
+        3. loading it again with replace changes the rows, its month is touched
+        """
+        processing.create_rollup_table_if_not_exist(self.database_connection, table_name)
+        self.database_connection.clear_table('''DELETE FROM ''' + processing.get_rollup_table_name(table_name))
+        processing.graph_dataframes.clear()
+        processing.process_file(files[0][0], files[0][1], table_name, 2, self.database_connection,
+                                load_mode='first_wins')
+        self.database_connection.ensure_connection()
+        graph_dataframe = processing.refresh_dataframe(table_name, self.database_connection)
+        last_id = processing.graph_dataframes[(self.database_connection.get_path(), table_name)][2]
+        touched_query = '''SELECT DISTINCT month FROM touched_months WHERE table_name = ? AND id > ?'''
+        processing.process_file(files[0][0], files[0][1], table_name, 2, self.database_connection,
+                                load_mode='first_wins')
+        self.database_connection.ensure_connection()
+        # 1
+        self.assertEqual(self.database_connection.transaction_select([], touched_query, (table_name, last_id)), [])
+        # 2
+        self.assertIs(processing.refresh_dataframe(table_name, self.database_connection), graph_dataframe)
+        processing.process_file(files[0][0], files[0][1], table_name, 2, self.database_connection,
+                                load_mode='replace')
+        self.database_connection.ensure_connection()
+        # 3
+        self.assertEqual(self.database_connection.transaction_select([], touched_query, (table_name, last_id)),
+                         [('2009-01',)])
+        self.database_connection.clear_table('''DROP TABLE ''' + processing.get_rollup_table_name(table_name))
+
+    def test_deferred_touched_months(self):
+        """
+        1. a chunk committed by a load with deferred indexes touches no month until the rollup is rebuilt,
+        the graph refreshed in between is the one before the load
+        2. once the load rebuilds the rollup its months are touched, the graph holds the whole table
+        """
+        processing.create_rollup_table_if_not_exist(self.database_connection, table_name)
+        self.database_connection.clear_table('''DELETE FROM ''' + processing.get_rollup_table_name(table_name))
+        processing.graph_dataframes.clear()
+        processing.process_file(files[0][0], files[0][1], table_name, 0, self.database_connection)
+        graph_dataframe = processing.refresh_dataframe(table_name, self.database_connection)
+        self.database_connection.ensure_connection()
+        processing.create_pending_months_if_not_exist(self.database_connection)
+        dataframe = next(processing.read_chunks(files[1][0], files[1][1], 0))
+        self.database_connection.insert_chunks([processing.get_chunk_statements(dataframe, table_name, False)])
+        # 1
+        self.assertIs(processing.refresh_dataframe(table_name, self.database_connection), graph_dataframe)
+        processing.process_file(files[1][0], files[1][1], table_name, 2, self.database_connection, defer_indexes=True)
+        # 2
+        self.assertEqual(processing.refresh_dataframe(table_name, self.database_connection),
+                         processing.build_dataframe(table_name, use_rollup=False,
+                                                    database_connection=self.database_connection))
+        self.database_connection.ensure_connection()
+        self.database_connection.clear_table('''DROP TABLE ''' + processing.get_rollup_table_name(table_name))
+
+    def test_deferred_failure(self):
+        """
+        1. a load with deferred indexes failing on a file without all its columns raises the failure
+        2. the indexes are built again all the same
+        3. the months pending from the chunks committed before the failure are touched, the rollup is rebuilt
+        """
+        processing.create_rollup_table_if_not_exist(self.database_connection, table_name)
+        self.database_connection.clear_table('''DELETE FROM ''' + processing.get_rollup_table_name(table_name))
+        self.database_connection.ensure_connection()
+        processing.create_pending_months_if_not_exist(self.database_connection)
+        dataframe = next(processing.read_chunks(files[1][0], files[1][1], 0))
+        self.database_connection.insert_chunks([processing.get_chunk_statements(dataframe, table_name, False)])
+        self.database_connection.ensure_connection()
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'columns.csv')
+            pandas.DataFrame({'InvoiceId': [1], 'CustomerId': [1], 'InvoiceDate': ['2009-01-01 00:00:00']}
+                             ).to_csv(file_path, index=False)
+            # 1
+            with self.assertRaises(KeyError):
+                processing.process_file(file_path, "csv", table_name, 2, self.database_connection,
+                                        defer_indexes=True)
+        # 2
+        self.assertIn('COVERING INDEX', get_rollup_refresh_plan())
+        self.database_connection.ensure_connection()
+        # 3
+        self.assertEqual(self.database_connection.transaction_select(
+            [], '''SELECT COUNT(*) FROM pending_months WHERE table_name = ?''', (table_name,)), [(0,)])
+        self.assertEqual(self.database_connection.query_to_dataframe(
+            processing.get_rollup_select_query(table_name)).values.tolist(),
+            self.database_connection.query_to_dataframe(
+                processing.get_monthly_aggregate_query(table_name)).values.tolist())
+        self.database_connection.clear_table('''DROP TABLE ''' + processing.get_rollup_table_name(table_name))
+
+    def test_graph_cache(self):
+        """
+        1. the graph dataframes of the last graph_cache_size tables are kept, the least recently used is evicted
+        2. refreshing a kept table moves it to the most recently used
+        """
+        other_table_name = table_name + '_other'
+        processing.graph_dataframes.clear()
+        graph_cache_size, processing.graph_cache_size = processing.graph_cache_size, 2
+        path = self.database_connection.get_path()
+        try:
+            for name in [table_name, other_table_name, table_name, other_table_name + '_third']:
+                self.database_connection.ensure_connection()
+                processing.create_table_if_not_exist(self.database_connection, name)
+                processing.refresh_dataframe(name, self.database_connection)
+            # 1
+            self.assertNotIn((path, other_table_name), processing.graph_dataframes)
+            # 2
+            self.assertEqual(list(processing.graph_dataframes),
+                             [(path, table_name), (path, other_table_name + '_third')])
+        finally:
+            processing.graph_cache_size = graph_cache_size
+            processing.graph_dataframes.clear()
+            for name in [other_table_name, other_table_name + '_third']:
+                self.database_connection.ensure_connection()
+                self.database_connection.clear_table('''DROP TABLE ''' + name)
+
+    def test_month_key(self):
+        """
+        1. the month key of every row is stored at ingest
+        2. a table created before the month key gets the column, filled from the dates
+        3. the month key converts to the month string and back
+        """
+        processing.process_file(files[0][0], files[0][1], table_name, 0, self.database_connection)
+        self.database_connection.ensure_connection()
+        # 1
+        self.assertEqual(self.database_connection.select('''SELECT DISTINCT InvoiceMonth FROM ''' + table_name),
+                         [(200901,)])
+        old_table_name = table_name + '_old'
+        self.database_connection.ensure_connection()
+        self.database_connection.create_table('''CREATE TABLE ''' + old_table_name + ''' (InvoiceId integer,
+                CustomerId integer, InvoiceDate text, Total float)''')
+        self.database_connection.insert_many('''INSERT INTO ''' + old_table_name + ''' VALUES (?, ?, ?, ?)''',
+                                             [(1, 2, '2010-03-04 00:00:00', 1.5)])
+        self.database_connection.ensure_connection()
+        processing.add_month_key_column_if_not_exist(self.database_connection, old_table_name)
+        self.database_connection.ensure_connection()
+        # 2
+        self.assertEqual(self.database_connection.select('''SELECT InvoiceMonth FROM ''' + old_table_name),
+                         [(201003,)])
+        self.database_connection.ensure_connection()
+        self.database_connection.clear_table('''DROP TABLE ''' + old_table_name)
+        # 3
+        self.assertEqual(processing.get_month_key('2009-12'), 200912)
+        self.assertEqual(processing.get_month_name(200912), '2009-12')
+
+    def test_indexes(self):
+        """
+        1. the rollup refresh of a month reads the covering index only
+        2. after dropping the indexes the refresh scans the table
+        3. creating the indexes again, the refresh is back on the covering index
+        """
+        # 1
+        self.assertIn('COVERING INDEX', get_rollup_refresh_plan())
+        processing.drop_indexes(self.database_connection, table_name)
+        # 2
+        self.assertNotIn('INDEX', get_rollup_refresh_plan())
+        processing.create_indexes_if_not_exist(self.database_connection, table_name)
+        # 3
+        self.assertIn('COVERING INDEX', get_rollup_refresh_plan())
+
     def test_build_graph(self):
         """
         1. testing the build_graph method returns the correct string, and waiting for file to open (less than 1 sec)
+        2. building the same data again skips the write
+        3. plotly.js is written once next to the html file, which only references it
+        4. the inline render mode embeds plotly.js in the html file
         """
         insert_good_data()
         dataframe = get_dataframe()
-        results = processing.build_graph(dataframe, figure_path, False)
+        processing.figure_hashes.pop(figure_path, None)
+        results = processing.build_graph(dataframe, figure_path, False, 'directory')
         # 1
         self.assertEqual(results, "Updated html File and Opened it")
+        # 2
+        self.assertEqual(processing.build_graph(dataframe, figure_path, False, 'directory'),
+                         "Graph Unchanged, Skipped the html File")
+        # 3
+        self.assertTrue(os.path.isfile(os.path.join(os.path.dirname(figure_path), 'plotly.min.js')))
+        self.assertLess(os.path.getsize(figure_path), 100000)
+        # 4
+        self.assertEqual(processing.build_graph(dataframe, figure_path, False, 'inline'),
+                         "Updated html File and Opened it")
+        self.assertGreater(os.path.getsize(figure_path), 1000000)
 
     def assertDataframeEqual(self, df1, df2, msg='Dataframes are NOT equal'):
         """
@@ -162,10 +707,50 @@ def get_file_reply(file_path: str, file_type: str):
     except pandas.errors.ParserError as e:
         print("Insertion failed: ", e.args[0])
         return 0
-    dataframe = processing.order_headers(dataframe)
+    dataframe = processing.add_month_key(processing.order_headers(dataframe))
     return database_connection.insert_many(insert_many_query, dataframe.values.tolist())
 
 
+def write_month_rows(directory: str, months: dict) -> str:
+    """
+    writing a csv file of invoices of their own customers, InvoiceId 1 of 5.0 and InvoiceId 2 of 10.0
+    :param directory: directory of the file
+    :param months: dict of InvoiceId -> month of the invoice
+    :return: path of the file
+    """
+    file_path = os.path.join(directory, 'moved.csv')
+    pandas.DataFrame({'InvoiceId': list(months), 'CustomerId': list(months),
+                      'InvoiceDate': [month + '-01 00:00:00' for month in months.values()],
+                      'BillingAddress': 'a', 'BillingCity': 'c', 'BillingState': 's', 'BillingCountry': 'x',
+                      'BillingPostalCode': '1', 'Total': [5.0 * invoice_id for invoice_id in months]}
+                     ).to_csv(file_path, index=False)
+    return file_path
+
+
+def insert_rollup_data(file_path: str, file_type: str):
+    """
+    inserting the file in chunks of 3 rows, updating the rollup in the same transactions
+    :param file_path: string of file path
+    :param file_type: CSV/JSON
+    """
+    database_connection = processing.establish_connection(database_path)
+    database_connection.insert_chunks(processing.get_chunk_statements(dataframe, table_name)
+                                      for dataframe in processing.read_chunks(file_path, file_type, 3))
+
+
+def get_rollup_refresh_plan() -> str:
+    """
+    explaining the query plan of the rollup select of one month,
+    on a new connection since a cached explain statement keeps its old plan
+    :return: the plan details joined in one string
+    """
+    database_connection = processing.establish_connection(database_path)
+    query = '''EXPLAIN QUERY PLAN SELECT COUNT(DISTINCT CustomerId), SUM(Total) FROM ''' + table_name + '''
+            WHERE InvoiceMonth = 200901'''
+    results = database_connection.select(query)
+    return ' '.join(row[-1] for row in results)
+
+
 def get_dataframe() -> pandas.DataFrame:
     """
     creating a connection, extracting from database and getting dataframe,
@@ -175,7 +760,7 @@ def get_dataframe() -> pandas.DataFrame:
     database_connection = processing.establish_connection(database_path)
     dataframe = database_connection.to_dataframe(['CustomerId', 'InvoiceDate', 'Total'], table_name)
     database_connection.close()
-    dataframe = processing.get_invoice_date_fixed(dataframe)
+    dataframe.loc[:, 'InvoiceDate'] = pandas.to_datetime(dataframe['InvoiceDate']).dt.strftime('%Y-%m')
     analyze_dataframe = dataframe.copy()
     total_sum_dataframe = processing.get_column_sum(analyze_dataframe)
 
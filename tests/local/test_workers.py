@@ -0,0 +1,200 @@
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import threading
+import multiprocessing
+import src.database_handler as database_handler
+import src.database_consumer as database_consumer
+from src import metrics
+from src.message import magic, create_message, encode_message, decode_message
+from src.database_consumer import DatabaseConsumer, run_workers
+from src.transport import MemoryBroker, MemoryTransport, poll_interval
+table_name = "invoices_dummy"
+base_path = os.path.normpath(os.path.dirname(__file__) + os.path.join('/dummy_files'))
+file_path = base_path + os.path.join('/invoices_2011.csv')
+json_file_path = base_path + os.path.join('/invoices_2009.json')
+
+
+class TestWorkers(unittest.TestCase):
+    def setUp(self):
+        """
+        connecting the consumer to a broker and a database of its own
+        """
+        self.directory = tempfile.mkdtemp()
+        self.database_path = os.path.join(self.directory, 'consumer.db')
+        self.metrics_directory = metrics.metrics_directory
+        metrics.metrics_directory = None
+        self.transport = MemoryTransport(MemoryBroker())
+        self.database_consumer = DatabaseConsumer(transport=self.transport, _database_path=self.database_path)
+
+    def tearDown(self):
+        """
+        closing the transport and the pool, then removing the database
+        """
+        self.transport.close()
+        self.database_consumer.executor.shutdown(wait=True)
+        metrics.metrics_directory = self.metrics_directory
+        shutil.rmtree(self.directory)
+
+    def consume_until(self, settled: int, timeout: float = 10.0):
+        """
+        running the consuming loop until settled messages are acknowledged or rejected
+        """
+        deadline = time.monotonic() + timeout
+        timers = []
+
+        def check():
+            if self.transport.settled >= settled or time.monotonic() > deadline:
+                self.transport.stop_consuming()
+            else:
+                timers.append(self.transport.call_later(poll_interval / 10, check))
+        timers.append(self.transport.call_later(0, check))
+        self.transport.start_consuming()
+        # the loop can be stopped by another callback, the next loop mustn't be stopped by this one
+        self.transport.remove_timeout(timers[-1])
+
+    def count_rows(self) -> int:
+        """
+        :return: number of rows in the table of the consumer database
+        """
+        with sqlite3.connect(self.database_path) as connection:
+            return connection.execute('''SELECT COUNT(*) FROM ''' + table_name).fetchone()[0]
+
+    def test_run_workers(self):
+        """
+        1. the worker processes share the queue of the broker, every file is loaded once
+        2. the graph is notified once for every file
+        """
+        manager = multiprocessing.Manager()
+        broker = MemoryBroker(manager)
+        broker.declare('files_to_database')
+        broker.declare('database_to_graph')
+        workers = run_workers(2, broker=broker, wait=False, _database_path=self.database_path)
+        try:
+            publisher = MemoryTransport(broker)
+            for path, file_type in [(file_path, 'csv'), (json_file_path, 'json')]:
+                publisher.publish('files_to_database', encode_message(create_message(path, file_type, table_name)))
+            deadline = time.monotonic() + 30
+            while publisher.message_count('database_to_graph') < 2 and time.monotonic() < deadline:
+                time.sleep(poll_interval)
+            # 1
+            self.assertEqual(self.count_rows(), 8)
+            # 2
+            self.assertEqual(publisher.message_count('database_to_graph'), 2)
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+            manager.shutdown()
+
+    def test_acknowledge_after_commit(self):
+        """
+        1. the message is acknowledged, with its rows committed
+        2. the graph is notified once, with the whole file
+        """
+        self.transport.publish('files_to_database', encode_message(create_message(file_path, 'csv', table_name)))
+        self.consume_until(1)
+        # 1
+        self.assertEqual(self.transport.settled, 1)
+        self.assertEqual(self.transport.unacked, {})
+        self.assertEqual(self.count_rows(), 4)
+        # 2
+        self.assertEqual(self.transport.message_count('database_to_graph'), 1)
+        self.assertEqual(decode_message(self.transport.broker.declare('database_to_graph').get()[0]).path, file_path)
+
+    def test_reject_once(self):
+        """
+        1. a message which can't be processed is delivered again once, then dropped
+        2. the graph isn't notified
+        """
+        # a version the consumers don't know
+        self.transport.publish('files_to_database', magic + bytes(33))
+        self.consume_until(2)
+        # 1
+        self.assertEqual(self.transport.settled, 2)
+        self.assertEqual(self.transport.message_count('files_to_database'), 0)
+        # 2
+        self.assertEqual(self.transport.message_count('database_to_graph'), 0)
+
+    def test_requeue_locked(self):
+        """
+        1. a message whose transaction fails on a locked database is delivered again
+        2. once the lock is released the delivered again message is loaded and acknowledged
+        """
+        busy_timeout = database_handler.busy_timeout
+        database_handler.busy_timeout = 0
+        self.addCleanup(setattr, database_handler, 'busy_timeout', busy_timeout)
+        lock = sqlite3.connect(self.database_path, isolation_level=None)
+        lock.execute('''BEGIN EXCLUSIVE''')
+        rejected = []
+
+        def nack(delivery_tag: int, requeue: bool):
+            # stopping before the message is delivered again to the locked database
+            rejected.append(requeue)
+            MemoryTransport.nack(self.transport, delivery_tag, requeue)
+            self.transport.stop_consuming()
+        self.transport.nack = nack
+        self.transport.publish('files_to_database', encode_message(create_message(file_path, 'csv', table_name)))
+        self.consume_until(1)
+        # 1
+        self.assertEqual(rejected, [True])
+        lock.rollback()
+        lock.close()
+        del self.transport.nack
+        self.consume_until(2)
+        # 2
+        self.assertEqual(self.transport.settled, 2)
+        self.assertEqual(self.count_rows(), 4)
+        self.assertEqual(self.transport.message_count('database_to_graph'), 1)
+
+
+    def test_thread_pool(self):
+        """
+        1. the files are loaded off the consuming thread, by at most prefetch_count threads at once
+        2. the acknowledgements and the notifications are passed back to the consuming thread
+        """
+        running = []
+        loaded = []
+        threads = set()
+        acknowledged = []
+        lock = threading.Lock()
+
+        def ingest_message(message, chunk_size, database_connection, skip_ingested):
+            with lock:
+                running.append(threading.current_thread())
+                threads.add(threading.current_thread())
+                loaded.append(len(running))
+            time.sleep(0.1)
+            with lock:
+                running.remove(threading.current_thread())
+            return True
+
+        def ack(delivery_tag: int):
+            acknowledged.append(threading.current_thread())
+            MemoryTransport.ack(self.transport, delivery_tag)
+        saved = database_consumer.ingest_message, database_consumer.get_thread_connection
+        database_consumer.ingest_message, database_consumer.get_thread_connection = ingest_message, lambda path: None
+        self.addCleanup(setattr, database_consumer, 'ingest_message', saved[0])
+        self.addCleanup(setattr, database_consumer, 'get_thread_connection', saved[1])
+        self.database_consumer.executor.shutdown(wait=True)
+        self.transport.close()
+        self.transport = MemoryTransport(MemoryBroker())
+        self.transport.ack = ack
+        self.database_consumer = DatabaseConsumer(prefetch_count=2, transport=self.transport,
+                                                  _database_path=self.database_path)
+        for _ in range(3):
+            self.transport.publish('files_to_database', encode_message(create_message(file_path, 'csv', table_name)))
+        self.consume_until(3)
+        # 1
+        self.assertEqual(max(loaded), 2)
+        self.assertEqual(len(loaded), 3)
+        self.assertNotIn(threading.current_thread(), threads)
+        # 2
+        self.assertEqual(acknowledged, [threading.current_thread()] * 3)
+        self.assertEqual(self.transport.message_count('database_to_graph'), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import time
+import asyncio
+import sqlite3
+import threading
+import unittest
+import src.async_consumer as async_consumer
+from src.message import Message, encode_message
+from src.async_consumer import AsyncConsumer, AsyncGraphConsumer
+
+
+class FakeChannel:
+    def __init__(self):
+        """
+        keeping the acknowledgements and the rejections instead of sending them to a broker
+        """
+        self.acked = []
+        self.nacked = []
+
+    def basic_ack(self, delivery_tag: int):
+        """
+        keeping the tag of the acknowledged message
+        """
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag: int, requeue: bool):
+        """
+        keeping the tag of the rejected message and either it's delivered again
+        """
+        self.nacked.append((delivery_tag, requeue))
+
+
+class FailingConsumer(AsyncConsumer):
+    queue = 'files_to_database'
+
+    def connect(self):
+        """
+        no broker, the channel is a FakeChannel
+        """
+        self.channel = FakeChannel()
+
+    async def work(self, body: bytes):
+        """
+        failing like a locked database, like any other failure, or succeeding
+        """
+        if b'locked' == body:
+            raise sqlite3.OperationalError("database is locked")
+        if b'bad' == body:
+            raise ValueError("unknown message version")
+
+
+class FakeGraphConsumer(AsyncGraphConsumer):
+    def connect(self):
+        """
+        no broker, the channel is a FakeChannel
+        """
+        self.channel = FakeChannel()
+
+
+class TestAsyncConsumer(unittest.TestCase):
+    def setUp(self):
+        """
+        creating an event loop of its own
+        """
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        """
+        closing the event loop
+        """
+        self.loop.close()
+
+    def test_abstract(self):
+        """
+        1. a consumer without work can't be created
+        """
+        # 1
+        with self.assertRaises(TypeError):
+            AsyncConsumer(self.loop)
+
+    def test_handle(self):
+        """
+        1. a message handled without a failure is acknowledged
+        2. a failed transaction is delivered again
+        3. any other failure is delivered again once, then dropped
+        """
+        consumer = FailingConsumer(self.loop, 2)
+        for delivery_tag, redelivered, body in [(1, False, b'ok'), (2, False, b'locked'), (3, True, b'locked'),
+                                                (4, False, b'bad'), (5, True, b'bad')]:
+            self.loop.run_until_complete(consumer.handle(delivery_tag, redelivered, body))
+        # 1
+        self.assertEqual(consumer.channel.acked, [1])
+        # 2
+        self.assertEqual(consumer.channel.nacked[:2], [(2, True), (3, True)])
+        # 3
+        self.assertEqual(consumer.channel.nacked[2:], [(4, True), (5, False)])
+        consumer.executor.shutdown()
+
+    def test_table_lock(self):
+        """
+        1. the graphs of one table are rebuilt one at a time, the graphs of different tables concurrently
+        2. every notification is acknowledged
+        """
+        running = {}
+        overlaps = []
+        lock = threading.Lock()
+
+        def refresh_graph(table_name, database_connection):
+            with lock:
+                running[table_name] = running.get(table_name, 0) + 1
+                overlaps.append(dict(running))
+            time.sleep(0.05)
+            with lock:
+                running[table_name] -= 1
+
+        saved = async_consumer.refresh_graph, async_consumer.get_thread_connection
+        async_consumer.refresh_graph, async_consumer.get_thread_connection = refresh_graph, lambda: None
+        try:
+            consumer = FakeGraphConsumer(self.loop, 4)
+            bodies = [encode_message(Message('', 'csv', table_name)) for table_name in ['a', 'a', 'b', 'a']]
+
+            async def handle_all():
+                await asyncio.gather(*(consumer.handle(delivery_tag, False, body)
+                                       for delivery_tag, body in enumerate(bodies, 1)))
+            self.loop.run_until_complete(handle_all())
+        finally:
+            async_consumer.refresh_graph, async_consumer.get_thread_connection = saved
+        # 1
+        self.assertEqual(max(overlap.get('a', 0) for overlap in overlaps), 1)
+        self.assertTrue(any(overlap.get('a') and overlap.get('b') for overlap in overlaps))
+        # 2
+        self.assertEqual(sorted(consumer.channel.acked), [1, 2, 3, 4])
+        consumer.executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
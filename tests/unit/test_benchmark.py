@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+from benchmarks.generator import generate_invoices, write_invoices
+from benchmarks.benchmark import summarize, compare_results, file_types, run_benchmarks
+from src import processing
+from src.processing import read_chunks
+from src.database_handler import database_path
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_generate_invoices(self):
+        """
+        1. generating the asked number of rows, customers and months
+        2. the duplicates repeat other rows as is
+        3. the same seed gives the same invoices
+        """
+        dataframe = generate_invoices(1000, customers=10, months=6, duplicate_ratio=0.1)
+        # 1
+        self.assertEqual(len(dataframe), 1000)
+        self.assertLessEqual(dataframe['CustomerId'].nunique(), 10)
+        self.assertEqual(dataframe['InvoiceDate'].str[:7].nunique(), 6)
+        # 2
+        self.assertEqual(dataframe.duplicated().sum(), 100)
+        # 3
+        self.assertTrue(dataframe.equals(generate_invoices(1000, customers=10, months=6, duplicate_ratio=0.1)))
+
+    def test_write_invoices(self):
+        """
+        1. the files of every benchmarked type are read back with all the rows and the columns of the source files
+        """
+        dataframe = generate_invoices(50)
+        with tempfile.TemporaryDirectory() as directory:
+            for file_type in file_types:
+                file_path = write_invoices(dataframe, os.path.join(directory, 'invoices.' + file_type), file_type)
+                read_dataframe = next(read_chunks(file_path, file_type, 0))
+                # 1
+                self.assertEqual(list(read_dataframe.columns), list(dataframe.columns))
+                self.assertEqual(len(read_dataframe), 50)
+
+    def test_summarize(self):
+        """
+        1. the median, the p95 and the throughput of the calls
+        2. comparing with a baseline twice faster
+        """
+        stage = summarize([0.4, 0.1, 0.2, 0.3, 0.5], 1000)
+        # 1
+        self.assertEqual(stage['median_seconds'], 0.3)
+        self.assertEqual(stage['p95_seconds'], 0.5)
+        self.assertAlmostEqual(stage['rows_per_second'], 1000 / 0.3)
+        # 2
+        baseline = {'stages': {'stage': summarize([0.15], 1000)}}
+        self.assertAlmostEqual(compare_results(baseline, {'stages': {'stage': stage}})['stage'], 2.0)
+
+    def test_run_benchmarks(self):
+        """
+        1. every stage is measured, the pipeline too
+        2. the database of the consumers isn't touched and the globals of the pipeline are restored
+        """
+        existed = os.path.exists(database_path)
+        globals_before = processing.graph_auto_open, processing.figure_directory
+        results = run_benchmarks(200, months=3, repeat=1)
+        # 1
+        self.assertIn('end_to_end', results['stages'])
+        self.assertIn('build_graph', results['stages'])
+        # 2
+        self.assertEqual(os.path.exists(database_path), existed)
+        self.assertEqual((processing.graph_auto_open, processing.figure_directory), globals_before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import json
+import socket
+import pandas
+import tempfile
+import unittest
+import urllib.request
+from src.dashboard import update_dashboard, start_server, stop_server, write_data
+
+
+def get_graph_dataframe(totals: list) -> pandas.DataFrame:
+    """
+    creating a graph dataframe of one customer a month, from 2009-01 on
+    :param totals: total of every month
+    :return: dataframe of 3 columns ['InvoiceDate', 'Count', 'Total']
+    """
+    return pandas.DataFrame({'InvoiceDate': ['2009-01', '2009-02', '2009-03'][:len(totals)],
+                             'Count': [1] * len(totals), 'Total': totals})
+
+
+def read_data(directory: str) -> dict:
+    """
+    reading the data file of the dashboard
+    :param directory: directory of the dashboard
+    :return: dict of the version, the changed months, the months, their counts and their totals
+    """
+    with open(os.path.join(directory, 'invoices.json'), encoding='utf-8') as file:
+        return json.load(file)
+
+
+class TestDashboard(unittest.TestCase):
+    def setUp(self):
+        """
+        creating a dashboard directory of its own
+        """
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """
+        removing the dashboard directory
+        """
+        self.directory.cleanup()
+
+    def test_update_dashboard(self):
+        """
+        1. the first update writes the page, plotly.js and every month of the table
+        2. the same data again isn't written
+        3. a changed month and a new month are the only changed months of the next version
+        """
+        result = update_dashboard('invoices', get_graph_dataframe([1.0, 2.0]), False, self.directory.name)
+        data = read_data(self.directory.name)
+        # 1
+        self.assertEqual(result, "Updated 2 Months of the Dashboard")
+        self.assertTrue(os.path.isfile(os.path.join(self.directory.name, 'index.html')))
+        self.assertTrue(os.path.isfile(os.path.join(self.directory.name, 'plotly.min.js')))
+        self.assertEqual((data['months'], data['totals']), (['2009-01', '2009-02'], [1.0, 2.0]))
+        version = data['version']
+        # 2
+        self.assertEqual(update_dashboard('invoices', get_graph_dataframe([1.0, 2.0]), False, self.directory.name),
+                         "Dashboard Unchanged, Skipped the Data File")
+        self.assertEqual(read_data(self.directory.name)['version'], version)
+        update_dashboard('invoices', get_graph_dataframe([1.0, 5.0, 3.0]), False, self.directory.name)
+        data = read_data(self.directory.name)
+        # 3
+        self.assertEqual(data['previous_version'], version)
+        self.assertGreater(data['version'], version)
+        self.assertEqual(data['changed'], ['2009-02', '2009-03'])
+        self.assertEqual(data['totals'], [1.0, 5.0, 3.0])
+
+    def test_two_writers(self):
+        """
+        1. the data file written by another process since is the one diffed, not the last one of this process
+        2. the next version follows the version of the other process, even ahead of the clock
+        """
+        data_path = os.path.join(self.directory.name, 'invoices.json')
+        update_dashboard('invoices', get_graph_dataframe([1.0, 2.0]), False, self.directory.name)
+        version = read_data(self.directory.name)['version']
+        # another graph consumer writes a version in the future (a clock ahead of this one)
+        write_data(data_path, {'2009-01': (1, 1.0), '2009-02': (1, 4.0)}, ['2009-02'], version + 10 ** 12, version)
+        # 1
+        self.assertEqual(update_dashboard('invoices', get_graph_dataframe([1.0, 4.0]), False, self.directory.name),
+                         "Dashboard Unchanged, Skipped the Data File")
+        self.assertEqual(update_dashboard('invoices', get_graph_dataframe([1.0, 4.0, 3.0]), False,
+                                          self.directory.name), "Updated 1 Months of the Dashboard")
+        data = read_data(self.directory.name)
+        # 2
+        self.assertEqual((data['version'], data['previous_version']), (version + 10 ** 12 + 1, version + 10 ** 12))
+        self.assertEqual(data['changed'], ['2009-03'])
+
+    def test_server(self):
+        """
+        1. the server serves the page and the data file of the dashboard directory, never cached
+        """
+        update_dashboard('invoices', get_graph_dataframe([1.0]), False, self.directory.name)
+        with socket.socket() as free_socket:
+            free_socket.bind(('127.0.0.1', 0))
+            port = free_socket.getsockname()[1]
+        server = start_server(port, self.directory.name)
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/invoices.json") as response:
+                # 1
+                self.assertEqual(json.loads(response.read())['months'], ['2009-01'])
+                self.assertEqual(response.headers['Cache-Control'], 'no-store')
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/index.html") as response:
+                self.assertIn(b'Plotly.react', response.read())
+        finally:
+            stop_server(server)
+
+
+if __name__ == '__main__':
+    unittest.main()
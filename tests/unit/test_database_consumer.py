@@ -14,8 +14,8 @@ class TestDatabaseConsumer(unittest.TestCase):
         clearing and 'forgetting' the queue
         closing the channel
         """
-        self.database_consumer.channel.queue_purge(queue='database_to_graph')
-        self.database_consumer.channel.close()
+        self.database_consumer.transport.purge('database_to_graph')
+        self.database_consumer.transport.close()
 
     def test_publish(self):
         """
@@ -3,6 +3,7 @@ import pandas
 import unittest
 from src.database_handler import DatabaseHandler
 database_path = os.path.normpath(os.path.pardir + os.path.join('/dummy_database/dummy.db'))
+wal_database_path = os.path.normpath(os.path.pardir + os.path.join('/dummy_database/dummy_wal.db'))
 table_name = "invoices_dummy"
 
 
@@ -75,6 +76,30 @@ class TestDatabaseHandler(unittest.TestCase):
         # 2
         self.assertFalse(results)
 
+    def test_insert_chunks(self):
+        """
+        1. inserting good data in chunks of 2 rows and expecting 3 rows
+        2. inserting bad data in chunks, the exception is caught and 0 is returned from database_handler
+        3. a conditional pair is executed only if the pair it refers to changed rows
+        """
+        query, data = set_insert_many()
+        results = self.database_connection.insert_chunks([[(query, data[:2])], [(query, data[2:])]])
+        # 1
+        self.assertEqual(results, "Inserted 3 Records")
+        self.database_connection.connect()
+        bad_query = set_bad_insert_many()
+        results = self.database_connection.insert_chunks([[(bad_query, data)]])
+        # 2
+        self.assertFalse(results)
+        self.database_connection.connect()
+        results = self.database_connection.insert_chunks([[('''DELETE FROM ''' + table_name + '''
+                WHERE InvoiceId < 0''', [()]), (bad_query, data, 0)]])
+        # 3
+        self.assertTrue(results)
+        self.database_connection.connect()
+        self.assertFalse(self.database_connection.insert_chunks([[('''DELETE FROM ''' + table_name, [()]),
+                                                                  (bad_query, data, 0)]]))
+
     def test_to_dataframe(self):
         """
         1. inserting good data and trying to retrieve some columns and turn it into dataframe
@@ -106,6 +131,91 @@ class TestDatabaseHandler(unittest.TestCase):
         self.assertFalse(results)
         self.database_connection.clear_table('''DROP TABLE IF EXISTS dummy''')
 
+    def test_persistent(self):
+        """
+        1. selecting twice with a persistent object without connecting again in between
+        2. connecting a persistent object again keeps the same connection
+        3. losing the connection, ensure_connection reconnects and the object is usable again
+        """
+        persistent_connection = DatabaseHandler(database_path, persistent=True)
+        connection = persistent_connection.connect()
+        insert_dummy_data(self.database_connection)
+        persistent_connection.select('''SELECT COUNT(*) FROM ''' + table_name)
+        results = persistent_connection.select('''SELECT COUNT(*) FROM ''' + table_name)[0][0]
+        # 1
+        self.assertEqual(results, 3)
+        # 2
+        self.assertIs(persistent_connection.connect(), connection)
+        connection.close()
+        persistent_connection.ensure_connection()
+        results = persistent_connection.select('''SELECT COUNT(*) FROM ''' + table_name)[0][0]
+        # 3
+        self.assertEqual(results, 3)
+        persistent_connection.close()
+
+    def test_profile(self):
+        """
+        1. connecting with the balanced profile switches the database to the write ahead log
+        2. the synchronous level of the balanced profile is NORMAL (1)
+        3. trying a profile which doesn't exist raises KeyError
+        """
+        profile_connection = DatabaseHandler(wal_database_path, profile='balanced')
+        profile_connection.connect()
+        # 1
+        self.assertEqual(profile_connection.connection.execute('''PRAGMA journal_mode''').fetchone()[0], 'wal')
+        # 2
+        self.assertEqual(profile_connection.connection.execute('''PRAGMA synchronous''').fetchone()[0], 1)
+        profile_connection.close()
+        # 3
+        with self.assertRaises(KeyError):
+            DatabaseHandler(wal_database_path, profile='turbo')
+
+    def test_table_exists(self):
+        """
+        1. checking the table of all tests exists
+        2. checking a table which was never created doesn't exist
+        """
+        # 1
+        self.assertTrue(self.database_connection.table_exists(table_name))
+        # 2
+        self.assertFalse(self.database_connection.table_exists('dummy_missing'))
+
+    def test_fill_table(self):
+        """
+        1. inserting dummy data, then filling a second table from it and expecting 3 rows
+        2. trying to fill from a table which doesn't exist, exception get caught
+        """
+        insert_dummy_data(self.database_connection)
+        self.database_connection.create_table(create_table_query())
+        results = self.database_connection.fill_table('''INSERT INTO dummy SELECT * FROM ''' + table_name)
+        # 1
+        self.assertEqual(results, "Filled 3 Rows")
+        results = self.database_connection.fill_table('''INSERT INTO dummy SELECT * FROM dummy_missing''')
+        # 2
+        self.assertFalse(results)
+        self.database_connection.clear_table('''DROP TABLE IF EXISTS dummy''')
+
+    def test_create_index(self):
+        """
+        1. creating an index on the table of all tests
+        2. trying to create again same index, exception get caught
+        3. dropping the index
+        4. trying to drop again same index, exception get caught
+        """
+        query = '''CREATE INDEX dummy_index ON ''' + table_name + ''' (InvoiceDate)'''
+        results = self.database_connection.create_index(query)
+        # 1
+        self.assertEqual(results, "1 Index Created Successfully")
+        results = self.database_connection.create_index(query)
+        # 2
+        self.assertFalse(results)
+        results = self.database_connection.drop_index('''DROP INDEX dummy_index''')
+        # 3
+        self.assertEqual(results, "1 Index Dropped Successfully")
+        results = self.database_connection.drop_index('''DROP INDEX dummy_index''')
+        # 4
+        self.assertFalse(results)
+
     def test_clear_table(self):
         """
         1. inserting dummy data. then trying to delete all rows
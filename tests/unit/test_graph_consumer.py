@@ -0,0 +1,94 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import src.graph_consumer as graph_consumer
+from src import metrics
+from src.message import Message, encode_message
+from src.graph_consumer import GraphConsumer
+from src.transport import MemoryBroker, MemoryTransport, poll_interval
+
+
+class TestGraphConsumer(unittest.TestCase):
+    def setUp(self):
+        """
+        replacing the graph refresh with one which only records the tables,
+        and connecting the consumer to a broker and a database of its own
+        """
+        self.directory = tempfile.mkdtemp()
+        self.refreshed = []
+        self.refresh_graph = graph_consumer.refresh_graph
+        graph_consumer.refresh_graph = lambda table_name, database_connection, output: self.refreshed.append(
+            table_name)
+        self.metrics_directory = metrics.metrics_directory
+        metrics.metrics_directory = None
+        self.broker = MemoryBroker()
+        self.transport = MemoryTransport(self.broker)
+        self.thread = None
+
+    def tearDown(self):
+        """
+        stopping the consumer, then restoring the graph refresh and removing the database
+        """
+        if self.thread:
+            self.transport.add_callback_threadsafe(self.transport.stop_consuming)
+            self.thread.join()
+        self.transport.close()
+        graph_consumer.refresh_graph = self.refresh_graph
+        metrics.metrics_directory = self.metrics_directory
+        shutil.rmtree(self.directory)
+
+    def start(self, **kwargs):
+        """
+        running the consumer on its own thread, its __init__ consumes until stop_consuming
+        """
+        kwargs.update(transport=self.transport, output='html',
+                      _database_path=os.path.join(self.directory, 'graph.db'))
+        self.thread = threading.Thread(target=GraphConsumer, kwargs=kwargs, daemon=True)
+        self.thread.start()
+
+    def wait_settled(self, count: int, timeout: float = 10.0):
+        """
+        waiting until count notifications are acknowledged
+        """
+        deadline = time.monotonic() + timeout
+        while self.transport.settled < count and time.monotonic() < deadline:
+            time.sleep(poll_interval / 10)
+
+    def test_coalesce(self):
+        """
+        1. five notifications of one table rebuild its graph once
+        2. all of them are acknowledged at once, none is left in the queue
+        """
+        for _ in range(5):
+            self.transport.publish('database_to_graph', encode_message(Message('', 'csv', 'invoices',
+                                                                                enqueued_at=time.time())))
+        self.start(coalesce_interval=0.5)
+        self.wait_settled(5)
+        # 1
+        self.assertEqual(self.refreshed, ['invoices'])
+        # 2
+        self.assertEqual(self.transport.settled, 5)
+        self.assertEqual(self.transport.unacked, {})
+        self.assertEqual(self.transport.message_count('database_to_graph'), 0)
+
+    def test_coalesce_count(self):
+        """
+        1. reaching coalesce_count rebuilds every pending table without waiting for the interval
+        """
+        for table_name in ['invoices', 'invoices', 'invoices_2010', 'invoices']:
+            self.transport.publish('database_to_graph', encode_message(Message('', 'csv', table_name,
+                                                                                enqueued_at=time.time())))
+        start = time.monotonic()
+        self.start(coalesce_interval=60.0, coalesce_count=4)
+        self.wait_settled(4)
+        # 1
+        self.assertEqual(sorted(self.refreshed), ['invoices', 'invoices_2010'])
+        self.assertEqual(self.transport.settled, 4)
+        self.assertLess(time.monotonic() - start, 60.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import os
 import unittest
-from src.main import create_metadata, check_path, check_type, check_same_table_list
+from src.main import create_metadata, check_path, check_type, check_same_table_list, split_file
+csv_path = os.path.normpath(os.path.dirname(__file__) + os.path.join('/../local/dummy_files/invoices_2011.csv'))
 
 
 def get_path_list() -> list:
@@ -41,10 +42,19 @@ class TestMain(unittest.TestCase):
         """
         1. obtaining a bad list of items and checking the return is false
         2. same with good list to get true
+        3. every extension of the line delimited and the columnar types, an unknown type is false
         """
         bad_data = get_bad_type(self.data.copy())
+        # 1
         self.assertFalse(check_type(bad_data[0], bad_data[1]))
+        # 2
         self.assertTrue(check_type(self.data[0], self.data[1]))
+        # 3
+        for path, file_type in [('a.ndjson', 'ndjson'), ('a.jsonl', 'ndjson'), ('a.parquet', 'parquet'),
+                                ('a.arrow', 'arrow'), ('a.feather', 'arrow')]:
+            self.assertTrue(check_type(path, file_type))
+        self.assertFalse(check_type('a.json', 'ndjson'))
+        self.assertFalse(check_type('a.txt', 'txt'))
 
     def test_check_path(self):
         """
@@ -63,6 +73,24 @@ class TestMain(unittest.TestCase):
         self.assertTrue(check_same_table_list(get_path_list()))
         self.assertFalse(check_same_table_list(get_bad_path_list()))
 
+    def test_split_file(self):
+        """
+        1. the ranges cover the whole file without gaps
+        2. every range ends on a line boundary
+        3. a shard size bigger than the file gives one range
+        """
+        ranges = split_file(csv_path, 100)
+        # 1
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(csv_path))
+        self.assertTrue(all(ranges[i][1] == ranges[i + 1][0] for i in range(len(ranges) - 1)))
+        # 2
+        with open(csv_path, 'rb') as file:
+            content = file.read()
+        self.assertTrue(all(content[end - 1:end] == b'\n' for _, end in ranges[:-1]))
+        # 3
+        self.assertEqual(split_file(csv_path, 1 << 20), [(0, os.path.getsize(csv_path))])
+
 
 # setup methods
 def get_bad_type(item: list) -> list:
@@ -0,0 +1,57 @@
+import os
+import unittest
+from src.message import Message, create_message, encode_message, decode_message, describe, hash_file
+base_path = os.path.normpath(os.path.dirname(__file__) + os.path.join('/../local/dummy_files'))
+file_path = base_path + os.path.join('/invoices_2011.csv')
+
+
+class TestMessage(unittest.TestCase):
+
+    def test_encode_decode(self):
+        """
+        1. encoding and decoding a message with a path holding spaces gives back the same message
+        2. the encoded message is bytes
+        3. describing the encoded message gives back 'path type table'
+        """
+        message = Message("C:/Users/barel/My Files/invoices 2009.json", "json", "invoices",
+                          1024, "abcd", 10, 20, 1600000000.5)
+        encoded = encode_message(message)
+        # 1
+        self.assertEqual(decode_message(encoded), message)
+        # 2
+        self.assertIs(type(encoded), bytes)
+        # 3
+        self.assertEqual(describe(encoded), "C:/Users/barel/My Files/invoices 2009.json json invoices")
+
+    def test_legacy(self):
+        """
+        1. decoding a legacy 'path type table' message, the path holds spaces
+        2. decoding a legacy 'table' message of the database consumer
+        3. describing a legacy message gives back the text
+        """
+        message = decode_message(b"C:/My Files/invoices 2009.json json invoices")
+        # 1
+        self.assertEqual(message, Message("C:/My Files/invoices 2009.json", "json", "invoices"))
+        # 2
+        self.assertEqual(decode_message(b"invoices").table_name, "invoices")
+        # 3
+        self.assertEqual(describe(b"Testing!"), "Testing!")
+
+    def test_create_message(self):
+        """
+        1. the size of an existing file is filled
+        2. the hash is filled only when asked, the same as hash_file
+        3. a path which doesn't exist gets size 0
+        """
+        message = create_message(file_path, "csv", "invoices")
+        # 1
+        self.assertEqual(message.file_size, os.path.getsize(file_path))
+        self.assertEqual(message.content_hash, '')
+        # 2
+        self.assertEqual(create_message(file_path, "csv", "invoices", True).content_hash, hash_file(file_path))
+        # 3
+        self.assertEqual(create_message(file_path + "21", "csv", "invoices").file_size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
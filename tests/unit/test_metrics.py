@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+import urllib.request
+from src.metrics import Registry, Exporter, write_metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        """
+        creating a registry of its own, the registry of the process is shared by the modules
+        """
+        self.registry = Registry(buckets=(0.1, 1.0))
+
+    def test_render(self):
+        """
+        1. a counter is rendered with its labels, escaped
+        2. a histogram is rendered with cumulative buckets, the sum and the count
+        3. every metric is described once
+        """
+        self.registry.increment('invoices_rows_total', 5, table='in"voices')
+        self.registry.observe('invoices_stage_seconds', 0.05, stage='read')
+        self.registry.observe('invoices_stage_seconds', 0.5, stage='read')
+        text = self.registry.render()
+        # 1
+        self.assertIn('invoices_rows_total{table="in\\"voices"} 5\n', text)
+        # 2
+        self.assertIn('invoices_stage_seconds_bucket{stage="read",le="0.1"} 1\n', text)
+        self.assertIn('invoices_stage_seconds_bucket{stage="read",le="1.0"} 2\n', text)
+        self.assertIn('invoices_stage_seconds_bucket{stage="read",le="+Inf"} 2\n', text)
+        self.assertIn('invoices_stage_seconds_sum{stage="read"} 0.55\n', text)
+        self.assertIn('invoices_stage_seconds_count{stage="read"} 2\n', text)
+        # 3
+        self.assertEqual(text.count('# TYPE invoices_stage_seconds histogram'), 1)
+
+    def test_timers(self):
+        """
+        1. the with block is observed, also when it raises
+        2. every item of the iterable is observed, not the end of it
+        """
+        with self.registry.timer('invoices_stage_seconds', stage='commit'):
+            pass
+        with self.assertRaises(ValueError):
+            with self.registry.timer('invoices_stage_seconds', stage='commit'):
+                raise ValueError
+        # 1
+        self.assertIn('invoices_stage_seconds_count{stage="commit"} 2\n', self.registry.render())
+        items = list(self.registry.timed(iter([1, 2, 3]), 'invoices_stage_seconds', stage='read'))
+        # 2
+        self.assertEqual(items, [1, 2, 3])
+        self.assertIn('invoices_stage_seconds_count{stage="read"} 3\n', self.registry.render())
+
+    def test_export(self):
+        """
+        1. writing the metrics file
+        2. the exporter serves the metrics over http, and writes the file once more when stopped
+        """
+        self.registry.increment('invoices_messages_total', consumer='graph_consumer', outcome='acknowledged')
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'metrics.prom')
+            write_metrics(file_path, self.registry)
+            with open(file_path) as file:
+                # 1
+                self.assertEqual(file.read(), self.registry.render())
+            exporter = Exporter('test', port=0, directory=directory, interval=60, metrics_registry=self.registry)
+            exporter.stop()
+            # 2
+            self.assertTrue(os.path.isfile(os.path.join(directory, f"test_{os.getpid()}.prom")))
+        exporter = Exporter('test', port=18765, directory='', metrics_registry=self.registry)
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:18765/metrics') as response:
+                self.assertEqual(response.read().decode(), self.registry.render())
+        finally:
+            exporter.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,8 +14,8 @@ class TestProducer(unittest.TestCase):
         clearing and 'forgetting' the queue
         closing the channel
         """
-        self.producer.channel.queue_purge(queue='files_to_database')
-        self.producer.channel.close()
+        self.producer.transport.purge('files_to_database')
+        self.producer.transport.close()
 
     def test_publish(self):
         """
@@ -25,6 +25,18 @@ class TestProducer(unittest.TestCase):
         result = self.producer.publish(b"Testing!")
         self.assertEqual(result, "Sent Testing!")
 
+    def test_publish_batch(self):
+        """
+        1. publishing 2500 bytes strings in batches of 1000 and getting the count back
+        2. the queue holds all of them after the last commit
+        """
+        self.producer.declare()
+        result = self.producer.publish_batch((b"Testing!" for _ in range(2500)), 1000)
+        # 1
+        self.assertIn("Sent 2500 Messages", result)
+        # 2
+        self.assertEqual(self.producer.transport.message_count('files_to_database'), 2500)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from src.producer import Producer
+from src.transport import MemoryBroker, MemoryTransport
+
+
+class TestMemoryTransport(unittest.TestCase):
+    def setUp(self):
+        """
+        creating a broker and a transport connected to it
+        """
+        self.broker = MemoryBroker()
+        self.transport = MemoryTransport(self.broker)
+        self.transport.declare('files_to_database')
+        self.received = []
+
+    def tearDown(self):
+        """
+        closing the transport
+        """
+        self.transport.close()
+
+    def callback(self, channel, method, properties, body):
+        """
+        keeping the message, stopping after the third one
+        """
+        self.received.append((method.delivery_tag, method.redelivered, body))
+        if len(self.received) == 3:
+            channel.stop_consuming()
+
+    def test_publish_consume(self):
+        """
+        1. publishing with the producer and getting the correct string in return
+        2. the messages are delivered in order with increasing delivery tags
+        3. the acknowledged messages are settled and gone from the queue
+        """
+        result = Producer(self.transport).publish_batch(b"Testing %d!" % index for index in range(3))
+        # 1
+        self.assertIn("Sent 3 Messages", result)
+        self.transport.consume('files_to_database', self.callback)
+        self.transport.start_consuming()
+        # 2
+        self.assertEqual(self.received, [(1, False, b"Testing 0!"), (2, False, b"Testing 1!"),
+                                         (3, False, b"Testing 2!")])
+        self.transport.ack(3, multiple=True)
+        # 3
+        self.assertEqual(self.transport.settled, 3)
+        self.assertEqual(self.transport.message_count('files_to_database'), 0)
+
+    def test_prefetch(self):
+        """
+        1. only prefetch_count messages are delivered before they are acknowledged
+        2. a rejected message is delivered again, marked as redelivered, after the other messages
+        3. the unacknowledged messages go back to the queue when the transport is closed
+        """
+        for index in range(2):
+            self.transport.publish('files_to_database', b"Testing %d!" % index)
+        self.transport.qos(1)
+        self.transport.consume('files_to_database', self.callback)
+        self.transport.call_later(0.5, self.transport.stop_consuming)
+        self.transport.start_consuming()
+        # 1
+        self.assertEqual(self.received, [(1, False, b"Testing 0!")])
+        self.transport.nack(1, requeue=True)
+        self.transport.call_later(0.5, self.transport.stop_consuming)
+        self.transport.start_consuming()
+        self.transport.ack(2)
+        self.transport.start_consuming()
+        # 2
+        self.assertEqual(self.received[1:], [(2, False, b"Testing 1!"), (3, True, b"Testing 0!")])
+        self.transport.close()
+        # 3
+        self.assertEqual(self.transport.message_count('files_to_database'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()